@@ -0,0 +1,39 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.processing import cascade
+from src.processing.priority import make_budget
+from src.processing.depth import labelling_depth
+from src.utils.model_api import configure_model_runtime, log_usage_stats, build_router, stage_residency
+from src.utils.config import (TOPIC_DIR, TRIALS_XML_DIR, RESULTS_DIR, PROMPT_DIR, INITIAL_RETRIEVAL_DIR, MODEL_NAME,
+                              MODEL_PROVIDER, OPENAI_API_KEY, TOP_N, CASCADE_POLICY, MODEL_ROUTES, OLLAMA_KEEP_ALIVE,
+                              LABELLING_ORDER, LABELLING_CALL_BUDGET, LABELLING_TIME_BUDGET)
+
+
+def main():
+    print(f"Running coarse-to-fine labelling cascade with policy '{CASCADE_POLICY}'")
+    configure_model_runtime()
+    coarse_router = build_router(MODEL_ROUTES["coarse"], MODEL_PROVIDER, OPENAI_API_KEY)
+    fine_router = build_router(MODEL_ROUTES["fine"], MODEL_PROVIDER, OPENAI_API_KEY)
+    budget = make_budget(LABELLING_CALL_BUDGET, LABELLING_TIME_BUDGET)
+    with stage_residency([MODEL_NAME] + MODEL_ROUTES["coarse"] + MODEL_ROUTES["fine"], MODEL_PROVIDER, OLLAMA_KEEP_ALIVE):
+        cascade.run_cascade(
+            topic_dir=TOPIC_DIR,
+            xml_trials_dir=TRIALS_XML_DIR,
+            results_dir=RESULTS_DIR,
+            prompt_dir=PROMPT_DIR,
+            qrel_results_dir=INITIAL_RETRIEVAL_DIR,
+            model=MODEL_NAME,
+            top_n=labelling_depth(INITIAL_RETRIEVAL_DIR, TOP_N),
+            policy=CASCADE_POLICY,
+            provider=MODEL_PROVIDER,
+            api_key=OPENAI_API_KEY,
+            coarse_router=coarse_router,
+            fine_router=fine_router,
+            order=LABELLING_ORDER,
+            budget=budget
+        )
+    log_usage_stats({"coarse": coarse_router, "fine": fine_router}, budget)
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,32 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from src.processing import coarse_labelling
-from src.utils.config import TOPIC_DIR, TRIALS_XML_DIR, RESULTS_DIR, PROMPT_DIR, INITIAL_RETRIEVAL_DIR, MODEL_NAME, MODEL_PROVIDER, OPENAI_API_KEY, TOP_N
+from src.processing.priority import make_budget
+from src.processing.depth import labelling_depth
+from src.utils.model_api import configure_model_runtime, log_usage_stats, build_router, stage_residency
+from src.utils.config import TOPIC_DIR, TRIALS_XML_DIR, RESULTS_DIR, PROMPT_DIR, INITIAL_RETRIEVAL_DIR, MODEL_NAME, MODEL_PROVIDER, OPENAI_API_KEY, TOP_N, MODEL_ROUTES, OLLAMA_KEEP_ALIVE, LABELLING_ORDER, LABELLING_CALL_BUDGET, LABELLING_TIME_BUDGET
 
 
 def main():
-    coarse_labelling.coarse_labelling(
-        topic_dir=TOPIC_DIR,
-        xml_trials_dir=TRIALS_XML_DIR,
-        results_dir=RESULTS_DIR,
-        prompt_dir=PROMPT_DIR,
-        qrel_results_dir=INITIAL_RETRIEVAL_DIR,
-        model=MODEL_NAME,
-        top_n=TOP_N,
-        provider=MODEL_PROVIDER,
-        api_key=OPENAI_API_KEY
-    )
+    configure_model_runtime()
+    router = build_router(MODEL_ROUTES["coarse"], MODEL_PROVIDER, OPENAI_API_KEY)
+    budget = make_budget(LABELLING_CALL_BUDGET, LABELLING_TIME_BUDGET)
+    with stage_residency([MODEL_NAME] + MODEL_ROUTES["coarse"], MODEL_PROVIDER, OLLAMA_KEEP_ALIVE):
+        coarse_labelling.coarse_labelling(
+            topic_dir=TOPIC_DIR,
+            xml_trials_dir=TRIALS_XML_DIR,
+            results_dir=RESULTS_DIR,
+            prompt_dir=PROMPT_DIR,
+            qrel_results_dir=INITIAL_RETRIEVAL_DIR,
+            model=MODEL_NAME,
+            top_n=labelling_depth(INITIAL_RETRIEVAL_DIR, TOP_N),
+            provider=MODEL_PROVIDER,
+            api_key=OPENAI_API_KEY,
+            router=router,
+            order=LABELLING_ORDER,
+            budget=budget
+        )
+    log_usage_stats({"coarse": router}, budget)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,27 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils.cohort_retrieval import run_cohort_retrieval
+from src.utils.SNOMED_retrieval import load_ontology
+from src.utils.config import (COHORT_PATH, COHORT_RESULTS_DIR, COHORT_BATCH_SIZE, DEPTH, TRIALS_XML_DIR,
+                              MAPPED_CONDITIONS_PATH, TOKEN_CACHE_PATH, TRIAL_DEMOGRAPHICS_PATH,
+                              SAVE_RANKED_RETRIEVAL)
+
+
+def main():
+    SNOMEDCT_US = load_ontology()
+    run_cohort_retrieval(
+        cohort_path=COHORT_PATH,
+        conditions_mapping_path=MAPPED_CONDITIONS_PATH,
+        trials_xml_directory=TRIALS_XML_DIR,
+        output_directory=COHORT_RESULTS_DIR,
+        SNOMEDCT_US=SNOMEDCT_US,
+        depth=DEPTH,
+        batch_size=COHORT_BATCH_SIZE,
+        token_cache_path=TOKEN_CACHE_PATH,
+        demographics_path=TRIAL_DEMOGRAPHICS_PATH,
+        save_ranked=SAVE_RANKED_RETRIEVAL
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils.checkpoint import compact_checkpoint
+from src.utils.config import RESULTS_DIR
+
+
+def main():
+    # Fold the journals left by interrupted labelling runs into their JSON results files.
+    for file_name in ["processed_topics.json", "structured_trials.json", "coarse_labelling.json", "fine_labelling.json"]:
+        records = compact_checkpoint(os.path.join(RESULTS_DIR, file_name))
+        if records is not None:
+            print(f"{file_name}: compacted {records} journal records")
+
+if __name__ == "__main__":
+    main()
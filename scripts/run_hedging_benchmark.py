@@ -0,0 +1,35 @@
+import sys
+import os
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils.model_api import prompt_model, map_concurrent, enable_hedging, disable_hedging
+from src.utils.stand_in_server import start_stand_in_server, StandInSettings
+from src.utils.config import MAX_CONCURRENT_REQUESTS, HEDGE_PERCENTILE, HEDGE_BUDGET
+
+
+def latency_percentiles(prompts, host):
+    def timed(prompt):
+        start_time = time.time()
+        prompt_model(prompt, "stand-in", host=host, use_cache=False)
+        return time.time() - start_time
+
+    latencies = sorted(map_concurrent(timed, prompts, MAX_CONCURRENT_REQUESTS))
+    return {f"p{p}": round(latencies[int(p / 100 * (len(latencies) - 1))], 3) for p in (50, 95, 99)}
+
+
+def main():
+    # Latencies of the same prompts against a local server with a slow tail, without and with hedging.
+    settings = StandInSettings(latency=0.1, tail_probability=0.05, tail_latency=2.0)
+    server, _ = start_stand_in_server(settings=settings)
+    host = f"http://127.0.0.1:{server.server_address[1]}"
+    prompts = [f"Benchmark prompt {i}" for i in range(400)]
+
+    print(f"Without hedging: {latency_percentiles(prompts, host)}")
+    hedger = enable_hedging(HEDGE_PERCENTILE or 95, HEDGE_BUDGET)
+    print(f"With hedging: {latency_percentiles(prompts, host)}")
+    print(f"Hedging: {hedger.stats()}, server requests: {settings.requests}, cancelled: {settings.cancelled}")
+    disable_hedging()
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from src.utils.initial_retrieval import run_initial_retrieval
 from src.utils.SNOMED_retrieval import load_ontology
 from src.utils.config import (TREC_QRELS_PATH, TOPIC_DIR, RESULTS_DIR, DEPTH, TRIALS_XML_DIR,
-                              MAPPED_DIAGNOSES_PATH, MAPPED_CONDITIONS_PATH, STRUCTURED_TOPIC_DIR)
+                              MAPPED_DIAGNOSES_PATH, MAPPED_CONDITIONS_PATH, STRUCTURED_TOPIC_DIR,
+                              TOKEN_CACHE_PATH, PARALLEL_RANKING, BM25_STREAMING_THRESHOLD,
+                              TRIAL_DEMOGRAPHICS_PATH, DEMOGRAPHIC_PREFILTER, SAVE_RANKED_RETRIEVAL)
 
 
 def main():
@@ -18,7 +20,13 @@ def main():
         topic_directory=TOPIC_DIR,
         SNOMEDCT_US=SNOMEDCT_US,
         results_directory=RESULTS_DIR,
-        structured_topics_dir = STRUCTURED_TOPIC_DIR
+        structured_topics_dir = STRUCTURED_TOPIC_DIR,
+        token_cache_path=TOKEN_CACHE_PATH,
+        parallel_ranking=PARALLEL_RANKING,
+        streaming_threshold=BM25_STREAMING_THRESHOLD,
+        demographics_path=TRIAL_DEMOGRAPHICS_PATH,
+        demographic_prefilter=DEMOGRAPHIC_PREFILTER,
+        save_ranked=SAVE_RANKED_RETRIEVAL
     )
 
 if __name__ == "__main__":
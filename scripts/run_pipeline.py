@@ -0,0 +1,43 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.processing import pipeline
+from src.processing.priority import make_budget
+from src.processing.depth import labelling_depth
+from src.utils.model_api import configure_model_runtime, log_usage_stats, build_router, stage_residency
+from src.utils.config import (TOPIC_DIR, TRIALS_XML_DIR, RESULTS_DIR, PROMPT_DIR, INITIAL_RETRIEVAL_DIR, MODEL_NAME,
+                              MODEL_PROVIDER, OPENAI_API_KEY, TOP_N, MODEL_ROUTES, MAX_CONCURRENT_REQUESTS,
+                              PIPELINE_QUEUE_SIZE, OLLAMA_KEEP_ALIVE, LABELLING_ORDER, LABELLING_CALL_BUDGET,
+                              LABELLING_TIME_BUDGET)
+
+
+def main():
+    print("Running trial structuring, coarse labelling and fine labelling as a streaming pipeline")
+    configure_model_runtime()
+    routers = {stage: build_router(MODEL_ROUTES[stage], MODEL_PROVIDER, OPENAI_API_KEY)
+               for stage in ("trials", "coarse", "fine")}
+    models = [MODEL_NAME] + MODEL_ROUTES["trials"] + MODEL_ROUTES["coarse"] + MODEL_ROUTES["fine"]
+    budget = make_budget(LABELLING_CALL_BUDGET, LABELLING_TIME_BUDGET)
+    with stage_residency(models, MODEL_PROVIDER, OLLAMA_KEEP_ALIVE):
+        pipeline.run_pipeline(
+            topic_dir=TOPIC_DIR,
+            xml_trials_dir=TRIALS_XML_DIR,
+            results_dir=RESULTS_DIR,
+            prompt_dir=PROMPT_DIR,
+            qrel_results_dir=INITIAL_RETRIEVAL_DIR,
+            model=MODEL_NAME,
+            top_n=labelling_depth(INITIAL_RETRIEVAL_DIR, TOP_N),
+            provider=MODEL_PROVIDER,
+            api_key=OPENAI_API_KEY,
+            max_concurrency=MAX_CONCURRENT_REQUESTS,
+            queue_size=PIPELINE_QUEUE_SIZE,
+            trials_router=routers["trials"],
+            coarse_router=routers["coarse"],
+            fine_router=routers["fine"],
+            order=LABELLING_ORDER,
+            budget=budget
+        )
+    log_usage_stats(routers, budget)
+
+if __name__ == "__main__":
+    main()
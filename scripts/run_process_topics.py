@@ -2,18 +2,24 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from src.processing import topics
-from src.utils.config import TOPIC_PROMPT_PATH, TOPICS_XML_PATH, RESULTS_DIR, MODEL_NAME, MODEL_PROVIDER, OPENAI_API_KEY
+from src.utils.model_api import configure_model_runtime, log_usage_stats, build_router, stage_residency
+from src.utils.config import TOPIC_PROMPT_PATH, TOPICS_XML_PATH, RESULTS_DIR, MODEL_NAME, MODEL_PROVIDER, OPENAI_API_KEY, MODEL_ROUTES, OLLAMA_KEEP_ALIVE
 
 
 def main():
-    topics.process_topics(
-        topic_prompt_path=TOPIC_PROMPT_PATH,
-        topics_xml_path=TOPICS_XML_PATH,
-        results_dir=RESULTS_DIR,
-        model_name=MODEL_NAME,
-        provider=MODEL_PROVIDER,
-        api_key=OPENAI_API_KEY
-    )
+    configure_model_runtime()
+    router = build_router(MODEL_ROUTES["topics"], MODEL_PROVIDER, OPENAI_API_KEY)
+    with stage_residency([MODEL_NAME] + MODEL_ROUTES["topics"], MODEL_PROVIDER, OLLAMA_KEEP_ALIVE):
+        topics.process_topics(
+            topic_prompt_path=TOPIC_PROMPT_PATH,
+            topics_xml_path=TOPICS_XML_PATH,
+            results_dir=RESULTS_DIR,
+            model_name=MODEL_NAME,
+            provider=MODEL_PROVIDER,
+            api_key=OPENAI_API_KEY,
+            router=router
+        )
+    log_usage_stats({"topics": router})
 
 if __name__ == "__main__":
     main()
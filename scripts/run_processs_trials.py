@@ -2,20 +2,27 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from src.processing import trials
-from src.utils.config import INITIAL_RETRIEVAL_DIR, TRIALS_XML_DIR, RESULTS_DIR, PROMPT_DIR, MODEL_NAME, MODEL_PROVIDER, OPENAI_API_KEY, TOP_N
+from src.processing.depth import labelling_depth
+from src.utils.model_api import configure_model_runtime, log_usage_stats, build_router, stage_residency
+from src.utils.config import INITIAL_RETRIEVAL_DIR, TRIALS_XML_DIR, RESULTS_DIR, PROMPT_DIR, MODEL_NAME, MODEL_PROVIDER, OPENAI_API_KEY, TOP_N, MODEL_ROUTES, OLLAMA_KEEP_ALIVE
 
 
 def main():
-    trials.process_trials(
-        qrel_results_dir=INITIAL_RETRIEVAL_DIR,
-        xml_trials_dir=TRIALS_XML_DIR,
-        results_dir=RESULTS_DIR,
-        prompt_dir=PROMPT_DIR,
-        model=MODEL_NAME,
-        top_n=TOP_N,
-        provider=MODEL_PROVIDER,
-        api_key=OPENAI_API_KEY
-    )
+    configure_model_runtime()
+    router = build_router(MODEL_ROUTES["trials"], MODEL_PROVIDER, OPENAI_API_KEY)
+    with stage_residency([MODEL_NAME] + MODEL_ROUTES["trials"], MODEL_PROVIDER, OLLAMA_KEEP_ALIVE):
+        trials.process_trials(
+            qrel_results_dir=INITIAL_RETRIEVAL_DIR,
+            xml_trials_dir=TRIALS_XML_DIR,
+            results_dir=RESULTS_DIR,
+            prompt_dir=PROMPT_DIR,
+            model=MODEL_NAME,
+            top_n=labelling_depth(INITIAL_RETRIEVAL_DIR, TOP_N),
+            provider=MODEL_PROVIDER,
+            api_key=OPENAI_API_KEY,
+            router=router
+        )
+    log_usage_stats({"trials": router})
 
 if __name__ == "__main__":
     main()
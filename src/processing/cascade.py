@@ -0,0 +1,111 @@
+import os
+import logging
+from .trials import extract_top_trials
+from .coarse_labelling import coarse_labelling, coarse_decision
+from .fine_grained_labelling import (fine_grained_labelling, extract_categorised_criteria, extract_categorised_topics,
+                                     build_fine_labelling_prompts, load_fine_labelling_prompts, batch_distinct_criteria)
+from src.utils.json import load_json, save_json
+from src.utils.config import FINE_LABELLING_DEDUPLICATE, FINE_LABELLING_BATCH_SIZE
+
+CASCADE_POLICIES = ["full", "eligible_or_ambiguous", "eligible_only"]
+
+
+def select_fine_labelling_trials(coarse_labels, trials_by_topic, policy):
+    """
+    Returns the trials of each topic sent on to fine labelling under a cascade policy:
+        - "full": every trial, as in a run without the cascade
+        - "eligible_or_ambiguous": trials coarse-labelled eligible or with an ambiguous output
+        - "eligible_only": trials coarse-labelled eligible
+    Trials without a coarse label are always kept.
+    """
+    if policy not in CASCADE_POLICIES:
+        raise ValueError(f"Unknown cascade policy: {policy}. Choose one of {', '.join(CASCADE_POLICIES)}")
+    accepted = {"full": {"eligible", "excluded", "ambiguous"},
+                "eligible_or_ambiguous": {"eligible", "ambiguous"},
+                "eligible_only": {"eligible"}}[policy]
+    selected = {}
+    for topic_id, trial_ids in trials_by_topic.items():
+        topic_labels = coarse_labels.get(topic_id, {})
+        selected[topic_id] = [trial_id for trial_id in trial_ids
+                              if trial_id not in topic_labels or coarse_decision(topic_labels[trial_id]) in accepted]
+    return selected
+
+
+# What the fine labelling call counts of the cascade report cover.
+CALL_COUNT_NOTE = ("First attempts only: router escalations and the per-criterion fallback of deduplicated "
+                   "batches are not counted, and deduplicated batches are counted without the criterion "
+                   "label cache of earlier runs")
+
+
+def count_fine_labelling_calls(trials_by_topic, structured_trials, topics, prompt_bases, deduplicate=None,
+                               batch_size=None):
+    """
+    Counts the model calls fine labelling makes for the given trials before any escalation:
+    one per non-empty criteria category, or with deduplicate (default:
+    FINE_LABELLING_DEDUPLICATE) one per batch of distinct criteria (see
+    batch_distinct_criteria).
+    """
+    if deduplicate is None:
+        deduplicate = FINE_LABELLING_DEDUPLICATE
+    if batch_size is None:
+        batch_size = FINE_LABELLING_BATCH_SIZE
+    jobs = []
+    for topic_id, trial_ids in trials_by_topic.items():
+        topic = topics.get(topic_id, {})
+        for trial_id in trial_ids:
+            raw_trial = structured_trials.get(trial_id)
+            if raw_trial is not None:
+                trial = extract_categorised_criteria(raw_trial)
+                jobs.append((topic_id, trial_id, build_fine_labelling_prompts(topic, trial, prompt_bases)))
+    if deduplicate:
+        return len(batch_distinct_criteria(jobs, batch_size)[0])
+    return sum(len(requests) for _, _, requests in jobs)
+
+
+def run_cascade(topic_dir, xml_trials_dir, results_dir, prompt_dir, qrel_results_dir, model, top_n, policy="full",
+                provider=None, api_key=None, max_concurrency=None, coarse_router=None, fine_router=None, order=None,
+                budget=None):
+    """
+    Runs coarse labelling on every top_n trial (top_n may be a per-topic depth map), then fine labelling only on the trials the
+    policy keeps. Trials skipped for a topic are saved to 'cascade_skipped.json', so that
+    hybrid re-ranking scores them on their coarse label alone until fine labelling runs
+    without the cascade, and the number of fine labelling calls each policy needs (see
+    count_fine_labelling_calls) is saved to 'cascade_report.json'.
+
+    Structured trials ('structured_trials.json') and processed topics must already exist.
+    Both stages send their work in the given order and share the budget (see priority).
+    """
+    qrel_results_path = os.path.join(qrel_results_dir, "qrel.txt")
+    trials_by_topic, _ = extract_top_trials(qrel_results_path, top_n)
+
+    coarse_labelling(topic_dir, xml_trials_dir, results_dir, prompt_dir, qrel_results_dir, model, top_n,
+                     provider=provider, api_key=api_key, max_concurrency=max_concurrency, router=coarse_router,
+                     order=order, budget=budget)
+    coarse_labels = load_json(os.path.join(results_dir, "coarse_labelling.json"))
+
+    structured_trials = load_json(os.path.join(results_dir, "structured_trials.json"))
+    topics = extract_categorised_topics(load_json(os.path.join(results_dir, "processed_topics.json")))
+    prompt_bases = load_fine_labelling_prompts(prompt_dir)
+
+    report = {"policy": policy, "call_counts": CALL_COUNT_NOTE, "policies": {}}
+    full_calls = None
+    for candidate_policy in CASCADE_POLICIES:
+        selected = select_fine_labelling_trials(coarse_labels, trials_by_topic, candidate_policy)
+        calls = count_fine_labelling_calls(selected, structured_trials, topics, prompt_bases)
+        full_calls = calls if full_calls is None else full_calls
+        report["policies"][candidate_policy] = {
+            "fine_labelled_trials": sum(len(trial_ids) for trial_ids in selected.values()),
+            "fine_labelling_calls": calls,
+            "saved_calls": full_calls - calls,
+        }
+        logging.info(f"Cascade policy '{candidate_policy}': {calls} fine labelling calls, {full_calls - calls} saved")
+    save_json(report, os.path.join(results_dir, "cascade_report.json"))
+
+    selected = select_fine_labelling_trials(coarse_labels, trials_by_topic, policy)
+    skipped = {topic_id: [trial_id for trial_id in trial_ids if trial_id not in selected[topic_id]]
+               for topic_id, trial_ids in trials_by_topic.items()}
+    save_json(skipped, os.path.join(results_dir, "cascade_skipped.json"))
+
+    fine_grained_labelling(qrel_results_dir, results_dir, prompt_dir, model, top_n, provider=provider,
+                           api_key=api_key, max_concurrency=max_concurrency, trials_by_topic=selected,
+                           router=fine_router, order=order, budget=budget)
@@ -1,24 +1,122 @@
 import os
+import re
 import time
 import logging
+from itertools import takewhile
 from .trials import extract_top_trials
+from .prompt_layout import layout_prompt
+from .token_budget import criteria_budget, chunk_sections
+from .priority import order_pairs
 from src.utils.xml_parsing import xml_processing
-from src.utils.json import load_json, save_json
-from src.utils.model_api import prompt_model
-from src.utils.config import MODEL_PROVIDER, MODEL_NAME, OPENAI_API_KEY
+from src.utils.json import load_json
+from src.utils.checkpoint import CheckpointJournal
+from src.utils.model_api import prompt_model, map_concurrent
+from src.utils.config import MODEL_PROVIDER, MODEL_NAME, OPENAI_API_KEY, MAX_CONCURRENT_REQUESTS, GENERATION_LIMITS, PROMPT_TOKEN_BUDGETS
 
 # Configure logging for detailed output.
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-def generate_coarse_labelling(prompt_base, inclusion, exclusion, topic_description, model, provider=None, api_key=None):
-    prompt = f"{prompt_base}\n{inclusion}\n{exclusion}\n(Patient profile):\n{topic_description}"
+def coarse_decision(text):
+    """
+    Classifies a coarse labelling output as 'eligible', 'excluded' or 'ambiguous'.
+    An output is ambiguous when it has no explicit label, or labels both ways; these are
+    the outputs process_trial_text can only resolve through its fallbacks.
+    """
+    labels = {label.strip().lower() for label in re.findall(r"""['"]label['"]\s*:\s*['"](.*?)['"]""", text)}
+    negative = bool(labels & {"excluded", "not eligible"})
+    positive = bool(labels - {"excluded", "not eligible"})
+    if positive and negative or not labels:
+        return "ambiguous"
+    return "excluded" if negative else "eligible"
+
+
+def has_coarse_label(text):
+    """
+    Checks that a (possibly partial) coarse labelling output holds an unambiguous label.
+    """
+    return coarse_decision(text) != "ambiguous"
+
+
+def merge_coarse_outputs(outputs):
+    """
+    Merges the labelling outputs of the criteria chunks of one trial: the trial is excluded
+    if any chunk excludes it, and eligible only if every chunk finds it eligible. Returns
+    the output of the first excluding chunk, else of the first ambiguous one, else the first.
+    """
+    decisions = [coarse_decision(output) for output in outputs]
+    for decision in ("excluded", "ambiguous"):
+        if decision in decisions:
+            return outputs[decisions.index(decision)]
+    return outputs[0]
+
+
+def generate_coarse_labelling(prompt_base, inclusion, exclusion, topic_description, model, provider=None, api_key=None,
+                              router=None, layout=None, system_message=None, max_tokens=None, stop=None,
+                              early_stop=None, token_budget=None, budget=None):
+    """
+    Labels a trial for a patient profile. max_tokens, stop and early_stop default to
+    GENERATION_LIMITS["coarse"]; with early_stop, generation ends at the first label.
+
+    Criteria that would take the prompt past token_budget estimated tokens (default:
+    PROMPT_TOKEN_BUDGETS["coarse"]) are labelled in chunks, one after another so a trial
+    takes a single slot of the caller's concurrency, and the chunk outputs merged with
+    merge_coarse_outputs.
+
+    The caller acquires the coarse_labelling_calls calls of the trial; with a router, its
+    escalations take their calls from budget (LabellingBudget).
+    """
+    limits = GENERATION_LIMITS["coarse"]
+    max_tokens = limits.get("max_tokens") if max_tokens is None else max_tokens
+    stop = limits.get("stop") if stop is None else stop
+    early_stop = limits.get("early_stop") if early_stop is None else early_stop
+    generation = {"max_tokens": max_tokens, "stop": stop, "early_stop": has_coarse_label if early_stop else None}
+    if token_budget is None:
+        token_budget = PROMPT_TOKEN_BUDGETS["coarse"]
     if provider is None:
         provider = MODEL_PROVIDER
     if api_key is None:
         api_key = OPENAI_API_KEY
-    return prompt_model(prompt, model, provider=provider, api_key=api_key)
-
-def coarse_labelling(topic_dir, xml_trials_dir, results_dir, prompt_dir, qrel_results_dir, model, top_n, provider=None, api_key=None):
+    profile_block = coarse_profile_block(topic_description)
+
+    def label(chunk):
+        chunk_inclusion, chunk_exclusion = chunk
+        system, prompt = layout_prompt(prompt_base, f"\n{chunk_inclusion}\n{chunk_exclusion}", profile_block,
+                                       layout, system_message)
+        if router is not None:
+            # Escalate to a larger model when the label is missing or contradictory.
+            return router.prompt(prompt, validator=has_coarse_label, system=system, budget=budget, **generation)
+        return prompt_model(prompt, model, provider=provider, api_key=api_key, system=system, **generation)
+
+    chunks = chunk_sections([inclusion, exclusion], criteria_budget(token_budget, prompt_base, profile_block))
+    if len(chunks) == 1:
+        return label((inclusion, exclusion))
+    return merge_coarse_outputs([label(chunk) for chunk in chunks])
+
+
+def coarse_profile_block(topic_description):
+    return f"\n(Patient profile):\n{topic_description}"
+
+
+def coarse_labelling_calls(prompt_base, inclusion, exclusion, topic_description, token_budget=None):
+    """
+    Returns the model calls generate_coarse_labelling makes for a trial before any
+    escalation: one per criteria chunk.
+    """
+    if token_budget is None:
+        token_budget = PROMPT_TOKEN_BUDGETS["coarse"]
+    profile_block = coarse_profile_block(topic_description)
+    return len(chunk_sections([inclusion, exclusion], criteria_budget(token_budget, prompt_base, profile_block)))
+
+def coarse_labelling(topic_dir, xml_trials_dir, results_dir, prompt_dir, qrel_results_dir, model, top_n, provider=None, api_key=None,
+                     max_concurrency=None, router=None, layout=None, system_message=None, order=None, budget=None):
+    """
+    Coarse-labels the top_n trials of every topic (top_n may map each topic to its own depth,
+    see depth.labelling_depth). Pairs are sent in the given order (see
+    priority.order_pairs); with a budget (LabellingBudget), the calls of each label (one per
+    criteria chunk, see coarse_labelling_calls) are acquired before it is sent, router
+    escalations take further calls, and labelling stops once the budget is exhausted, leaving
+    the remaining pairs for the next run.
+    """
     qrel_results_path = os.path.join(qrel_results_dir, "qrel.txt")
     topic_trials, _ = extract_top_trials(qrel_results_path, top_n)
     output_path = os.path.join(results_dir, "coarse_labelling.json")
@@ -28,10 +126,11 @@ def coarse_labelling(topic_dir, xml_trials_dir, results_dir, prompt_dir, qrel_re
     with open(prompt_path, 'r') as f:
         prompt_base = f.read()
 
-    if os.path.exists(output_path):
-        coarse_labels = load_json(output_path)
-    else:
-        coarse_labels = {topic_id: {} for topic_id in topic_trials.keys()}
+    # Labels are checkpointed to an append-only journal and resumed from it.
+    journal = CheckpointJournal(output_path)
+    coarse_labels = journal.state
+    for topic_id in topic_trials.keys():
+        coarse_labels.setdefault(topic_id, {})
 
     # Calculate total number of trials to process for progress logging.
     total_trials = sum(len(trials) for trials in topic_trials.values())
@@ -39,38 +138,52 @@ def coarse_labelling(topic_dir, xml_trials_dir, results_dir, prompt_dir, qrel_re
     overall_counter = 0
     overall_start_time = time.time()
 
-    for topic_id, trials in topic_trials.items():
-        topic_description = topic_description_dict.get(topic_id, "No topic description found")
-        for trial_id in trials:
-
-            if trial_id in coarse_labels[topic_id]:
-                overall_counter += 1
-                continue
-
-            trial_start_time = time.time()
-            trial_file_path = os.path.join(xml_trials_dir, trial_id + ".xml")
-            if not os.path.exists(trial_file_path):
-                logging.warning(f"Trial {trial_id} does not exist in the trials directory")
-                continue
+    # Collect the (topic, trial) pairs still to label; their model calls then run concurrently,
+    # by default topic by topic, so that consecutive prompts share the topic's profile.
+    requests = []
+    for topic_id, trial_id in order_pairs(topic_trials, order):
+        if trial_id in coarse_labels.get(topic_id, {}):
+            overall_counter += 1
+            continue
 
-            try:
-                inclusion, exclusion, _ = xml_processing(trial_file_path)
-            except Exception as e:
-                logging.error(f"Error processing XML for trial {trial_id}: {e}")
+        trial_file_path = os.path.join(xml_trials_dir, trial_id + ".xml")
+        if not os.path.exists(trial_file_path):
+            logging.warning(f"Trial {trial_id} does not exist in the trials directory")
+            continue
+        topic_description = topic_description_dict.get(topic_id, "No topic description found")
+        requests.append((topic_id, trial_id, topic_description, trial_file_path))
+
+    def label(request):
+        topic_id, trial_id, topic_description, trial_file_path = request
+        if budget is not None and budget.exhausted():
+            return None
+        try:
+            inclusion, exclusion, _ = xml_processing(trial_file_path)
+        except Exception as e:
+            logging.error(f"Error processing XML for trial {trial_id}: {e}")
+            return None
+        calls = coarse_labelling_calls(prompt_base, inclusion, exclusion, topic_description)
+        if budget is not None and not budget.acquire(calls):
+            return None
+        return generate_coarse_labelling(prompt_base, inclusion, exclusion, topic_description, model, provider, api_key,
+                                         router, layout, system_message, budget=budget)
+
+    if max_concurrency is None:
+        max_concurrency = MAX_CONCURRENT_REQUESTS
+    scheduled = requests if budget is None else takewhile(lambda _: not budget.exhausted(), requests)
+    with journal:
+        for (topic_id, trial_id, _, _), label_text in zip(requests, map_concurrent(label, scheduled, max_concurrency)):
+            if label_text is None:
                 continue
-
-            label = generate_coarse_labelling(prompt_base, inclusion, exclusion, topic_description, model, provider, api_key)
-            if topic_id not in coarse_labels:
-                coarse_labels[topic_id] = {}
-            coarse_labels[topic_id][trial_id] = label
+            journal.record([topic_id, trial_id], label_text)
 
             overall_counter += 1
-            processing_time = time.time() - trial_start_time
             overall_progress = (overall_counter / total_trials) * 100
-            logging.info(f"Trial {trial_id} processed in {processing_time:.2f} seconds - {overall_progress:.2f}% complete")
-            save_json(coarse_labels, output_path)
+            logging.info(f"Trial {trial_id} processed - {overall_progress:.2f}% complete")
 
     total_elapsed = time.time() - overall_start_time
+    if budget is not None and budget.exhausted():
+        logging.info(f"Labelling budget exhausted after {overall_counter} of {total_trials} trials: {budget.stats()}")
     logging.info(f"All trials processed in {total_elapsed:.2f} seconds")
 
 
@@ -0,0 +1,100 @@
+import os
+import logging
+from src.utils.config import TOP_N, ADAPTIVE_DEPTH_CALL_BUDGET, ADAPTIVE_DEPTH_CALLS_PER_TRIAL, ADAPTIVE_DEPTH_MIN
+
+
+def read_retrieval_scores(file_path):
+    """
+    Reads the retrieval scores of a run file, per topic in rank order.
+
+    Returns:
+        dict: topic_id -> list of (trial_id, score) pairs.
+    """
+    ranked = {}
+    with open(file_path, 'r') as f:
+        for line in f:
+            parts = line.strip().split()
+            if len(parts) < 5:
+                continue
+            try:
+                rank, score = int(parts[3]), float(parts[4])
+            except ValueError:
+                logging.warning(f"Invalid rank or score in line: {line.strip()}")
+                continue
+            ranked.setdefault(parts[0], []).append((rank, parts[2], score))
+    return {topic_id: [(trial_id, score) for _, trial_id, score in sorted(entries)]
+            for topic_id, entries in ranked.items()}
+
+
+def normalize_scores(scores):
+    """
+    Normalizes a topic's scores (in rank order) by its top score, so 1.0 is the best trial and
+    a score cliff shows as a drop towards 0. Scores are made non-increasing in rank.
+    """
+    top = max(scores, default=0)
+    if top <= 0:
+        return [1.0] * len(scores)
+    normalized = []
+    for score in scores:
+        normalized.append(min(score / top, normalized[-1] if normalized else 1.0))
+    return normalized
+
+
+def adaptive_depths(scores_by_topic, call_budget, calls_per_trial=1, min_depth=1, max_depth=None):
+    """
+    Chooses how many of its top trials each topic labels within a budget of model calls.
+
+    Every topic gets min_depth trials; the rest of the budget goes to the trials with the
+    highest normalized retrieval scores across all topics. A topic whose scores fall off a
+    cliff after a few trials therefore stops there, while a topic with many near-ties gets
+    labels for all of them, where re-ranking can change its order.
+
+    Parameters:
+        scores_by_topic (dict): topic_id -> retrieval scores in rank order.
+        call_budget (int): Target number of model calls.
+        calls_per_trial (float): Model calls labelling one (topic, trial) pair takes.
+        min_depth (int): Trials every topic labels.
+        max_depth (int): Trials a topic labels at most (default: no limit).
+
+    Returns:
+        dict: topic_id -> labelling depth.
+    """
+    limits = {topic_id: len(scores) if max_depth is None else min(len(scores), max_depth)
+              for topic_id, scores in scores_by_topic.items()}
+    depths = {topic_id: min(min_depth, limit) for topic_id, limit in limits.items()}
+    slots = int(call_budget // calls_per_trial) - sum(depths.values())
+    if slots < 0:
+        logging.warning(f"A call budget of {call_budget} is below the minimum depth of every topic")
+    candidates = sorted((-value, rank, topic_id)
+                        for topic_id, scores in scores_by_topic.items()
+                        for rank, value in enumerate(normalize_scores(scores))
+                        if depths[topic_id] <= rank < limits[topic_id])
+    # Normalized scores never increase with rank, so every topic gets a prefix of its trials.
+    for _, rank, topic_id in candidates[:max(0, slots)]:
+        depths[topic_id] = max(depths[topic_id], rank + 1)
+    return depths
+
+
+def labelling_depth(qrel_results_dir, top_n=None, call_budget=None, calls_per_trial=None, min_depth=None):
+    """
+    Returns the top_n the labelling stages pass to extract_top_trials: the fixed top_n
+    (default: TOP_N), or with a call budget (default: ADAPTIVE_DEPTH_CALL_BUDGET) the
+    per-topic depths adaptive_depths chooses from the run in qrel_results_dir, at most top_n.
+    """
+    if top_n is None:
+        top_n = TOP_N
+    if call_budget is None:
+        call_budget = ADAPTIVE_DEPTH_CALL_BUDGET
+    if call_budget is None:
+        return top_n
+    if calls_per_trial is None:
+        calls_per_trial = ADAPTIVE_DEPTH_CALLS_PER_TRIAL
+    if min_depth is None:
+        min_depth = ADAPTIVE_DEPTH_MIN
+
+    ranked = read_retrieval_scores(os.path.join(qrel_results_dir, "qrel.txt"))
+    scores_by_topic = {topic_id: [score for _, score in trials] for topic_id, trials in ranked.items()}
+    depths = adaptive_depths(scores_by_topic, call_budget, calls_per_trial, min_depth, top_n)
+    logging.info(f"Adaptive labelling depth: {sum(depths.values())} trials over {len(depths)} topics, "
+                 f"depth {min(depths.values(), default=0)} to {max(depths.values(), default=0)}")
+    return depths
@@ -4,17 +4,65 @@ import re
 import time
 import logging
 import json
+import hashlib
+import unicodedata
+from functools import lru_cache
+from itertools import chain
 from .trials import extract_top_trials
-from src.utils.model_api import prompt_model
-from src.utils.config import MODEL_PROVIDER, OPENAI_API_KEY
+from .prompt_layout import layout_prompt, split_template
+from .priority import order_pairs
+from src.utils.checkpoint import CheckpointJournal
+from src.utils.model_api import prompt_model, map_concurrent
+from src.utils.config import (MODEL_PROVIDER, OPENAI_API_KEY, MAX_CONCURRENT_REQUESTS, FINE_LABELLING_DEDUPLICATE,
+                              FINE_LABELLING_BATCH_SIZE, USE_SYSTEM_MESSAGES, GENERATION_LIMITS, LABELLING_ORDER)
 
+# Mapping from trial criteria keys to corresponding topic keys.
+TRIAL_TO_TOPIC_MAP = {
+    "demographic criteria": "demographic characteristics",
+    "disease criteria": "disease characteristics",
+    "prior treatment criteria": "prior treatment"
+}
 
-def fine_grained_labelling(qrel_results_dir, results_dir, prompt_dir, model, top_n, provider=None, api_key=None):
+# A labelled criterion line as counted by process_criteria_str in re_ranking.
+LABEL_LINE_PATTERN = re.compile(r"""['"]Label['"]\s*:\s*['"](eligible|excluded|no relevant information)['"]""")
+
+
+def fine_grained_labelling(qrel_results_dir, results_dir, prompt_dir, model, top_n, provider=None, api_key=None,
+                           max_concurrency=None, deduplicate=None, batch_size=None, trials_by_topic=None, router=None,
+                           layout=None, system_message=None, order=None, budget=None):
     """
     Processes trial data to generate fine-grained labels for each trial based on inclusion and exclusion criteria.
+    The per-category model calls of all trials run concurrently, up to max_concurrency at a time.
+
+    With deduplicate, criteria are labelled individually instead of per trial: each distinct
+    (criterion, patient characteristics) pair is labelled once, in batches of batch_size
+    criteria, and cached in 'criterion_labels.json' across runs. Trial outputs are then
+    reassembled from the cached label lines.
+
+    trials_by_topic restricts labelling to the given trials per topic instead of the top_n
+    trials of the qrel results (top_n may map each topic to its own depth) (used by the cascade to skip coarse-excluded trials).
+
+    With a router, prompts go to its smallest model first and escalate when the output
+    does not label every criterion of the prompt.
+
+    Prompts are laid out with layout (see prompt_layout) and sent grouped by topic, then by
+    section and criteria category, so consecutive prompts share the longest prefix; with
+    system_message, the template instructions go in a system message.
+
+    With order "rank" (see priority.order_pairs), trials are labelled in order of retrieval
+    rank across all topics instead. With a budget (LabellingBudget), a trial's calls are
+    acquired before its first prompt is sent, router escalations take further calls, and
+    labelling stops once the budget is exhausted; trials left unlabelled are labelled by the
+    next run. With deduplicate, each batched call (including the per-criterion fallback and
+    escalations) takes a call from the budget, batches are sent in the order of the first
+    trial that needs them, and trials with criteria left unlabelled are labelled by the next run.
     """
-    qrel_results_path = os.path.join(qrel_results_dir, "qrel.txt")
-    trials_by_topic, _ = extract_top_trials(qrel_results_path, top_n)
+    if order is None:
+        order = LABELLING_ORDER
+    if trials_by_topic is None:
+        qrel_results_path = os.path.join(qrel_results_dir, "qrel.txt")
+        trials_by_topic, _ = extract_top_trials(qrel_results_path, top_n)
+        discard_cascade_skipped(results_dir)
     output_path = os.path.join(results_dir, "fine_labelling.json")
     structured_trials_path = os.path.join(results_dir, "structured_trials.json")
     structured_trials = load_json(structured_trials_path)
@@ -22,88 +70,424 @@ def fine_grained_labelling(qrel_results_dir, results_dir, prompt_dir, model, top
     processed_topics = load_json(processed_topics_path)
     topics = extract_categorised_topics(processed_topics)
 
-    fine_labels = load_json(output_path) if os.path.exists(output_path) else {topic_id: {} for topic_id in trials_by_topic.keys()}
+    # Labels are checkpointed to an append-only journal and resumed from it.
+    journal = CheckpointJournal(output_path)
+    fine_labels = journal.state
 
     total_trials = sum(len(trial_ids) for trial_ids in trials_by_topic.values())
     logging.info(f"Processing {total_trials} trials for fine labelling")
     overall_counter = 0
     overall_start_time = time.time()
 
-    for topic_id, trial_ids in trials_by_topic.items():
-        topic = topics.get(topic_id)
+    if provider is None:
+        provider = MODEL_PROVIDER
+    if api_key is None:
+        api_key = OPENAI_API_KEY
+    if max_concurrency is None:
+        max_concurrency = MAX_CONCURRENT_REQUESTS
+    prompt_bases = load_fine_labelling_prompts(prompt_dir)
+
+    # Build the prompts of every (topic, trial) pair still to label.
+    for topic_id in trials_by_topic:
         fine_labels.setdefault(topic_id, {})
-        for trial_id in trial_ids:
-            if trial_id in fine_labels[topic_id]:
-                overall_counter += 1
-                continue
+    jobs = []
+    for topic_id, trial_id in order_pairs(trials_by_topic, order):
+        if trial_id in fine_labels[topic_id]:
+            overall_counter += 1
+            continue
 
-            trial_start_time = time.time()
-            raw_trial = structured_trials.get(trial_id)
-            if raw_trial is None:
-                logging.warning(f"Trial {trial_id} does not exist in the structured trials file")
-                continue
+        raw_trial = structured_trials.get(trial_id)
+        if raw_trial is None:
+            logging.warning(f"Trial {trial_id} does not exist in the structured trials file")
+            continue
 
-            trial = extract_categorised_criteria(raw_trial)
-            fine_labels[topic_id][trial_id] = generate_fine_labelling(topic, trial, prompt_dir, model, provider, api_key)
+        trial = extract_categorised_criteria(raw_trial)
+        jobs.append((topic_id, trial_id, build_fine_labelling_prompts(topics.get(topic_id), trial, prompt_bases, layout,
+                                                                     system_message)))
+
+    systems = fine_labelling_system_prompts(prompt_bases, system_message)
+
+    def label(request):
+        if budget is not None and budget.expired():
+            return None
+        return label_fine_request(request, systems, model, provider, api_key, router, budget)
+
+    if deduplicate is None:
+        deduplicate = FINE_LABELLING_DEDUPLICATE
+    if deduplicate:
+        if batch_size is None:
+            batch_size = FINE_LABELLING_BATCH_SIZE
+        criterion_labels_path = os.path.join(results_dir, "criterion_labels.json")
+        label_distinct_criteria(jobs, prompt_bases, criterion_labels_path, model, provider, api_key,
+                                max_concurrency, batch_size, journal, overall_counter, total_trials, router,
+                                layout, system_message, budget)
+        total_elapsed = time.time() - overall_start_time
+        if budget is not None and budget.exhausted():
+            logging.info(f"Labelling budget exhausted: {budget.stats()}")
+        logging.info(f"All trials processed in {total_elapsed:.2f} seconds")
+        return
+
+    # Prompts are sent grouped by topic, section and criteria category (or trial by trial in
+    # rank order); a trial is recorded as soon as all its outputs are in.
+    if order == "topic":
+        schedule = order_by_prefix(jobs)
+    else:
+        schedule = [(job_index, request_index)
+                    for job_index, (_, _, requests) in enumerate(jobs) for request_index in range(len(requests))]
+    if budget is not None:
+        schedule = filter(acquire_trial_calls(jobs, budget), schedule)
+    outputs = [[None] * len(requests) for _, _, requests in jobs]
+    remaining = [len(requests) for _, _, requests in jobs]
+
+    def label_scheduled(item):
+        job_index, request_index = item
+        return item, label(jobs[job_index][2][request_index])
+
+    results = map_concurrent(label_scheduled, schedule, max_concurrency)
+    completed = [(job_index, None, None) for job_index, count in enumerate(remaining) if count == 0]
+    with journal:
+        arrivals = ((job_index, request_index, output) for (job_index, request_index), output in results)
+        for job_index, request_index, output in chain(completed, arrivals):
+            if request_index is not None:
+                outputs[job_index][request_index] = output
+                remaining[job_index] -= 1
+                if remaining[job_index]:
+                    continue
+            topic_id, trial_id, requests = jobs[job_index]
+            if any(output is None for output in outputs[job_index]):
+                # Out of time before all prompts of the trial were sent.
+                outputs[job_index] = None
+                continue
+            journal.record([topic_id, trial_id], assemble_fine_labels(requests, outputs[job_index]))
+            outputs[job_index] = None
             overall_counter += 1
 
-            processing_time = time.time() - trial_start_time
             overall_progress = (overall_counter / total_trials) * 100
-            logging.info(f"Trial {trial_id} processed in {processing_time:.2f} seconds - {overall_progress:.2f}% complete")
-            save_json(fine_labels, output_path)
+            logging.info(f"Trial {trial_id} processed - {overall_progress:.2f}% complete")
 
     total_elapsed = time.time() - overall_start_time
+    if budget is not None and budget.exhausted():
+        logging.info(f"Labelling budget exhausted after {overall_counter} of {total_trials} trials: {budget.stats()}")
     logging.info(f"All trials processed in {total_elapsed:.2f} seconds")
 
 
-def generate_fine_labelling(topic, trial, prompt_dir, model, provider=None, api_key=None):
+def discard_cascade_skipped(results_dir):
     """
-    Generates fine-grained labels for a trial using inclusion and exclusion criteria along with topic context.
+    Removes the trials an earlier cascade run skipped ('cascade_skipped.json') when fine
+    labelling runs without the cascade, so hybrid re-ranking no longer scores them on their
+    coarse label alone.
+    """
+    skipped_path = os.path.join(results_dir, "cascade_skipped.json")
+    if os.path.exists(skipped_path):
+        logging.info(f"Removing {skipped_path} of an earlier cascade run")
+        os.remove(skipped_path)
+
+
+def acquire_trial_calls(jobs, budget):
+    """
+    Returns a predicate over (job index, request index) schedule items that acquires all
+    calls of a job from the budget at its first request. Once the budget refuses a job, the
+    predicate is false for every job not acquired before, and true for the remaining
+    requests of those that were, so no acquired trial is left incomplete.
+    """
+    acquired = set()
+    refused = False
+
+    def acquire(item):
+        nonlocal refused
+        job_index = item[0]
+        if job_index not in acquired:
+            if refused or not budget.acquire(len(jobs[job_index][2])):
+                refused = True
+                return False
+            acquired.add(job_index)
+        return True
+
+    return acquire
+
+
+@lru_cache(maxsize=None)
+def load_fine_labelling_prompts(prompt_dir):
     """
-    # Mapping from trial criteria keys to corresponding topic keys.
-    trial_to_topic_map = {
-        "demographic criteria": "demographic characteristics",
-        "disease criteria": "disease characteristics",
-        "prior treatment criteria": "prior treatment"
-    }
-
-    def get_topic_key(trial_key):
-        return trial_to_topic_map.get(trial_key)
-
-    inclusion_prompt_path = os.path.join(prompt_dir, "inclusion_fine_labelling_prompt.txt")
-    exclusion_prompt_path = os.path.join(prompt_dir, "exclusion_fine_labelling_prompt.txt")
-    inclusion_dict = trial.get("inclusion", {})
-    exclusion_dict = trial.get("exclusion", {})
-
-    # Load prompt templates.
-    with open(inclusion_prompt_path, 'r') as f:
-        inclusion_prompt_base = f.read()
-    with open(exclusion_prompt_path, 'r') as f:
-        exclusion_prompt_base = f.read()
-
-    def process_criteria(criteria_dict, prompt_base):
-        labels = {}
-        if provider is None:
-            current_provider = MODEL_PROVIDER
-        else:
-            current_provider = provider
-        if api_key is None:
-            current_api_key = OPENAI_API_KEY
-        else:
-            current_api_key = api_key
-        for criteria_type, criteria_list in criteria_dict.items():
+    Loads the inclusion and exclusion fine labelling prompt templates. Templates are read
+    once per prompt directory and shared; callers must not modify the returned dict.
+    """
+    prompt_bases = {}
+    for section in ("inclusion", "exclusion"):
+        with open(os.path.join(prompt_dir, f"{section}_fine_labelling_prompt.txt"), 'r') as f:
+            prompt_bases[section] = f.read()
+    return prompt_bases
+
+
+def build_fine_labelling_prompts(topic, trial, prompt_bases, layout=None, system_message=None):
+    """
+    Builds one prompt per non-empty criteria category of a trial, paired with the matching
+    section of the patient profile. Returns a list of (section, criteria type, prompt, criteria,
+    patient section) tuples; with system_message, the prompt leaves out the template
+    instructions, which fine_labelling_system_prompts returns per section.
+    """
+    requests = []
+    for section in ("inclusion", "exclusion"):
+        for criteria_type, criteria_list in trial.get(section, {}).items():
             if not criteria_list:
                 continue
             criteria_text = "\n".join(criteria_list) + "\n"
-            topic_section = "\n".join(topic.get(get_topic_key(criteria_type), []))
-            prompt_text = f"{prompt_base}{criteria_text}\nPatient Characteristics (DO NOT LABEL):\n{topic_section}"
-            labels[criteria_type] = prompt_model(prompt_text, model, provider=current_provider, api_key=current_api_key)
-        return labels
+            topic_section = "\n".join(topic.get(TRIAL_TO_TOPIC_MAP.get(criteria_type), []))
+            _, prompt_text = layout_prompt(prompt_bases[section], criteria_text, fine_labelling_profile(topic_section),
+                                           layout, system_message)
+            requests.append((section, criteria_type, prompt_text, criteria_list, topic_section))
+    return requests
+
+
+def fine_labelling_profile(topic_section):
+    return f"\nPatient Characteristics (DO NOT LABEL):\n{topic_section}"
+
+
+def fine_labelling_system_prompts(prompt_bases, system_message=None):
+    """
+    Returns the system message of each section's prompts: the template instructions with
+    system_message, otherwise None.
+    """
+    if system_message is None:
+        system_message = USE_SYSTEM_MESSAGES
+    return {section: split_template(prompt_base)[0] if system_message else None
+            for section, prompt_base in prompt_bases.items()}
+
+
+def order_by_prefix(jobs):
+    """
+    Orders the requests of the jobs by topic (in order of first appearance), then section and
+    criteria category, so consecutive prompts share the longest prefix and the server's
+    prompt cache is reused. Returns (job index, request index) pairs.
+    """
+    topic_order = {}
+    for topic_id, _, _ in jobs:
+        topic_order.setdefault(topic_id, len(topic_order))
+    schedule = [(job_index, request_index)
+                for job_index, (_, _, requests) in enumerate(jobs) for request_index in range(len(requests))]
+    return sorted(schedule, key=lambda item: (topic_order[jobs[item[0]][0]], *jobs[item[0]][2][item[1]][:2]))
+
 
-    inclusion_labels = process_criteria(inclusion_dict, inclusion_prompt_base)
-    exclusion_labels = process_criteria(exclusion_dict, exclusion_prompt_base)
+def label_fine_request(request, systems, model, provider, api_key, router=None, budget=None):
+    """
+    Sends one request of build_fine_labelling_prompts to the model, with the system message
+    of its section. With a router, outputs that do not label every criterion are escalated,
+    each escalation taking a call from budget (LabellingBudget), if any.
+    """
+    section, _, prompt_text, criteria_list, _ = request
+    generation = fine_generation_limits(len(criteria_list))
+    if router is not None:
+        criteria_count = len(criteria_list)
+        return router.prompt(prompt_text, validator=lambda output: len(extract_label_lines(output)) == criteria_count,
+                             system=systems[section], budget=budget, **generation)
+    return prompt_model(prompt_text, model, provider=provider, api_key=api_key, system=systems[section], **generation)
+
+
+def assemble_fine_labels(requests, outputs):
+    """
+    Groups model outputs by section and criteria type, in the format process_fine_labels expects.
+    """
+    labels = {"inclusion": {}, "exclusion": {}}
+    for (section, criteria_type, *_), output in zip(requests, outputs):
+        labels[section][criteria_type] = output
+    return labels
 
-    return {"inclusion": inclusion_labels, "exclusion": exclusion_labels}
+
+def fine_generation_limits(criteria_count, max_tokens=None, stop=None, early_stop=None):
+    """
+    Returns the prompt_model generation limits of a prompt labelling criteria_count criteria,
+    defaulting to GENERATION_LIMITS["fine"]; early stopping ends the answer once every
+    criterion has a label line.
+    """
+    limits = GENERATION_LIMITS["fine"]
+    max_tokens = limits.get("max_tokens") if max_tokens is None else max_tokens
+    stop = limits.get("stop") if stop is None else stop
+    early_stop = limits.get("early_stop") if early_stop is None else early_stop
+
+    def all_labelled(text):
+        return len(extract_label_lines(text)) >= criteria_count
+
+    return {"max_tokens": max_tokens, "stop": stop, "early_stop": all_labelled if early_stop else None}
+
+
+def generate_fine_labelling(topic, trial, prompt_dir, model, provider=None, api_key=None, layout=None,
+                            system_message=None, max_tokens=None, stop=None, early_stop=None):
+    """
+    Generates fine-grained labels for a trial using inclusion and exclusion criteria along with topic context.
+    max_tokens, stop and early_stop default to GENERATION_LIMITS["fine"].
+    """
+    if provider is None:
+        provider = MODEL_PROVIDER
+    if api_key is None:
+        api_key = OPENAI_API_KEY
+    prompt_bases = load_fine_labelling_prompts(prompt_dir)
+    requests = build_fine_labelling_prompts(topic, trial, prompt_bases, layout, system_message)
+    systems = fine_labelling_system_prompts(prompt_bases, system_message)
+    outputs = [prompt_model(prompt_text, model, provider=provider, api_key=api_key, system=systems[section],
+                            **fine_generation_limits(len(criteria_list), max_tokens, stop, early_stop))
+               for section, _, prompt_text, criteria_list, _ in requests]
+    return assemble_fine_labels(requests, outputs)
+
+
+def normalize_criterion(criterion):
+    """
+    Normalizes a criterion for deduplication: Unicode compatibility forms (so '≥' variants
+    match), case, bullets, whitespace and trailing punctuation.
+    """
+    text = unicodedata.normalize("NFKC", criterion).lower()
+    text = re.sub(r'^[\-\*\u2022\s]+', '', text)
+    return re.sub(r'\s+', ' ', text).strip().rstrip('.;,: ')
+
+
+def criterion_key(section, criteria_type, criterion, topic_section):
+    """
+    Cache key of a (criterion, patient characteristics) pair.
+    """
+    payload = json.dumps([section, criteria_type, normalize_criterion(criterion), topic_section.strip()])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def extract_label_lines(output):
+    """
+    Returns the lines of a fine labelling output that carry a label, in order.
+    """
+    return [line.strip() for line in output.splitlines() if LABEL_LINE_PATTERN.search(line)]
+
+
+def label_criteria_batch(prompt_base, criteria, topic_section, label, layout=None, system_message=None):
+    """
+    Labels a batch of criteria with a single prompt. The output lines are matched to the
+    criteria by position; if the model does not return exactly one labelled line per
+    criterion, each criterion is labelled on its own instead. label(prompt, criteria count)
+    sends a prompt to the model, or returns None when the call could not be made (e.g. the
+    budget refused it); the criteria it would have labelled are left without a label.
+
+    Returns:
+        list: One label line per criterion ("" if unlabelled), and the number of model calls made.
+    """
+    def prompt_for(batch):
+        criteria_text = "\n".join(batch) + "\n"
+        return layout_prompt(prompt_base, criteria_text, fine_labelling_profile(topic_section), layout, system_message)[1]
+
+    output = label(prompt_for(criteria), len(criteria))
+    if output is None:
+        return [""] * len(criteria), 0
+    lines = extract_label_lines(output)
+    if len(lines) == len(criteria):
+        return lines, 1
+    if len(criteria) == 1:
+        return [lines[0] if lines else ""], 1
+
+    single_lines = []
+    calls = 1
+    for criterion in criteria:
+        output = label(prompt_for([criterion]), 1)
+        if output is None:
+            single_lines.append("")
+            continue
+        calls += 1
+        lines = extract_label_lines(output)
+        single_lines.append(lines[0] if lines else "")
+    return single_lines, calls
+
+
+def batch_distinct_criteria(jobs, batch_size, criterion_labels=None):
+    """
+    Groups the distinct (criterion, patient characteristics) pairs of the jobs missing from
+    criterion_labels into batches of at most batch_size criteria sharing a prompt, ordered
+    by the first job that needs them.
+
+    Returns:
+        tuple: (section, patient section, criterion keys, criteria) batches, and the number of
+        criterion occurrences in the jobs.
+    """
+    criterion_labels = criterion_labels or {}
+    occurrences = 0
+    pending = {}
+    first_job = {}
+    for job_index, (_, _, requests) in enumerate(jobs):
+        for section, criteria_type, _, criteria_list, topic_section in requests:
+            for criterion in criteria_list:
+                occurrences += 1
+                key = criterion_key(section, criteria_type, criterion, topic_section)
+                if key in criterion_labels:
+                    continue
+                group = pending.setdefault((section, criteria_type, topic_section), {})
+                group.setdefault(key, criterion)
+                first_job.setdefault(key, job_index)
+
+    batches = []
+    for (section, _, topic_section), group in pending.items():
+        keys = list(group)
+        for start in range(0, len(keys), batch_size):
+            batch_keys = keys[start:start + batch_size]
+            batches.append((section, topic_section, batch_keys, [group[key] for key in batch_keys]))
+    # Keys of a group are in job order, so a batch's first key is its earliest job.
+    batches.sort(key=lambda batch: first_job[batch[2][0]])
+    return batches, occurrences
+
+
+def label_distinct_criteria(jobs, prompt_bases, criterion_labels_path, model, provider, api_key, max_concurrency,
+                            batch_size, journal, overall_counter, total_trials, router=None, layout=None,
+                            system_message=None, budget=None):
+    """
+    Labels every distinct (criterion, patient characteristics) pair of the jobs once and
+    reassembles each trial's labels in the format process_fine_labels expects. Batches are
+    sent in the order of the first job that needs them; with a budget, each call takes one
+    call from it and no call is sent once it refuses.
+    """
+    label_cache = CheckpointJournal(criterion_labels_path)
+    criterion_labels = label_cache.state
+
+    batches, occurrences = batch_distinct_criteria(jobs, batch_size, criterion_labels)
+    distinct = sum(len(batch_keys) for _, _, batch_keys, _ in batches)
+    logging.info(f"Labelling {distinct} distinct criteria ({occurrences} occurrences) in {len(batches)} batches")
+
+    systems = fine_labelling_system_prompts(prompt_bases, system_message)
+
+    def label_batch(batch):
+        section, topic_section, _, criteria = batch
+        system = systems[section]
+
+        def label(prompt_text, criteria_count):
+            if budget is not None and not budget.acquire():
+                return None
+            generation = fine_generation_limits(criteria_count)
+            if router is not None:
+                return router.prompt(prompt_text, validator=lambda output: bool(extract_label_lines(output)), system=system,
+                                     budget=budget, **generation)
+            return prompt_model(prompt_text, model, provider=provider, api_key=api_key, system=system, **generation)
+
+        return label_criteria_batch(prompt_bases[section], criteria, topic_section, label, layout, system_message)
+
+    calls = 0
+    with label_cache:
+        for (_, _, batch_keys, _), (lines, batch_calls) in zip(batches, map_concurrent(label_batch, batches, max_concurrency)):
+            for key, line in zip(batch_keys, lines):
+                # Criteria left without a label are not cached, so they are labelled again.
+                if line:
+                    label_cache.record([key], line)
+            calls += batch_calls
+    logging.info(f"Labelled {distinct} distinct criteria with {calls} model calls")
+
+    # A trial is recorded only once every criterion has a label; the others are left for the
+    # next run, which labels their missing criteria and reuses the cached ones.
+    incomplete = 0
+    with journal:
+        for topic_id, trial_id, requests in jobs:
+            request_lines = [[criterion_labels.get(criterion_key(section, criteria_type, criterion, topic_section))
+                              for criterion in criteria_list]
+                             for section, criteria_type, _, criteria_list, topic_section in requests]
+            if not all(all(lines) for lines in request_lines):
+                incomplete += 1
+                continue
+            journal.record([topic_id, trial_id], assemble_fine_labels(requests, ["\n".join(lines) for lines in request_lines]))
+            overall_counter += 1
+
+            overall_progress = (overall_counter / total_trials) * 100
+            logging.info(f"Trial {trial_id} processed - {overall_progress:.2f}% complete")
+    if incomplete:
+        logging.warning(f"{incomplete} trials have criteria without a label and are left for the next run")
 
 
 def parse_output(text):
@@ -0,0 +1,260 @@
+import os
+import time
+import logging
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .trials import extract_top_trials, generate_structure, structure_calls
+from .coarse_labelling import generate_coarse_labelling, coarse_labelling_calls
+from .priority import order_pairs
+from .fine_grained_labelling import (extract_categorised_criteria, extract_categorised_topics, build_fine_labelling_prompts,
+                                     load_fine_labelling_prompts, fine_labelling_system_prompts, label_fine_request,
+                                     assemble_fine_labels, discard_cascade_skipped)
+from src.utils.xml_parsing import xml_processing
+from src.utils.json import load_json
+from src.utils.checkpoint import CheckpointJournal
+from src.utils.config import MODEL_PROVIDER, OPENAI_API_KEY, MAX_CONCURRENT_REQUESTS, PIPELINE_QUEUE_SIZE
+
+# Configure logging for detailed output.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def run_pipeline(topic_dir, xml_trials_dir, results_dir, prompt_dir, qrel_results_dir, model, top_n, provider=None,
+                 api_key=None, max_concurrency=None, queue_size=None, trials_router=None, coarse_router=None,
+                 fine_router=None, layout=None, system_message=None, order=None, budget=None):
+    """
+    Runs trial structuring, coarse labelling and fine labelling as concurrent stages sharing
+    one pool of max_concurrency workers, instead of one stage after the other.
+
+    As soon as both criteria sections of a trial are structured, the fine labelling requests
+    of every topic that retrieved it join a bounded queue: structuring runs while fewer than
+    queue_size fine labelling requests are waiting and pauses once the queue is full. Free
+    workers then take fine and coarse labelling requests in turn, so no stage waits for
+    another to finish and the run takes about as long as its slowest stage.
+
+    top_n is the labelling depth, overall or per topic (see depth.labelling_depth). Results
+    go to the same files as the separate stages ('structured_trials.json',
+    'coarse_labelling.json' and 'fine_labelling.json'), checkpointed and resumed the same
+    way. A failed request is logged and its trial left for the next run. Processed topics
+    ('processed_topics.json') must already exist.
+
+    With order "rank" (see priority.order_pairs), trials are structured and (topic, trial)
+    pairs labelled in order of retrieval rank across all topics. With a budget
+    (LabellingBudget), work acquires its calls before it is taken from its queue: a
+    structuring or coarse labelling request one call per criteria chunk, and the fine
+    labelling of a (topic, trial) pair all its calls at its first request, so every pair
+    started is completed. Router escalations take further calls. Once the budget refuses,
+    no new work is started and only the fine labelling of pairs already started goes on.
+    """
+    if provider is None:
+        provider = MODEL_PROVIDER
+    if api_key is None:
+        api_key = OPENAI_API_KEY
+    if max_concurrency is None:
+        max_concurrency = MAX_CONCURRENT_REQUESTS
+    if queue_size is None:
+        queue_size = PIPELINE_QUEUE_SIZE
+
+    qrel_results_path = os.path.join(qrel_results_dir, "qrel.txt")
+    trials_by_topic, trials_to_process = extract_top_trials(qrel_results_path, top_n)
+    discard_cascade_skipped(results_dir)
+    topics_by_trial = {}
+    for topic_id, trial_ids in trials_by_topic.items():
+        for trial_id in trial_ids:
+            topics_by_trial.setdefault(trial_id, []).append(topic_id)
+
+    topic_descriptions = load_json(topic_dir)
+    topics = extract_categorised_topics(load_json(os.path.join(results_dir, "processed_topics.json")))
+    with open(os.path.join(prompt_dir, "trial_structure_prompt.txt"), 'r') as f:
+        structure_prompt = f.read()
+    with open(os.path.join(prompt_dir, "coarse_labelling_prompt.txt"), 'r') as f:
+        coarse_prompt = f.read()
+    fine_prompts = load_fine_labelling_prompts(prompt_dir)
+    fine_systems = fine_labelling_system_prompts(fine_prompts, system_message)
+
+    structured_journal = CheckpointJournal(os.path.join(results_dir, "structured_trials.json"))
+    coarse_journal = CheckpointJournal(os.path.join(results_dir, "coarse_labelling.json"))
+    fine_journal = CheckpointJournal(os.path.join(results_dir, "fine_labelling.json"))
+    structured_trials = structured_journal.state
+    coarse_labels = coarse_journal.state
+    fine_labels = fine_journal.state
+
+    # Parse every trial first, in a sorted order for consistency.
+    criteria = {}
+    for trial_id in sorted(trials_to_process):
+        trial_path = os.path.join(xml_trials_dir, trial_id + ".xml")
+        if not os.path.exists(trial_path):
+            logging.warning(f"Trial {trial_id} does not exist in the trials directory")
+            continue
+        try:
+            criteria[trial_id] = xml_processing(trial_path)[:2]
+        except Exception as e:
+            logging.error(f"Error processing XML for trial {trial_id}: {e}")
+
+    pairs = order_pairs(trials_by_topic, order)
+    trial_order = list(dict.fromkeys(trial_id for _, trial_id in pairs))
+    structure_requests = deque((trial_id, section, text)
+                               for trial_id in trial_order if trial_id in criteria and trial_id not in structured_trials
+                               for section, text in zip(("inclusion", "exclusion"), criteria[trial_id]))
+    coarse_requests = deque((topic_id, trial_id) for topic_id, trial_id in pairs
+                            if trial_id in criteria and trial_id not in coarse_labels.get(topic_id, {}))
+    fine_requests = deque()
+    fine_jobs = {}
+    sections = {}
+
+    def schedule_fine_labelling(trial_id):
+        # Queue the fine labelling requests of every topic that retrieved a structured trial.
+        trial = extract_categorised_criteria(structured_trials[trial_id])
+        for topic_id in topics_by_trial[trial_id]:
+            if trial_id in fine_labels.get(topic_id, {}):
+                continue
+            requests = build_fine_labelling_prompts(topics.get(topic_id, {}), trial, fine_prompts, layout, system_message)
+            if not requests:
+                fine_journal.record([topic_id, trial_id], assemble_fine_labels(requests, []))
+                continue
+            fine_jobs[(topic_id, trial_id)] = {"requests": requests, "outputs": [None] * len(requests),
+                                               "remaining": len(requests)}
+            fine_requests.extend(((topic_id, trial_id), index) for index in range(len(requests)))
+
+    submitted = {"fine": 0, "coarse": 0}
+    # Fine labelling jobs whose calls are acquired, and whether the budget has refused work.
+    acquired = set()
+    refused = False
+
+    def reserve(calls):
+        nonlocal refused
+        if budget is None:
+            return True
+        if refused or not budget.acquire(calls):
+            refused = True
+            return False
+        return True
+
+    def next_structure_task():
+        if not structure_requests or len(fine_requests) >= queue_size:
+            return None
+        trial_id, section, text = structure_requests[0]
+        if not reserve(structure_calls(text, structure_prompt)):
+            return None
+        structure_requests.popleft()
+        return ("structure", (trial_id, section)), partial(generate_structure, budget=budget), (
+            text, model, structure_prompt, provider, api_key, trials_router)
+
+    def next_fine_task():
+        if not fine_requests:
+            return None
+        job_key, index = fine_requests[0]
+        requests = fine_jobs[job_key]["requests"]
+        if job_key not in acquired:
+            if not reserve(len(requests)):
+                return None
+            acquired.add(job_key)
+        fine_requests.popleft()
+        submitted["fine"] += 1
+        return ("fine", (job_key, index)), label_fine_request, (requests[index], fine_systems, model, provider,
+                                                               api_key, fine_router, budget)
+
+    def next_coarse_task():
+        if not coarse_requests:
+            return None
+        topic_id, trial_id = coarse_requests[0]
+        inclusion, exclusion = criteria[trial_id]
+        description = topic_descriptions.get(topic_id, "No topic description found")
+        if not reserve(coarse_labelling_calls(coarse_prompt, inclusion, exclusion, description)):
+            return None
+        coarse_requests.popleft()
+        submitted["coarse"] += 1
+        return ("coarse", (topic_id, trial_id)), partial(generate_coarse_labelling, budget=budget), (
+            coarse_prompt, inclusion, exclusion, description, model, provider, api_key, coarse_router, layout,
+            system_message)
+
+    def next_task():
+        # Structuring while the fine labelling queue has room, so it never runs dry; otherwise
+        # fine and coarse labelling requests in turn. Work is only taken from its queue once
+        # its calls are acquired.
+        while fine_requests and (fine_requests[0][0] not in fine_jobs
+                                 or refused and fine_requests[0][0] not in acquired):
+            # Another request of the trial failed, or the budget refused the trial.
+            fine_requests.popleft()
+        takers = [next_structure_task]
+        if submitted["fine"] <= submitted["coarse"]:
+            takers += [next_fine_task, next_coarse_task]
+        else:
+            takers += [next_coarse_task, next_fine_task]
+        for take in takers:
+            task = take()
+            if task is not None:
+                return task
+        return None
+
+    counts = {"structure": 0, "coarse": 0, "fine": 0, "failed": 0}
+    overall_start_time = time.time()
+    logging.info(f"Streaming {len(structure_requests) // 2} trials to structure, {len(coarse_requests)} coarse labels "
+                 f"and the fine labels of {sum(len(trial_ids) for trial_ids in trials_by_topic.values())} "
+                 f"(topic, trial) pairs")
+
+    with structured_journal, coarse_journal, fine_journal, ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for trial_id in sorted(trials_to_process):
+            if trial_id in structured_trials:
+                schedule_fine_labelling(trial_id)
+
+        in_flight = {}
+        while True:
+            while len(in_flight) < max_concurrency:
+                task = next_task()
+                if task is None:
+                    break
+                meta, func, args = task
+                in_flight[executor.submit(func, *args)] = meta
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key = in_flight.pop(future)
+                try:
+                    output = future.result()
+                except Exception as e:
+                    counts["failed"] += 1
+                    logging.error(f"Pipeline {stage} request {key} failed: {e}")
+                    if stage == "fine":
+                        fine_jobs.pop(key[0], None)
+                        acquired.discard(key[0])
+                    elif stage == "structure":
+                        sections[key[0]] = None
+                    continue
+
+                if stage == "structure":
+                    trial_id, section = key
+                    if trial_id in sections and sections[trial_id] is None:
+                        continue
+                    sections.setdefault(trial_id, {})[section] = output
+                    if len(sections[trial_id]) < 2:
+                        continue
+                    structured_journal.record([trial_id], sections.pop(trial_id))
+                    counts["structure"] += 1
+                    schedule_fine_labelling(trial_id)
+                elif stage == "coarse":
+                    coarse_journal.record(list(key), output)
+                    counts["coarse"] += 1
+                else:
+                    job_key, index = key
+                    job = fine_jobs.get(job_key)
+                    if job is None:
+                        continue
+                    job["outputs"][index] = output
+                    job["remaining"] -= 1
+                    if job["remaining"]:
+                        continue
+                    fine_journal.record(list(job_key), assemble_fine_labels(job["requests"], job["outputs"]))
+                    del fine_jobs[job_key]
+                    acquired.discard(job_key)
+                    counts["fine"] += 1
+                    if counts["fine"] % 50 == 0:
+                        logging.info(f"Pipeline progress: {counts}")
+
+    total_elapsed = time.time() - overall_start_time
+    if budget is not None and budget.exhausted():
+        logging.info(f"Labelling budget exhausted: {budget.stats()}")
+    logging.info(f"Pipeline finished in {total_elapsed:.2f} seconds: {counts}")
+    return counts
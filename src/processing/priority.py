@@ -0,0 +1,88 @@
+import time
+import threading
+from src.utils.config import LABELLING_ORDER
+
+# "topic": (topic, trial) pairs topic by topic, trials in retrieval order, so consecutive prompts
+# share the topic's prefix. "rank": every topic's rank 1 trial, then every rank 2 trial, and so
+# on, so a run stopped early has labels for the best-ranked trials of every topic.
+LABELLING_ORDERS = ["topic", "rank"]
+
+
+def order_pairs(trials_by_topic, order=None):
+    """
+    Returns the (topic, trial) pairs of trials_by_topic (topic -> trials in retrieval order)
+    in the given labelling order (default: LABELLING_ORDER).
+    """
+    if order is None:
+        order = LABELLING_ORDER
+    if order not in LABELLING_ORDERS:
+        raise ValueError(f"Unknown labelling order: {order}. Choose one of {', '.join(LABELLING_ORDERS)}")
+    pairs = [(topic_id, trial_id) for topic_id, trial_ids in trials_by_topic.items() for trial_id in trial_ids]
+    if order == "topic":
+        return pairs
+    ranks = {}
+    for topic_id, trial_ids in trials_by_topic.items():
+        for rank, trial_id in enumerate(trial_ids):
+            ranks.setdefault((topic_id, trial_id), rank)
+    topic_order = {topic_id: index for index, topic_id in enumerate(trials_by_topic)}
+    return sorted(pairs, key=lambda pair: (ranks[pair], topic_order[pair[0]]))
+
+
+class LabellingBudget:
+    """
+    Budget of model calls and wall-clock time shared by the labelling stages of a run.
+
+    Stages acquire calls before sending them; once max_calls calls have been acquired or
+    max_seconds have passed since the budget was created, acquire refuses and the stages
+    stop scheduling work. Work they skip is left for the next run, like an interrupted run.
+
+    Parameters:
+        max_calls (int): Maximum number of model calls (None: no limit).
+        max_seconds (float): Maximum wall-clock time in seconds (None: no limit).
+    """
+
+    def __init__(self, max_calls=None, max_seconds=None):
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        self.started = time.monotonic()
+        self.calls = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+
+    def expired(self):
+        return self.max_seconds is not None and time.monotonic() - self.started >= self.max_seconds
+
+    def acquire(self, calls=1):
+        """
+        Takes calls from the budget. Returns False, taking nothing, when they do not fit in
+        the remaining calls or the time is up.
+        """
+        with self._lock:
+            if self.expired() or self.max_calls is not None and self.calls + calls > self.max_calls:
+                self.refused += 1
+                return False
+            self.calls += calls
+            return True
+
+    def exhausted(self):
+        """Whether no further call can be acquired."""
+        with self._lock:
+            return self.expired() or self.max_calls is not None and self.calls >= self.max_calls
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "max_calls": self.max_calls,
+            "seconds": round(time.monotonic() - self.started, 2),
+            "max_seconds": self.max_seconds,
+            "refused": self.refused,
+        }
+
+
+def make_budget(max_calls=None, max_seconds=None):
+    """
+    Returns a LabellingBudget, or None when neither limit is set.
+    """
+    if max_calls is None and max_seconds is None:
+        return None
+    return LabellingBudget(max_calls, max_seconds)
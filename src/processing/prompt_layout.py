@@ -0,0 +1,41 @@
+from src.utils.config import PROMPT_LAYOUT, USE_SYSTEM_MESSAGES
+
+# "template": instructions, criteria, then the patient profile (the order of the prompt files).
+# "profile_first": instructions, the patient profile, then the criteria, so that the requests
+# of one topic share the instructions and profile as a common prompt prefix.
+PROMPT_LAYOUTS = ["template", "profile_first"]
+
+
+def split_template(template):
+    """
+    Splits a prompt template into its instructions and its last line, the header the
+    task input follows (e.g. 'Inclusion criteria:' or 'Input: ').
+    """
+    cut = template.rstrip().rfind("\n") + 1
+    return template[:cut], template[cut:]
+
+
+def layout_prompt(template, task_input, profile_block, layout=None, system_message=None):
+    """
+    Lays out a prompt from a template, the task input appended after it and the patient
+    profile block.
+
+    Returns:
+        tuple: The system message (None unless system_message is set; then the template
+        instructions) and the prompt. Together they always hold the same text.
+    """
+    if layout is None:
+        layout = PROMPT_LAYOUT
+    if system_message is None:
+        system_message = USE_SYSTEM_MESSAGES
+    if layout not in PROMPT_LAYOUTS:
+        raise ValueError(f"Unknown prompt layout: {layout}. Choose one of {', '.join(PROMPT_LAYOUTS)}")
+
+    instructions, header = split_template(template)
+    if layout == "template":
+        prompt = f"{header}{task_input}{profile_block}"
+    else:
+        prompt = f"{profile_block.lstrip()}\n\n{header}{task_input}"
+    if system_message:
+        return instructions, prompt
+    return None, instructions + prompt
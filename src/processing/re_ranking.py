@@ -2,7 +2,9 @@ import re
 import os
 from src.utils.json import *
 from .trials import extract_top_trials
+from .depth import labelling_depth
 from src.utils.evaluation import save_results_and_evaluate
+from src.utils.config import EVALUATE_PARTIAL_LABELS, UNLABELLED_PLACEMENT, TOP_N
 
 
 def filtered_inclusion_eligibility(fine_labels, initial_retrieval):
@@ -235,14 +237,22 @@ def coarse_grained_eligibility(coarse_labels, initial_retrieval):
     return results
 
 
-def hybrid_eligibility(fine_labels, coarse_labels, initial_retrieval):
+def hybrid_eligibility(fine_labels, coarse_labels, initial_retrieval, skipped_trials=None):
+    """
+    Scores trials by their coarse label plus their fraction of eligible fine labels.
+    Trials in skipped_trials (topic -> trial ids the cascade did not fine-label) score on
+    their coarse label alone.
+    """
     results = {}
-    for topic, trials in fine_labels.items():
+    skipped_trials = skipped_trials or {}
+    for topic in list(fine_labels) + [topic for topic in skipped_trials if topic not in fine_labels]:
+        trials = fine_labels.get(topic, {})
         ordered_trials = initial_retrieval.get(topic, [])
         trial_ids = []
         eligibility_scores = []
-        for trial_id, trial_data in trials.items():
-            coarse_score = 1 if coarse_labels[topic][trial_id] == "eligible" else 0
+        skipped = {trial_id: {} for trial_id in skipped_trials.get(topic, []) if trial_id not in trials}
+        for trial_id, trial_data in {**trials, **skipped}.items():
+            coarse_score = 1 if coarse_labels.get(topic, {}).get(trial_id) == "eligible" else 0
             eligible_count = 0
             excluded_count = 0
             total_count = 0
@@ -316,6 +326,51 @@ def single_criteria_eligibility(fine_labels, initial_retrieval, criteria_type):
     return results
 
 
+def complete_ranking(results, initial_retrieval, placement=None):
+    """
+    Completes re-ranked results computed on partial labels with the trials of each topic's
+    initial retrieval that were not labelled, in retrieval order. With placement
+    "after_positive" (default: UNLABELLED_PLACEMENT) they follow the labelled trials with a
+    positive score and precede those scored 0 or less, so an unlabelled trial is not ranked
+    below one labelled as excluded; with "last" they follow every labelled trial. Topics
+    without any label keep their retrieval ranking.
+    """
+    if placement is None:
+        placement = UNLABELLED_PLACEMENT
+    if placement not in ("after_positive", "last"):
+        raise ValueError(f"Unknown unlabelled trial placement: {placement}")
+    completed = {}
+    for topic, ordered_trials in initial_retrieval.items():
+        trial_ids, scores = results.get(topic, ([], []))
+        ranked = set(trial_ids)
+        unlabelled = [trial_id for trial_id in ordered_trials if trial_id not in ranked]
+        if placement == "last":
+            floor = min(scores, default=0)
+            unlabelled_scores = [floor - 1 - index / len(unlabelled) for index in range(len(unlabelled))]
+            completed[topic] = (list(trial_ids) + unlabelled, list(scores) + unlabelled_scores)
+            continue
+        # Scores strictly between 0 and the lowest positive score, decreasing in retrieval order.
+        ceiling = min((score for score in scores if score > 0), default=1)
+        unlabelled_scores = [ceiling * (len(unlabelled) - index) / (len(unlabelled) + 1)
+                             for index in range(len(unlabelled))]
+        positive = sum(score > 0 for score in scores)
+        completed[topic] = (list(trial_ids[:positive]) + unlabelled + list(trial_ids[positive:]),
+                            list(scores[:positive]) + unlabelled_scores + list(scores[positive:]))
+    for topic in results:
+        completed.setdefault(topic, results[topic])
+    return completed
+
+
+def label_coverage(labels, initial_retrieval):
+    """
+    Returns the fraction of the (topic, trial) pairs of the initial retrieval that have a label.
+    """
+    total = sum(len(trial_ids) for trial_ids in initial_retrieval.values())
+    labelled = sum(trial_id in labels.get(topic, {}) for topic, trial_ids in initial_retrieval.items()
+                   for trial_id in trial_ids)
+    return labelled / total if total else 0.0
+
+
 ## Label processing functions
 
 def process_criteria_str(crit_str):
@@ -408,15 +463,33 @@ def process_coarse_labels(data):
     return new_data
 
 
-def re_ranking_and_evaluation(results_path, qrel_file):
+def re_ranking_and_evaluation(results_path, qrel_file, partial=None, top_n=None):
+    """
+    Re-ranks the top_n (default: TOP_N) trials of the initial retrieval with every scoring
+    method and evaluates the runs.
+
+    With partial (default: EVALUATE_PARTIAL_LABELS), labels may cover only part of the
+    retrieved trials, as after a budget-capped or interrupted labelling run: unlabelled
+    trials are ranked among the labelled ones (see complete_ranking), so every run is
+    evaluated over the full retrieval. Partial evaluation is always on when the labelling
+    stages used per-topic depths (see depth.labelling_depth).
+    """
+    if top_n is None:
+        top_n = TOP_N
+    if partial is None:
+        partial = EVALUATE_PARTIAL_LABELS
+    if isinstance(labelling_depth(os.path.join(results_path, "filtered_retrieval"), top_n), dict):
+        partial = True
     qrel_results_path = os.path.join(results_path,"filtered_retrieval", "qrel.txt")
     fine_grained_label_path = os.path.join(results_path, "fine_labelling.json")
     coarse_labels_path = os.path.join(results_path, "coarse_labelling.json")
+    cascade_skipped_path = os.path.join(results_path, "cascade_skipped.json")
     fine_labels = load_json(fine_grained_label_path)
     coarse_labels = load_json(coarse_labels_path)
+    skipped_trials = load_json(cascade_skipped_path) if os.path.exists(cascade_skipped_path) else None
 
     # Load Data
-    qrel_results, _ = extract_top_trials(qrel_results_path, 50)
+    qrel_results, _ = extract_top_trials(qrel_results_path, top_n)
     processed_fine_labels = process_fine_labels(fine_labels)
     processed_coarse_labels = process_coarse_labels(coarse_labels)
 
@@ -427,11 +500,21 @@ def re_ranking_and_evaluation(results_path, qrel_file):
     general_results = general_eligibility(processed_fine_labels, qrel_results)
     contrasting_results = contrasting_eligibility(processed_fine_labels, qrel_results)
     coarse_results = coarse_grained_eligibility(processed_coarse_labels, qrel_results)
-    hybrid_results = hybrid_eligibility(processed_fine_labels, processed_coarse_labels, qrel_results)
+    hybrid_results = hybrid_eligibility(processed_fine_labels, processed_coarse_labels, qrel_results, skipped_trials)
     demographic_results = single_criteria_eligibility(processed_fine_labels, qrel_results, "demographic criteria")
     disease_results = single_criteria_eligibility(processed_fine_labels, qrel_results, "disease criteria")
     treatment_results = single_criteria_eligibility(processed_fine_labels, qrel_results, "prior treatment criteria")
 
+    if partial:
+        print(f"Labelled trials: fine {label_coverage(fine_labels, qrel_results):.1%}, "
+              f"coarse {label_coverage(coarse_labels, qrel_results):.1%}")
+        (filtered_inclusion_results, inclusion_results, exclusion_results, general_results, contrasting_results,
+         coarse_results, hybrid_results, demographic_results, disease_results, treatment_results) = (
+            complete_ranking(results, qrel_results)
+            for results in (filtered_inclusion_results, inclusion_results, exclusion_results, general_results,
+                            contrasting_results, coarse_results, hybrid_results, demographic_results,
+                            disease_results, treatment_results))
+
     # Save and Evaluate
     save_results_and_evaluate(filtered_inclusion_results, "filtered_inclusion", results_path, qrel_file)
     save_results_and_evaluate(inclusion_results, "inclusion", results_path, qrel_file)
@@ -0,0 +1,116 @@
+import re
+import json
+import logging
+from src.utils.model_api import estimate_tokens
+
+# Criteria chunks are never cut below this many tokens, however long the fixed part of the prompt.
+MIN_CHUNK_TOKENS = 256
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.;])\s+")
+
+
+def criteria_budget(prompt_budget, *fixed_parts):
+    """
+    Returns the tokens left for criteria in a prompt of prompt_budget tokens once the fixed
+    parts (template, patient profile) are in, or None when prompt_budget is None.
+    """
+    if prompt_budget is None:
+        return None
+    fixed = sum(estimate_tokens(part or "") for part in fixed_parts)
+    if fixed + MIN_CHUNK_TOKENS > prompt_budget:
+        logging.warning(f"Prompt template of about {fixed} tokens leaves less than {MIN_CHUNK_TOKENS} tokens "
+                        f"of the {prompt_budget} token budget for criteria")
+    return max(MIN_CHUNK_TOKENS, prompt_budget - fixed)
+
+
+def split_line(line, max_tokens):
+    """
+    Splits a criterion line longer than max_tokens at sentence boundaries, and sentences
+    that are still too long at word boundaries.
+    """
+    pieces = []
+    for sentence in SENTENCE_BOUNDARY.split(line):
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        words = []
+        for word in sentence.split():
+            if words and estimate_tokens(" ".join(words + [word])) > max_tokens:
+                pieces.append(" ".join(words))
+                words = []
+            words.append(word)
+        if words:
+            pieces.append(" ".join(words))
+
+    # Put short sentences back together as long as they fit.
+    merged = []
+    for piece in pieces:
+        if merged and estimate_tokens(f"{merged[-1]} {piece}") <= max_tokens:
+            merged[-1] = f"{merged[-1]} {piece}"
+        else:
+            merged.append(piece)
+    return merged
+
+
+def chunk_sections(sections, max_tokens):
+    """
+    Splits criteria sections (e.g. inclusion and exclusion criteria) into chunks of at most
+    about max_tokens tokens, packing whole criterion lines in order.
+
+    Returns:
+        list: One list of section texts per chunk, with the sections in their original
+        positions (empty where a chunk holds no line of a section). Criteria within the
+        budget come back unchanged as a single chunk.
+    """
+    if max_tokens is None or sum(estimate_tokens(section or "") for section in sections) <= max_tokens:
+        return [list(sections)]
+
+    chunks = []
+    current = [[] for _ in sections]
+    size = 0
+    for index, section in enumerate(sections):
+        for line in (section or "").splitlines():
+            if not line.strip():
+                continue
+            pieces = [line] if estimate_tokens(line) <= max_tokens else split_line(line.strip(), max_tokens)
+            for piece in pieces:
+                tokens = estimate_tokens(piece) + 1
+                if size and size + tokens > max_tokens:
+                    chunks.append(current)
+                    current = [[] for _ in sections]
+                    size = 0
+                current[index].append(piece)
+                size += tokens
+    if size:
+        chunks.append(current)
+    return [["\n".join(lines) for lines in chunk] for chunk in chunks]
+
+
+def split_criteria(criteria, max_tokens):
+    """
+    Splits a criteria text into chunks of at most about max_tokens tokens (see chunk_sections).
+    """
+    return [chunk[0] for chunk in chunk_sections([criteria], max_tokens)]
+
+
+def merge_structured_outputs(outputs):
+    """
+    Merges the structuring outputs of the chunks of one criteria text into a single output:
+    the JSON criterion lines of every chunk, in chunk order, as parse_output and
+    extract_categorised_criteria read them.
+    """
+    if len(outputs) == 1:
+        return outputs[0]
+    lines = []
+    for output in outputs:
+        for line in (output or "").splitlines():
+            line = line.strip()
+            if line.startswith("Output:"):
+                line = line[len("Output:"):].strip()
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(item, dict):
+                lines.append(line)
+    return "\n".join(lines)
@@ -1,12 +1,16 @@
 import os
 import xml.etree.ElementTree as ET
 import time
-from src.utils.model_api import prompt_model
-from src.utils.config import MODEL_PROVIDER, OPENAI_API_KEY
+from src.utils.model_api import prompt_model, map_concurrent
+from src.utils.scheduler import classify_error
+from src.utils.config import MODEL_PROVIDER, OPENAI_API_KEY, MAX_CONCURRENT_REQUESTS
 from src.utils.json import *
+from src.utils.checkpoint import CheckpointJournal
+from .fine_grained_labelling import extract_lists
 
 
-def process_topics(topic_prompt_path, topics_xml_path, results_dir, model_name, max_retries=10000, delay_seconds=60, provider=None, api_key=None):
+def process_topics(topic_prompt_path, topics_xml_path, results_dir, model_name, max_retries=3, delay_seconds=30, provider=None, api_key=None,
+                   max_concurrency=None, router=None):
     """
     Processes topics using a system prompt and writes each output to a file,
     calling a model specified by model_name and provider.
@@ -16,10 +20,15 @@ def process_topics(topic_prompt_path, topics_xml_path, results_dir, model_name,
         topics_xml_path (str): Path to the XML file with topics.
         results_dir (str): Directory where processed topic files will be saved.
         model_name (str): The model name to use.
-        max_retries (int): Maximum number of retry attempts on failure.
-        delay_seconds (int): Delay (in seconds) between retry attempts.
+        max_retries (int): Maximum number of rounds retrying the topics that failed with a
+            retryable error (see classify_error); the request scheduler already retries
+            each request with backoff, so these rounds only cover longer outages.
+        delay_seconds (int): Delay (in seconds) before each retry round.
         provider (str): The provider to use ("ollama" or "openai").
         api_key (str): Optional API key for OpenAI.
+        max_concurrency (int): Maximum number of topics sent to the model at once.
+        router (ModelRouter): Optional small-to-large model router used instead of model_name.
+            Outputs without any categorised characteristics escalate to the next model.
     """
     # Ensure output directory exists
     os.makedirs(results_dir, exist_ok=True)
@@ -38,33 +47,50 @@ def process_topics(topic_prompt_path, topics_xml_path, results_dir, model_name,
         description = topic_element.text.strip()
         topics.append((number, description))
 
-    retry = 0
-    processsed_topics = {}
-    for idx, (number, topic) in enumerate(topics):
-        print(f"Processing Topic number: {number}. Remaining topics: {len(topics) - idx - 1}")
+    # Call the model using the specified provider
+    if provider is None:
+        provider = MODEL_PROVIDER
+    if api_key is None:
+        api_key = OPENAI_API_KEY
+    if max_concurrency is None:
+        max_concurrency = MAX_CONCURRENT_REQUESTS
+
+    def process_topic(item):
+        _, topic = item
         user_prompt = f"Input: {topic}"
         full_prompt = system_prompt + user_prompt
+        if router is not None:
+            return router.prompt(full_prompt, validator=lambda output: any(extract_lists(output).values()))
+        return prompt_model(full_prompt, model=model_name, provider=provider, api_key=api_key)
 
-        try:
-            # Call the model using the specified provider
-            if provider is None:
-                current_provider = MODEL_PROVIDER
-            else:
-                current_provider = provider
-            if api_key is None:
-                current_api_key = OPENAI_API_KEY
-            else:
-                current_api_key = api_key
-            output = prompt_model(full_prompt, model=model_name, provider=current_provider, api_key=current_api_key)
-            processsed_topics[number] = output
-            save_json(processsed_topics, f"{results_dir}/processed_topics.json")
+    # Outputs are checkpointed to an append-only journal; topics already processed are skipped.
+    journal = CheckpointJournal(f"{results_dir}/processed_topics.json")
+    topics = [(number, topic) for number, topic in topics if str(number) not in journal.state]
 
+    # Topics that failed with a retryable error are retried together after delay_seconds,
+    # until max_retries rounds; errors a retry will not fix skip the topic at once.
+    retry = 0
+    with journal:
+        while topics:
+            failed = []
+            outputs = map_concurrent(process_topic, topics, max_concurrency, return_exceptions=True)
+            for idx, ((number, topic), output) in enumerate(zip(topics, outputs)):
+                print(f"Processing Topic number: {number}. Remaining topics: {len(topics) - idx - 1}")
+                if not isinstance(output, Exception):
+                    journal.record([number], output)
+                    continue
+                print(f"Error processing topic {number}: {output}")
+                if classify_error(output) is None:
+                    print(f"Skipping topic {number}: the error is not retryable")
+                    continue
+                failed.append((number, topic))
 
-        except Exception as e:
-            print(f"Error processing topic {number}: {e}")
-            if retry < max_retries:
-                print(f"Retrying in {delay_seconds} seconds...")
-                time.sleep(delay_seconds)
-                retry += 1
-            else:
-                print("Max retries reached. Skipping topic.")
\ No newline at end of file
+            if not failed:
+                break
+            if retry >= max_retries:
+                print(f"Max retries reached. Skipping topics: {', '.join(str(number) for number, _ in failed)}")
+                break
+            print(f"Retrying {len(failed)} topics in {delay_seconds} seconds...")
+            time.sleep(delay_seconds)
+            retry += 1
+            topics = failed
@@ -1,10 +1,12 @@
 import os
+import json
 import time
 import logging
+from .token_budget import criteria_budget, split_criteria, merge_structured_outputs
 from src.utils.xml_parsing import xml_processing
-from src.utils.model_api import prompt_model
-from src.utils.config import MODEL_PROVIDER, OPENAI_API_KEY
-from src.utils.json import load_json, save_json
+from src.utils.model_api import prompt_model, map_concurrent
+from src.utils.config import MODEL_PROVIDER, OPENAI_API_KEY, MAX_CONCURRENT_REQUESTS, GENERATION_LIMITS, PROMPT_TOKEN_BUDGETS
+from src.utils.checkpoint import CheckpointJournal
 
 # Configure logging for detailed output.
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -15,7 +17,8 @@ def extract_top_trials(file_path, n):
 
     Parameters:
         file_path (str): Path to the qrel file.
-        n (int): Maximum rank to include.
+        n (int or dict): Maximum rank to include, or a map from topic_id to the maximum rank
+            of that topic (topics not in the map are left out), e.g. from depth.labelling_depth.
 
     Returns:
         tuple: A dictionary mapping topic_id to list of trial_ids, and a set of unique trial_ids.
@@ -33,13 +36,31 @@ def extract_top_trials(file_path, n):
             except ValueError:
                 logging.warning(f"Invalid rank '{rank_str}' in line: {line.strip()}")
                 continue
-            if rank <= n:
+            if rank <= (n.get(topic_id, 0) if isinstance(n, dict) else n):
                 topic_trials.setdefault(topic_id, []).append(trial_id)
                 trials_to_process.add(trial_id)
     return topic_trials, trials_to_process
 
 
-def generate_structure(criteria, model, prompt_base, provider=None, api_key=None):
+def has_structured_criteria(output):
+    """
+    Checks that a structuring output contains at least one JSON criterion line.
+    """
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith("Output:"):
+            line = line[len("Output:"):].strip()
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(item, dict) and "Criterion" in item:
+            return True
+    return False
+
+
+def generate_structure(criteria, model, prompt_base, provider=None, api_key=None, router=None, max_tokens=None,
+                       stop=None, token_budget=None, budget=None):
     """
     Generates structured text from criteria using the specified model.
 
@@ -49,21 +70,57 @@ def generate_structure(criteria, model, prompt_base, provider=None, api_key=None
         prompt_base (str): The base prompt text.
         provider (str): The provider to use ("ollama" or "openai").
         api_key (str): Optional API key for OpenAI.
+        router (ModelRouter): Optional router; escalates outputs without parseable criteria.
+        max_tokens (int): Maximum answer length (default: GENERATION_LIMITS["trials"]).
+        stop (list): Stop sequences (default: GENERATION_LIMITS["trials"]).
+        token_budget (int): Maximum estimated prompt tokens (default: PROMPT_TOKEN_BUDGETS["trials"]);
+            longer criteria are structured in chunks, one after another so a request takes a
+            single slot of the caller's concurrency, and the outputs merged.
+        budget (LabellingBudget): Optional budget router escalations take their calls from;
+            the caller acquires the structure_calls calls of the criteria.
 
     Returns:
         str: The structured text output.
     """
     if not criteria:
         return ""
-    prompt = f"{prompt_base}\nInput: {criteria}"
+    limits = GENERATION_LIMITS["trials"]
+    max_tokens = limits.get("max_tokens") if max_tokens is None else max_tokens
+    stop = limits.get("stop") if stop is None else stop
+    if token_budget is None:
+        token_budget = PROMPT_TOKEN_BUDGETS["trials"]
     if provider is None:
         provider = MODEL_PROVIDER
     if api_key is None:
         api_key = OPENAI_API_KEY
-    return prompt_model(prompt, model, provider=provider, api_key=api_key)
 
+    def structure(chunk):
+        prompt = f"{prompt_base}\nInput: {chunk}"
+        if router is not None:
+            return router.prompt(prompt, validator=has_structured_criteria, budget=budget, max_tokens=max_tokens,
+                                 stop=stop)
+        return prompt_model(prompt, model, provider=provider, api_key=api_key, max_tokens=max_tokens, stop=stop)
+
+    chunks = split_criteria(criteria, criteria_budget(token_budget, prompt_base))
+    if len(chunks) == 1:
+        return structure(criteria)
+    return merge_structured_outputs([structure(chunk) for chunk in chunks])
+
+
+def structure_calls(criteria, prompt_base, token_budget=None):
+    """
+    Returns the model calls generate_structure makes for criteria before any escalation:
+    one per chunk, none for empty criteria.
+    """
+    if not criteria:
+        return 0
+    if token_budget is None:
+        token_budget = PROMPT_TOKEN_BUDGETS["trials"]
+    return len(split_criteria(criteria, criteria_budget(token_budget, prompt_base)))
 
-def process_trials(qrel_results_dir, xml_trials_dir, results_dir, prompt_dir, model, top_n, provider=None, api_key=None):
+
+def process_trials(qrel_results_dir, xml_trials_dir, results_dir, prompt_dir, model, top_n, provider=None, api_key=None,
+                   max_concurrency=None, router=None):
     """
     Processes the trials by extracting information from XML files and generating structured
     text using an external model.
@@ -74,7 +131,9 @@ def process_trials(qrel_results_dir, xml_trials_dir, results_dir, prompt_dir, mo
         results_dir (str): Directory where results are saved.
         prompt_dir (str): Directory containing the prompt file.
         model (str): The model to use for structuring the trials.
-        top_n (int): The maximum trial rank to process.
+        top_n (int or dict): The maximum trial rank to process, overall or per topic.
+        max_concurrency (int): Maximum number of model requests in flight (default: MAX_CONCURRENT_REQUESTS).
+        router (ModelRouter): Optional small-to-large model router used instead of model.
     """
     output_path = os.path.join(results_dir, "structured_trials.json")
     prompt_path = os.path.join(prompt_dir, "trial_structure_prompt.txt")
@@ -87,16 +146,20 @@ def process_trials(qrel_results_dir, xml_trials_dir, results_dir, prompt_dir, mo
     with open(prompt_path, 'r') as f:
         prompt_base = f.read()
 
-    if os.path.exists(output_path):
-        structured_trials = load_json(output_path)
-    else:
-        structured_trials = {}
+    # Structured trials are checkpointed to an append-only journal and resumed from it.
+    journal = CheckpointJournal(output_path)
+    structured_trials = journal.state
 
     overall_start_time = time.time()
 
-    # Process trials in a sorted order for consistency.
-    for idx, trial in enumerate(sorted(trials_to_process), start=1):
-        trial_start_time = time.time()
+    # Parse every trial first, in a sorted order for consistency.
+    parsed_trials = []
+    processed = 0
+    for trial in sorted(trials_to_process):
+        if trial in structured_trials:
+            processed += 1
+            continue
+
         trial_path = os.path.join(xml_trials_dir, trial + ".xml")
         if not os.path.exists(trial_path):
             logging.warning(f"Trial {trial} does not exist in the trials directory")
@@ -107,19 +170,32 @@ def process_trials(qrel_results_dir, xml_trials_dir, results_dir, prompt_dir, mo
         except Exception as e:
             logging.error(f"Error processing XML for trial {trial}: {e}")
             continue
+        parsed_trials.append((trial, inclusion, exclusion))
+
+    # The inclusion and exclusion criteria of every trial are structured concurrently.
+    requests = [(trial, section, criteria)
+                for trial, inclusion, exclusion in parsed_trials
+                for section, criteria in (("inclusion", inclusion), ("exclusion", exclusion))]
+
+    def structure(request):
+        _, _, criteria = request
+        return generate_structure(criteria, model, prompt_base, provider, api_key, router)
+
+    if max_concurrency is None:
+        max_concurrency = MAX_CONCURRENT_REQUESTS
+    results = map_concurrent(structure, requests, max_concurrency)
+    structured_trial = {}
+    with journal:
+        for (trial, section, _), structured in zip(requests, results):
+            structured_trial[section] = structured
+            if section != "exclusion":
+                continue
+            journal.record([trial], structured_trial)
+            structured_trial = {}
 
-        structured_inclusion = generate_structure(inclusion, model, prompt_base, provider, api_key)
-        structured_exclusion = generate_structure(exclusion, model, prompt_base, provider, api_key)
-        processing_time = time.time() - trial_start_time
-
-        structured_trials[trial] = {
-            "inclusion": structured_inclusion,
-            "exclusion": structured_exclusion
-        }
-        save_json(structured_trials, output_path)
-
-        overall_progress = (idx / total_trials) * 100
-        logging.info(f"Trial {trial} processed in {processing_time:.2f} seconds - {overall_progress:.2f}% complete")
+            processed += 1
+            overall_progress = (processed / total_trials) * 100
+            logging.info(f"Trial {trial} processed - {overall_progress:.2f}% complete")
 
     total_elapsed = time.time() - overall_start_time
     logging.info(f"All trials processed in {total_elapsed:.2f} seconds")
@@ -1,75 +1,29 @@
 from .xml_parsing import *
 from .json import *
+from .tokenization import TokenCache, extract_trial_text, preprocess_text, tokenize_trials
+from .sparse_bm25 import CorpusStatistics, SparseBM25, build_term_matrix, top_k_indices
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Tuple
 import os
-import re
-from typing import Any, Dict, List, Optional, Tuple
-from rank_bm25 import BM25Okapi
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
-from nltk.tokenize import word_tokenize
-import nltk
-nltk.download('stopwords')
+import heapq
+import numpy as np
 
-# Preload common resources for text processing.
-STOP_WORDS = set(stopwords.words('english'))
-STEMMER = PorterStemmer()
+# Term matrix and vocabulary of the union of candidate trials, set in each ranking worker.
+_SHARED_CORPUS: Optional[Tuple[Any, Dict[str, int]]] = None
 
 
 def extract_xml_texts(xml_dir: str, xml_ids: List[str]) -> List[str]:
-
-    extracted_texts = []
-    for xml_id in xml_ids:
-        # Build full file path and process the XML.
-        file_path = os.path.join(xml_dir, f'{xml_id}.xml')
-        inclusion_text, exclusion_text, element_dict = xml_processing(file_path)
-
-        text_parts = []
-        for key, value in element_dict.items():
-            if value is not None:
-                # For these keys, assume the value is a list.
-                if key in ['condition', 'keyword', 'condition_browse']:
-                    text_parts.append(' '.join(value))
-                else:
-                    text_parts.append(value)
-        if inclusion_text is not None:
-            text_parts.append(inclusion_text)
-        if exclusion_text is not None:
-            text_parts.append(exclusion_text)
-
-        full_text = ' '.join(text_parts)
-        extracted_texts.append(full_text)
-    return extracted_texts
-
-
-def preprocess_text(text: str) -> List[str]:
-    """
-    Preprocesses text by lowercasing, removing non-alphabetic characters,
-    tokenizing, removing stopwords, and applying stemming.
-
-    Parameters:
-        text (str): The input text to preprocess.
-
-    Returns:
-        List[str]: A list of preprocessed tokens.
-    """
-    # Lowercase and remove non-alphabetic characters.
-    text = text.lower()
-    text = re.sub(r'[^a-zA-Z\s]', '', text)
-
-    # Tokenize the text.
-    tokens = word_tokenize(text)
-
-    # Remove stopwords and stem the tokens.
-    tokens = [STEMMER.stem(token) for token in tokens if token not in STOP_WORDS]
-
-    return tokens
+    return [extract_trial_text(xml_dir, xml_id) for xml_id in xml_ids]
 
 
 def retrieve_bm25_documents(query: str,
                             xml_dir: str,
                             xml_ids: List[str],
                             k1: float = 0.75,
-                            b: float = 0.75) -> Tuple[List[str], List[float]]:
+                            b: float = 0.75,
+                            token_cache: Optional[TokenCache] = None,
+                            workers: Optional[int] = None,
+                            top_k: Optional[int] = None) -> Tuple[List[str], List[float]]:
     """
     Ranks XML files using the BM25 algorithm based on the provided query.
 
@@ -79,72 +33,309 @@ def retrieve_bm25_documents(query: str,
         xml_ids (List[str]): List of XML file identifiers.
         k1 (float): BM25 k1 parameter (default: 0.75).
         b (float): BM25 b parameter (default: 0.75).
+        token_cache (Optional[TokenCache]): Cache of preprocessed trial tokens shared across calls.
+        workers (Optional[int]): Number of tokenizer worker processes (default: CPU count).
+        top_k (Optional[int]): Only return the top_k best documents (default: all).
 
     Returns:
         Tuple[List[str], List[float]]: A tuple containing the list of XML IDs ranked
         in descending order of BM25 score and their corresponding scores.
     """
-    # Extract and preprocess text from the XML files.
-    xml_texts = extract_xml_texts(xml_dir, xml_ids)
-    tokenized_texts = [preprocess_text(text) for text in xml_texts]
+    # Extract and preprocess text from the XML files, reusing cached tokens.
+    trial_tokens = tokenize_trials(xml_dir, xml_ids, token_cache, workers)
+    tokenized_texts = [trial_tokens[xml_id] for xml_id in xml_ids]
 
-    bm25_model = BM25Okapi(tokenized_texts, k1=k1, b=b)
-    # The actual query text is the second element of the tuple.
+    bm25_model = SparseBM25.from_tokenized(tokenized_texts, k1=k1, b=b)
     processed_query = preprocess_text(query)
-    doc_scores = bm25_model.get_scores(processed_query)
 
-    # Pair xml_id with its BM25 score, then sort in descending order.
-    scored_results = sorted(zip(xml_ids, doc_scores), key=lambda pair: pair[1], reverse=True)
-    ranked_ids, ranked_scores = zip(*scored_results) if scored_results else ([], [])
+    # Select the best documents in descending order of score; ties keep candidate order.
+    order, ranked_scores = bm25_model.top_k(processed_query, top_k)
+    ranked_ids = [xml_ids[index] for index in order]
 
-    return list(ranked_ids), list(ranked_scores)
+    return ranked_ids, ranked_scores.tolist()
 
 
 def bm25_rank_documents(unranked_retrieval: Dict[str, List[str]],
                         xml_dir: str,
-                        query_path: str):
+                        query_path: str,
+                        token_cache_path: Optional[str] = None,
+                        workers: Optional[int] = None,
+                        parallel: bool = False,
+                        streaming_threshold: Optional[int] = None,
+                        streaming_top_k: int = 1000,
+                        chunk_size: int = 5000,
+                        query_ids: Optional[Dict[Any, str]] = None):
+    """
+    Ranks the candidates of every topic with BM25 and normalizes the scores.
+
+    query_ids maps each key of unranked_retrieval to the topic whose query ranks it (default:
+    the key itself), so several candidate sets of a topic are ranked in one call and share
+    its tokenization and, with parallel, its term matrix.
+    """
+    # Topics with very large candidate sets are ranked in memory-bounded chunks.
+    streamed_topics = [topic_index for topic_index, xml_ids in unranked_retrieval.items()
+                       if streaming_threshold is not None and len(xml_ids) > streaming_threshold]
+    in_memory_retrieval = {topic_index: xml_ids for topic_index, xml_ids in unranked_retrieval.items()
+                           if topic_index not in streamed_topics}
 
-    ranked_results: Dict[str, Tuple[List[str], List[float]]] = {}
     queries = load_json(query_path)
+    if query_ids is not None:
+        queries = {key: queries[topic_id] for key, topic_id in query_ids.items()}
+    token_cache = None
+    if parallel:
+        ranked_results = parallel_bm25_rank_documents(in_memory_retrieval, xml_dir, query_path,
+                                                      token_cache_path=token_cache_path, workers=workers,
+                                                      query_ids=query_ids)
+    else:
+        ranked_results: Dict[str, Tuple[List[str], List[float]]] = {}
+        token_cache = TokenCache(token_cache_path)
+
+        for topic_index, xml_ids in in_memory_retrieval.items():
+            print(f"Ranking topic {topic_index}...")
+            if not xml_ids:
+                ranked_results[topic_index] = ([], [])
+                continue
+            topic_query = queries[topic_index]
+            ranked_ids, ranked_scores = retrieve_bm25_documents(topic_query, xml_dir, xml_ids,
+                                                                token_cache=token_cache, workers=workers)
+            ranked_scores = normalize_bm25_scores(ranked_scores)
+            ranked_results[topic_index] = (ranked_ids, ranked_scores)
+            print(f"Topic {topic_index}: {len(ranked_ids)} documents ranked.")
+        token_cache.save()
+
+    # With a persistent token cache, streamed trials are tokenized once for both passes and
+    # every topic; without one only a chunk of tokens is held in memory at a time.
+    stream_cache = None
+    if streamed_topics and token_cache_path is not None:
+        stream_cache = token_cache if token_cache is not None else TokenCache(token_cache_path)
+    # Topics with the same candidates share their corpus statistics.
+    candidate_statistics: Dict[FrozenSet[str], CorpusStatistics] = {}
+    for topic_index in streamed_topics:
+        xml_ids = unranked_retrieval[topic_index]
+        print(f"Streaming topic {topic_index} ({len(xml_ids)} candidates)...")
+        candidates = frozenset(xml_ids)
+        if candidates not in candidate_statistics:
+            candidate_statistics[candidates] = build_corpus_statistics(xml_dir, xml_ids, chunk_size, workers,
+                                                                       stream_cache)
+        ranked_ids, ranked_scores, min_score, max_score = streaming_bm25_documents(
+            queries[topic_index], xml_dir, xml_ids, top_k=streaming_top_k, chunk_size=chunk_size,
+            statistics=candidate_statistics[candidates], workers=workers, token_cache=stream_cache)
+        ranked_scores = normalize_bm25_scores(ranked_scores, min_score, max_score)
+        ranked_results[topic_index] = (ranked_ids, ranked_scores)
+        print(f"Topic {topic_index}: top {len(ranked_ids)} of {len(xml_ids)} documents kept.")
+    if stream_cache is not None:
+        stream_cache.save()
+
+    return {topic_index: ranked_results[topic_index] for topic_index in unranked_retrieval}
+
+
+def _iter_token_chunks(xml_dir: str,
+                       xml_ids: List[str],
+                       chunk_size: int,
+                       workers: Optional[int],
+                       token_cache: Optional[TokenCache] = None) -> Iterator[Tuple[int, List[str], List[List[str]]]]:
+    for start in range(0, len(xml_ids), chunk_size):
+        chunk_ids = xml_ids[start:start + chunk_size]
+        # Without a shared cache, a throwaway cache per chunk keeps only one chunk of tokens alive.
+        chunk_tokens = tokenize_trials(xml_dir, chunk_ids, token_cache, workers)
+        yield start, chunk_ids, [chunk_tokens[xml_id] for xml_id in chunk_ids]
+
+
+def build_corpus_statistics(xml_dir: str,
+                            xml_ids: List[str],
+                            chunk_size: int = 5000,
+                            workers: Optional[int] = None,
+                            token_cache: Optional[TokenCache] = None) -> CorpusStatistics:
+    """
+    Computes BM25 corpus statistics over the given trials in fixed-size chunks.
+
+    Parameters:
+        xml_dir (str): Directory containing the XML files.
+        xml_ids (List[str]): List of XML file identifiers.
+        chunk_size (int): Number of trials tokenized at a time.
+        workers (Optional[int]): Number of tokenizer worker processes (default: CPU count).
+        token_cache (Optional[TokenCache]): Cache of preprocessed trial tokens shared across calls.
+
+    Returns:
+        CorpusStatistics: Document count, average length and document frequencies.
+    """
+    statistics = CorpusStatistics()
+    for _, _, tokenized_chunk in _iter_token_chunks(xml_dir, xml_ids, chunk_size, workers, token_cache):
+        statistics.update(tokenized_chunk)
+    return statistics
+
+
+def streaming_bm25_documents(query: str,
+                             xml_dir: str,
+                             xml_ids: List[str],
+                             top_k: int = 1000,
+                             chunk_size: int = 5000,
+                             k1: float = 0.75,
+                             b: float = 0.75,
+                             statistics: Optional[CorpusStatistics] = None,
+                             workers: Optional[int] = None,
+                             token_cache: Optional[TokenCache] = None) -> Tuple[List[str], List[float], float, float]:
+    """
+    Ranks XML files with BM25 while holding only one chunk of tokens and a bounded
+    top-k heap in memory. When no corpus statistics are given they are computed over
+    the candidates in a first pass, which gives the same scores as retrieve_bm25_documents.
+    With a token cache, trials are tokenized once for both passes, at the cost of keeping
+    their tokens in the cache.
+
+    Parameters:
+        query (str): The query text.
+        xml_dir (str): Directory containing the XML files.
+        xml_ids (List[str]): List of XML file identifiers.
+        top_k (int): Number of best documents to keep.
+        chunk_size (int): Number of trials tokenized and scored at a time.
+        k1 (float): BM25 k1 parameter (default: 0.75).
+        b (float): BM25 b parameter (default: 0.75).
+        statistics (Optional[CorpusStatistics]): Precomputed corpus-level statistics.
+        workers (Optional[int]): Number of tokenizer worker processes (default: CPU count).
+        token_cache (Optional[TokenCache]): Cache of preprocessed trial tokens shared across calls.
 
-    for topic_index, xml_ids in unranked_retrieval.items():
-        print(f"Ranking topic {topic_index}...")
-        if not xml_ids:
-            ranked_results[topic_index] = ([], [])
+    Returns:
+        Tuple[List[str], List[float], float, float]: The top_k XML IDs in descending order
+        of BM25 score, their scores, and the minimum and maximum score over all candidates.
+    """
+    if statistics is None:
+        statistics = build_corpus_statistics(xml_dir, xml_ids, chunk_size, workers, token_cache)
+    scorer = statistics.scorer(preprocess_text(query), k1=k1, b=b)
+
+    # Min-heap of (score, -position, xml_id); the root is the worst document kept.
+    # On equal scores the earlier candidate ranks higher, as in retrieve_bm25_documents.
+    heap: List[Tuple[float, int, str]] = []
+    min_score, max_score = float('inf'), float('-inf')
+    for start, chunk_ids, tokenized_chunk in _iter_token_chunks(xml_dir, xml_ids, chunk_size, workers, token_cache):
+        chunk_scores = scorer.score(tokenized_chunk)
+        if chunk_scores.shape[0] == 0:
             continue
-        topic_query = queries[topic_index]
-        ranked_ids, ranked_scores = retrieve_bm25_documents(topic_query, xml_dir, xml_ids)
-        ranked_scores = normalize_bm25_scores(ranked_scores)
-        ranked_results[topic_index] = (ranked_ids, ranked_scores)
-        print(f"Topic {topic_index}: {len(ranked_ids)} documents ranked.")
+        min_score = min(min_score, float(chunk_scores.min()))
+        max_score = max(max_score, float(chunk_scores.max()))
+        for index in top_k_indices(chunk_scores, top_k):
+            entry = (float(chunk_scores[index]), -(start + int(index)), chunk_ids[index])
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+            else:
+                # Chunk candidates arrive best first, so the rest cannot enter the heap.
+                break
+
+    ranked = sorted(heap, reverse=True)
+    ranked_ids = [xml_id for _, _, xml_id in ranked]
+    ranked_scores = [score for score, _, _ in ranked]
+    return ranked_ids, ranked_scores, min_score, max_score
+
+
+def _init_ranking_worker(term_matrix, vocabulary):
+    global _SHARED_CORPUS
+    _SHARED_CORPUS = (term_matrix, vocabulary)
+
+
+def _rank_topic(args) -> Tuple[List[int], List[float]]:
+    topic_query, rows, k1, b = args
+    term_matrix, vocabulary = _SHARED_CORPUS
+    # Corpus statistics are computed over the topic's own candidates, as in retrieve_bm25_documents.
+    bm25_model = SparseBM25(term_matrix[rows], vocabulary, k1=k1, b=b)
+    order, ranked_scores = bm25_model.top_k(preprocess_text(topic_query))
+    return [rows[index] for index in order], normalize_bm25_scores(ranked_scores)
+
+
+def parallel_bm25_rank_documents(unranked_retrieval: Dict[str, List[str]],
+                                 xml_dir: str,
+                                 query_path: str,
+                                 token_cache_path: Optional[str] = None,
+                                 workers: Optional[int] = None,
+                                 k1: float = 0.75,
+                                 b: float = 0.75,
+                                 query_ids: Optional[Dict[Any, str]] = None) -> Dict[str, Tuple[List[str], List[float]]]:
+    """
+    Ranks the candidates of every topic in parallel. The union of candidate trials
+    is parsed and tokenized once, and every topic is scored against that shared corpus.
+    Results are identical to bm25_rank_documents.
+
+    Parameters:
+        unranked_retrieval (Dict[str, List[str]]): Candidate trial ids for each topic.
+        xml_dir (str): Directory containing the XML files.
+        query_path (str): Path to the JSON file of topic queries.
+        token_cache_path (Optional[str]): Path of the persistent token cache.
+        workers (Optional[int]): Number of worker processes (default: CPU count).
+        k1 (float): BM25 k1 parameter (default: 0.75).
+        b (float): BM25 b parameter (default: 0.75).
+        query_ids (Optional[Dict[Any, str]]): Topic whose query ranks each key of
+            unranked_retrieval (default: the key itself).
+
+    Returns:
+        Dict[str, Tuple[List[str], List[float]]]: Ranked trial ids and normalized scores per topic.
+    """
+    workers = workers or os.cpu_count() or 1
+    queries = load_json(query_path)
+    if query_ids is not None:
+        queries = {key: queries[topic_id] for key, topic_id in query_ids.items()}
+    token_cache = TokenCache(token_cache_path)
+
+    # Tokenize every trial retrieved by at least one topic exactly once.
+    unique_ids = list(dict.fromkeys(xml_id for xml_ids in unranked_retrieval.values() for xml_id in xml_ids))
+    print(f"Tokenizing {len(unique_ids)} unique trials for {len(unranked_retrieval)} topics...")
+    trial_tokens = tokenize_trials(xml_dir, unique_ids, token_cache, workers)
+    token_cache.save()
+
+    term_matrix, vocabulary = build_term_matrix(trial_tokens[xml_id] for xml_id in unique_ids)
+    row_index = {xml_id: row for row, xml_id in enumerate(unique_ids)}
+
+    topic_ids = [topic_id for topic_id, xml_ids in unranked_retrieval.items() if xml_ids]
+    tasks = [(queries[topic_id], [row_index[xml_id] for xml_id in unranked_retrieval[topic_id]], k1, b)
+             for topic_id in topic_ids]
+
+    if workers == 1 or len(tasks) < 2:
+        _init_ranking_worker(term_matrix, vocabulary)
+        topic_rankings = map(_rank_topic, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_ranking_worker,
+                                       initargs=(term_matrix, vocabulary))
+        topic_rankings = executor.map(_rank_topic, tasks)
+
+    ranked_results: Dict[str, Tuple[List[str], List[float]]] = {topic_id: ([], []) for topic_id in unranked_retrieval}
+    try:
+        for topic_id, (ranked_rows, ranked_scores) in zip(topic_ids, topic_rankings):
+            ranked_results[topic_id] = ([unique_ids[row] for row in ranked_rows], ranked_scores)
+            print(f"Topic {topic_id}: {len(ranked_rows)} documents ranked.")
+    finally:
+        if executor is not None:
+            executor.shutdown()
     return ranked_results
 
 
-def normalize_bm25_scores(scores: List[float]) -> List[float]:
+def normalize_bm25_scores(scores: List[float],
+                          min_score: Optional[float] = None,
+                          max_score: Optional[float] = None) -> List[float]:
     """
     Normalizes a list of BM25 scores to the range [0, 2].
 
     Parameters:
         scores (List[float]): The BM25 scores to normalize.
+        min_score (Optional[float]): Lower bound of the scale (default: min of scores).
+            Used when scores holds only the top of a longer ranking.
+        max_score (Optional[float]): Upper bound of the scale (default: max of scores).
 
     Returns:
         List[float]: Normalized BM25 scores in the range [0, 2].
     """
-    if not scores:
+    if len(scores) == 0:
         return []
 
-    min_score = min(scores)
-    max_score = max(scores)
+    scores = np.asarray(scores, dtype=np.float64)
+    min_score = scores.min() if min_score is None else min_score
+    max_score = scores.max() if max_score is None else max_score
 
     if max_score == min_score:
-        return [1.0 for _ in scores]
+        return np.ones_like(scores).tolist()
 
-    normalized = [
-        2.0 * (score - min_score) / (max_score - min_score)
-        for score in scores
-    ]
+    normalized = 2.0 * (scores - min_score) / (max_score - min_score)
     # Clamp values to the [0, 2] range.
-    return [max(0.0, min(2.0, ns)) for ns in normalized]
+    return np.clip(normalized, 0.0, 2.0).tolist()
 
 
 # def generate_candidate_documents(topic_number: int,
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+from typing import Any, Dict, List, Optional
+from .json import load_json
+
+
+def journal_path(json_path: str) -> str:
+    """
+    Returns the path of the journal kept next to a stage's JSON results file.
+    """
+    return f"{os.path.splitext(json_path)[0]}.journal.jsonl"
+
+
+def _set_nested(state: Dict[str, Any], keys: List[str], value: Any):
+    for key in keys[:-1]:
+        state = state.setdefault(key, {})
+    state[keys[-1]] = value
+
+
+def replay_journal(path: str, state: Dict[str, Any]) -> int:
+    """
+    Applies the records of a journal to a results dict in place. A record cut short by
+    a crash can only be the last line and is ignored.
+
+    Returns:
+        int: The number of records applied.
+    """
+    if not os.path.exists(path):
+        return 0
+    applied = 0
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            _set_nested(state, record["keys"], record["value"])
+            applied += 1
+    return applied
+
+
+def _write_json_atomic(data: Dict[str, Any], path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file, indent=4)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class CheckpointJournal:
+    """
+    Append-only checkpoint of a stage's results.
+
+    Each finished item is appended to a JSON Lines journal as one record instead of
+    rewriting the whole results file, so checkpoint cost stays constant per item. Records
+    are flushed to the operating system immediately and fsynced in batches of fsync_every
+    records or every fsync_interval seconds. On startup the results file and the journal
+    are replayed into `state`; compaction rewrites the results file and empties the journal.
+
+    Used as a context manager, the journal is compacted when the block completes and
+    kept for the next resume when it raises.
+
+    Parameters:
+        json_path (str): The stage's JSON results file.
+        fsync_every (int): Number of records between fsyncs.
+        fsync_interval (float): Maximum number of seconds between fsyncs.
+    """
+
+    def __init__(self, json_path: str, fsync_every: int = 64, fsync_interval: float = 5.0):
+        self.json_path = json_path
+        self.path = journal_path(json_path)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.state: Dict[str, Any] = load_json(json_path) if os.path.exists(json_path) else {}
+        self.replayed = replay_journal(self.path, self.state)
+        self._drop_partial_record()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def _drop_partial_record(self):
+        # A record cut short by a crash must not be glued to the next appended record.
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as file:
+            data = file.read()
+            if data and not data.endswith(b'\n'):
+                file.truncate(data.rfind(b'\n') + 1)
+
+    def record(self, keys: List[Any], value: Any):
+        """
+        Sets state[keys[0]][keys[1]]... to value and appends the change to the journal.
+        """
+        keys = [str(key) for key in keys]
+        _set_nested(self.state, keys, value)
+        self._file.write(json.dumps({"keys": keys, "value": value}) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.time() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def compact(self):
+        """
+        Writes the current state to the results file and empties the journal.
+        """
+        self.sync()
+        _write_json_atomic(self.state, self.json_path)
+        self._file.truncate(0)
+        self._file.seek(0)
+
+    def close(self, compact: bool = True):
+        """
+        Closes the journal. With compact, the results file is rewritten and the
+        emptied journal removed; otherwise the journal is kept for the next resume.
+        """
+        if compact:
+            self.compact()
+        else:
+            self.sync()
+        self._file.close()
+        if compact:
+            os.remove(self.path)
+
+    def __enter__(self) -> 'CheckpointJournal':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(compact=exc_type is None)
+
+
+def compact_checkpoint(json_path: str) -> Optional[int]:
+    """
+    Folds a stage's journal into its JSON results file, e.g. after an interrupted run.
+
+    Returns:
+        Optional[int]: The number of journal records folded in, or None without a journal.
+    """
+    if not os.path.exists(journal_path(json_path)):
+        return None
+    journal = CheckpointJournal(json_path)
+    replayed = journal.replayed
+    journal.close(compact=True)
+    return replayed
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .json import load_json
+from .BM25 import normalize_bm25_scores
+from .sparse_bm25 import SparseBM25, build_term_matrix, top_k_indices
+from .tokenization import TokenCache, preprocess_text, tokenize_trials
+from .demographics import TrialDemographics, parse_structured_topic
+from .evaluation import qrel_format
+
+
+def load_cohort(cohort_path: str) -> List[Dict[str, Any]]:
+    """
+    Loads patient profiles from a JSON Lines file. Each line holds one patient:
+        - "patient_id": unique identifier, used as the topic id of the run files
+        - "description": free-text profile, used as the BM25 query
+        - "snomed_id": SNOMED-CT concept of the patient's mapped diagnosis
+        - "demographics": list such as ["age: 62 years", "gender: female"], or
+          "structured": a structured profile in the processed topics format
+    """
+    patients = []
+    with open(cohort_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                patients.append(json.loads(line))
+    return patients
+
+
+def patient_demographics(patient: Dict[str, Any]) -> List[str]:
+    if 'demographics' in patient:
+        return patient['demographics']
+    structured = patient.get('structured')
+    if structured:
+        return parse_structured_topic(structured).get('demographic characteristics', [])
+    return []
+
+
+def build_concept_trials(conditions_mapping_path: str) -> Dict[str, List[str]]:
+    """
+    Inverts the mapped trial conditions into SNOMED-CT concept -> trial ids.
+    """
+    mapped_conditions = load_json(conditions_mapping_path)
+    concept_trials: Dict[str, Dict[str, None]] = {}
+    for mapping in mapped_conditions.values():
+        trials = concept_trials.setdefault(str(mapping['ID']), {})
+        for trial_file in mapping.get('Associated trials', []):
+            trials[os.path.splitext(trial_file)[0]] = None
+    return {concept: list(trials) for concept, trials in concept_trials.items()}
+
+
+def expand_concept(concept_id: str, SNOMEDCT_US=None, depth: int = 0) -> List[str]:
+    """
+    Returns the concept followed by its descendants up to the given depth. A concept missing
+    from the ontology is returned without descendants.
+    """
+    concepts = [str(concept_id)]
+    if SNOMEDCT_US is None or depth <= 0:
+        return concepts
+    root = SNOMEDCT_US[concept_id]
+    if root is None:
+        print(f"Warning: SNOMED-CT concept {concept_id} is not in the ontology, no descendants added")
+        return concepts
+    seen = set(concepts)
+    frontier = [root]
+    for _ in range(depth):
+        next_frontier = []
+        for concept in frontier:
+            for child in concept.children:
+                child_id = str(child.name)
+                if child_id not in seen:
+                    seen.add(child_id)
+                    concepts.append(child_id)
+                    next_frontier.append(child)
+        frontier = next_frontier
+    return concepts
+
+
+def _group_by_concept(patients: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+    groups: Dict[str, List[int]] = {}
+    for index, patient in enumerate(patients):
+        groups.setdefault(str(patient.get('snomed_id')), []).append(index)
+    return groups
+
+
+def _batches(items: List[int], batch_size: int) -> Iterable[List[int]]:
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def _rank_patient(scores: np.ndarray, candidate_ids: List[str], top_k: int,
+                  rows: Optional[np.ndarray] = None) -> Tuple[List[str], List[float]]:
+    # Scores are normalized over every candidate, as in bm25_rank_documents.
+    min_score, max_score = float(scores.min()), float(scores.max())
+    if rows is None:
+        rows = np.arange(scores.shape[0])
+    order = rows[top_k_indices(scores[rows], top_k)]
+    ranked_scores = normalize_bm25_scores(scores[order], min_score, max_score)
+    return [candidate_ids[row] for row in order], ranked_scores
+
+
+def run_cohort_retrieval(cohort_path: str,
+                         conditions_mapping_path: str,
+                         trials_xml_directory: str,
+                         output_directory: str,
+                         SNOMEDCT_US=None,
+                         depth: int = 0,
+                         top_k: int = 1000,
+                         batch_size: int = 256,
+                         token_cache_path: Optional[str] = None,
+                         demographics_path: Optional[str] = None,
+                         workers: Optional[int] = None,
+                         save_ranked: bool = True):
+    """
+    Ranks trials for a whole cohort of patients, sharing work across patients.
+
+    Patients are grouped by mapped SNOMED-CT concept so each candidate set is generated
+    once. The union of candidates is tokenized once into a shared term matrix. Within a
+    group, BM25 scores for a batch of patients come from one sparse query-by-document
+    product, and demographics from one patients-by-trials boolean mask. Run lines are
+    appended to 'ranked_retrieval.txt' and 'filtered_retrieval.txt' in the output
+    directory as each batch finishes.
+
+    Parameters:
+        cohort_path (str): JSON Lines file of patient profiles (see load_cohort).
+        conditions_mapping_path (str): Mapped trial conditions produced by run_map_conditions.
+        trials_xml_directory (str): Directory containing the trial XML files.
+        output_directory (str): Directory where the run files are written.
+        SNOMEDCT_US: Loaded SNOMED-CT ontology, used to add descendant concepts.
+        depth (int): Descendant depth added to each patient's concept.
+        top_k (int): Number of trials kept per patient.
+        batch_size (int): Number of patients scored together.
+        token_cache_path (Optional[str]): Path of the persistent token cache.
+        demographics_path (Optional[str]): Path of the persistent trial demographics table.
+        workers (Optional[int]): Number of tokenizer worker processes (default: CPU count).
+        save_ranked (bool): Also write the run without demographic filtering.
+    """
+    start_time = time.time()
+    patients = load_cohort(cohort_path)
+    concept_trials = build_concept_trials(conditions_mapping_path)
+    groups = _group_by_concept(patients)
+    print(f"{len(patients)} patients in {len(groups)} concept groups")
+    unmapped = [str(patients[index]['patient_id']) for index in groups.get('None', [])]
+    if unmapped:
+        listed = ', '.join(unmapped[:10]) + (', ...' if len(unmapped) > 10 else '')
+        print(f"Warning: {len(unmapped)} patients have no snomed_id and get empty runs: {listed}")
+
+    # Candidate generation, once per concept.
+    group_candidates: Dict[str, List[str]] = {}
+    for concept_id in groups:
+        candidates: Dict[str, None] = {}
+        if concept_id != 'None':
+            for concept in expand_concept(concept_id, SNOMEDCT_US, depth):
+                candidates.update(dict.fromkeys(concept_trials.get(concept, [])))
+        group_candidates[concept_id] = list(candidates)
+
+    # Tokenize and parse demographics of every candidate once.
+    unique_ids = list(dict.fromkeys(trial_id for candidates in group_candidates.values() for trial_id in candidates))
+    print(f"Tokenizing {len(unique_ids)} unique candidate trials...")
+    token_cache = TokenCache(token_cache_path)
+    trial_tokens = tokenize_trials(trials_xml_directory, unique_ids, token_cache, workers)
+    token_cache.save()
+    term_matrix, vocabulary = build_term_matrix(trial_tokens[trial_id] for trial_id in unique_ids)
+    del trial_tokens
+    row_index = {trial_id: row for row, trial_id in enumerate(unique_ids)}
+
+    if demographics_path is not None and os.path.exists(demographics_path):
+        demographics_table = TrialDemographics.load(demographics_path)
+    else:
+        demographics_table = TrialDemographics()
+    demographics_table.extend(unique_ids, trials_xml_directory)
+    if demographics_path is not None:
+        demographics_table.save(demographics_path)
+
+    os.makedirs(output_directory, exist_ok=True)
+    ranked_path = os.path.join(output_directory, 'ranked_retrieval.txt')
+    filtered_path = os.path.join(output_directory, 'filtered_retrieval.txt')
+    ranked_file = open(ranked_path, 'w') if save_ranked else None
+    filtered_file = open(filtered_path, 'w')
+
+    processed = 0
+    try:
+        for concept_id, patient_indices in groups.items():
+            candidate_ids = group_candidates[concept_id]
+            if candidate_ids:
+                bm25_model = SparseBM25(term_matrix[[row_index[trial_id] for trial_id in candidate_ids]], vocabulary)
+
+            for batch in _batches(patient_indices, batch_size):
+                ranked_batch: Dict[str, Tuple[List[str], List[float]]] = {}
+                filtered_batch: Dict[str, Tuple[List[str], List[float]]] = {}
+                if candidate_ids:
+                    queries = [preprocess_text(patients[index].get('description', '')) for index in batch]
+                    scores = bm25_model.get_batch_scores(queries)
+                    eligibility = demographics_table.eligibility_matrix(
+                        candidate_ids, [patient_demographics(patients[index]) for index in batch])
+                for column, index in enumerate(batch):
+                    patient_id = str(patients[index]['patient_id'])
+                    if not candidate_ids:
+                        ranked_batch[patient_id] = filtered_batch[patient_id] = ([], [])
+                        continue
+                    patient_scores = scores[:, column]
+                    if save_ranked:
+                        ranked_batch[patient_id] = _rank_patient(patient_scores, candidate_ids, top_k)
+                    filtered_batch[patient_id] = _rank_patient(
+                        patient_scores, candidate_ids, top_k, np.flatnonzero(eligibility[column]))
+
+                if save_ranked:
+                    ranked_file.writelines(f"{line}\n" for line in qrel_format(ranked_batch))
+                    ranked_file.flush()
+                filtered_file.writelines(f"{line}\n" for line in qrel_format(filtered_batch))
+                filtered_file.flush()
+
+                processed += len(batch)
+                elapsed = time.time() - start_time
+                print(f"{processed}/{len(patients)} patients ranked - {processed / elapsed:.1f} patients/s")
+    finally:
+        filtered_file.close()
+        if ranked_file is not None:
+            ranked_file.close()
+
+    print(f"Cohort retrieval finished in {time.time() - start_time:.2f} seconds")
@@ -6,6 +6,7 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 RAW_DIR = os.path.join(DATA_DIR, "raw")
 PROCESSED_DIR = os.path.join(DATA_DIR, "processed")
 PROMPT_DIR = os.path.join(DATA_DIR, "prompts")
+RESOURCES_DIR = os.path.join(DATA_DIR, "resources")
 
 # RUN SETTINGS
 # Model provider: "ollama" or "openai"
@@ -14,6 +15,48 @@ MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "ollama")
 MODEL_NAME = os.getenv("MODEL_NAME", "qwen2")
 # OpenAI API key (optional, can also be set via OPENAI_API_KEY env var)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", None)
+# Ollama hosts requests are balanced over, comma-separated (empty: the default host only)
+OLLAMA_HOSTS = [host.strip() for host in os.getenv("OLLAMA_HOSTS", "").split(",") if host.strip()]
+# How long Ollama keeps a model loaded after each request of a stage (None: the server default).
+# The stage scripts load the model before the stage, so idle gaps do not unload it.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m") or None
+# Context sizes (num_ctx) Ollama requests choose from by estimated prompt length, e.g.
+# [2048, 4096, 8192, 16384, 32768] (empty: the server default). Prompts longer than the
+# server default are then no longer truncated, so outputs may differ.
+OLLAMA_CONTEXT_BUCKETS = []
+# Maximum number of model requests in flight at once in the labelling stages (default: 4 per Ollama host)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", str(4 * max(1, len(OLLAMA_HOSTS)))))
+# Fine labelling requests the streaming pipeline (run_pipeline.py) lets wait before it pauses
+# trial structuring, so structured trials do not pile up ahead of fine labelling
+PIPELINE_QUEUE_SIZE = 4 * MAX_CONCURRENT_REQUESTS
+# Requests per second allowed per provider, or a (rate, burst) pair; None for no limit
+MODEL_RATE_LIMITS = {
+    "ollama": None,
+    "openai": float(os.getenv("OPENAI_REQUESTS_PER_SECOND", "8")),
+}
+# Retries of a failed model request (rate limited, timed out, connection lost), with exponential backoff
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "5"))
+# Hedged requests: a request slower than this latency percentile of recent requests is
+# duplicated and the first answer kept (None to disable), e.g. 95
+HEDGE_PERCENTILE = None
+# Maximum duplicate requests, as a fraction of all requests
+HEDGE_BUDGET = 0.05
+# Alternate Ollama hosts or OpenAI base URLs the duplicates are sent to (empty: the same host)
+HEDGE_HOSTS = []
+# Model responses cached across stages and runs, keyed by a hash of the request (empty to disable)
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(PROCESSED_DIR, "model_responses.sqlite"))
+# Least recently used responses are evicted above this size
+RESPONSE_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Small model tried first when a stage routes prompts by model size (see MODEL_ROUTES)
+SMALL_MODEL_NAME = os.getenv("SMALL_MODEL_NAME", "qwen2:0.5b")
+# Per-stage escalation order, smallest model first, e.g. [SMALL_MODEL_NAME, MODEL_NAME].
+# Outputs the stage cannot parse escalate to the next model; an empty list uses MODEL_NAME only.
+MODEL_ROUTES = {
+    "topics": [],
+    "trials": [],
+    "coarse": [],
+    "fine": [],
+}
 
 # Backward compatibility
 OLLAMA_MODEL = MODEL_NAME
@@ -47,11 +90,85 @@ PROCESSED_TOPICS_PATH = os.path.join(RESULTS_DIR, "processed_topics.json")
 TREC_QRELS_PATH = os.path.join(RAW_DIR, "TREC_2022_qrels.txt")
 TOPIC_DIR = os.path.join(PROCESSED_DIR, "topic_descriptions.json")
 STRUCTURED_TOPIC_DIR = os.path.join(RESULTS_DIR, "processed_topics.json")
+# Preprocessed trial tokens, shared by BM25 ranking and other lexical features
+TOKEN_CACHE_PATH = os.path.join(PROCESSED_DIR, "trial_tokens.pkl")
+# Bundled copy of nltk's English stopwords, so tokenization never needs a download
+STOPWORDS_PATH = os.path.join(RESOURCES_DIR, "english_stopwords.txt")
+# Tokenize the union of candidate trials once and rank topics in parallel
+PARALLEL_RANKING = True
+# Topics with more candidates than this are ranked in chunks, keeping only the top 1000
+# (None: rank every topic in memory and keep all its candidates), e.g. 20000
+BM25_STREAMING_THRESHOLD = None
+# Age limits and gender requirements of every trial parsed so far
+TRIAL_DEMOGRAPHICS_PATH = os.path.join(PROCESSED_DIR, "trial_demographics.npz")
+# Drop trials closed to the patient's age or gender before BM25 ranking. BM25 statistics
+# then cover only the open trials, so scores differ slightly from post-filtering.
+DEMOGRAPHIC_PREFILTER = False
+# Also rank the unfiltered candidates and save the 'ranked_retrieval' run
+SAVE_RANKED_RETRIEVAL = True
+# Patient profiles (JSON Lines) ranked together by run_cohort_retrieval
+COHORT_PATH = os.path.join(RAW_DIR, "cohort.jsonl")
+COHORT_RESULTS_DIR = os.path.join(RESULTS_DIR, "cohort_retrieval")
+# Patients scored together in one sparse BM25 product
+COHORT_BATCH_SIZE = 256
 
 # File paths for Step 7: Trial Structuring
 TOP_N = 50
+# Adaptive labelling depth: with a budget of model calls, each topic labels its top trials by
+# normalized retrieval score across all topics (at least ADAPTIVE_DEPTH_MIN, at most TOP_N)
+# instead of exactly TOP_N (None: fixed TOP_N). ADAPTIVE_DEPTH_CALLS_PER_TRIAL is the number
+# of calls one (topic, trial) pair costs, e.g. 1 for coarse labelling.
+ADAPTIVE_DEPTH_CALL_BUDGET = None
+ADAPTIVE_DEPTH_CALLS_PER_TRIAL = 1
+ADAPTIVE_DEPTH_MIN = 10
 
 # File paths for Step 7: Coarse Labelling
 
+# Cascade: which coarse-labelled trials go on to fine labelling. "full" labels every
+# trial (same as running both stages); "eligible_or_ambiguous" and "eligible_only" skip
+# trials the coarse label excludes, which then score on their coarse label alone.
+CASCADE_POLICY = "full"
+
+# Prompt layout of the coarse and fine labelling stages: "template" keeps the order of the
+# prompt files (instructions, criteria, patient profile); "profile_first" puts the patient
+# profile before the criteria, so the requests of one topic share a longer cached prefix.
+PROMPT_LAYOUT = "template"
+# Send the instructions of the prompt templates as chat system messages
+USE_SYSTEM_MESSAGES = False
+# Generation limits per stage: max_tokens caps the answer length (None: no limit), stop lists
+# stop sequences, and early_stop streams the answer and ends it once it holds a parseable
+# label (coarse: a label; fine: one label per criterion)
+GENERATION_LIMITS = {
+    "trials": {"max_tokens": None, "stop": []},
+    "coarse": {"max_tokens": None, "stop": [], "early_stop": False},
+    "fine": {"max_tokens": None, "stop": [], "early_stop": False},
+}
+# Maximum estimated prompt tokens per model call (None: no limit), e.g. 6144. Trials whose
+# criteria exceed it are structured (trials) or labelled (coarse) in chunks of criteria sent
+# one after another, and the chunk outputs are merged, so outputs of long trials may differ.
+PROMPT_TOKEN_BUDGETS = {
+    "trials": None,
+    "coarse": None,
+}
+# Order the labelling stages send (topic, trial) pairs in: "topic" (topic by topic, which
+# shares prompt prefixes) or "rank" (by initial retrieval rank across all topics, so a run
+# stopped early or by its budget has labels for the best-ranked trials of every topic)
+LABELLING_ORDER = "topic"
+# Budget of a labelling run in model calls and seconds (None: no limit); work beyond it is
+# left for the next run. Use with LABELLING_ORDER = "rank".
+LABELLING_CALL_BUDGET = None
+LABELLING_TIME_BUDGET = None
+# Evaluate re-ranking on partial labels: trials without labels are ranked among the labelled
+# trials of their topic, in initial retrieval order
+EVALUATE_PARTIAL_LABELS = False
+# Where unlabelled trials go when evaluating partial labels: "after_positive" (after the
+# labelled trials with a positive score, ahead of the excluded ones) or "last"
+UNLABELLED_PLACEMENT = "after_positive"
+
 # File paths for Step 8: Fine Labelling
+# Label each distinct (criterion, patient characteristics) pair once instead of whole
+# criteria blocks per trial. Labels then come from batched prompts, so outputs may differ.
+FINE_LABELLING_DEDUPLICATE = False
+# Number of distinct criteria labelled per prompt when deduplicating
+FINE_LABELLING_BATCH_SIZE = 10
 
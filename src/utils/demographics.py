@@ -1,9 +1,23 @@
 import os
 import re
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
 from .xml_parsing import xml_processing
 from .json import load_json
 
+# Conversion factors used to normalize ages to years.
+AGE_CONVERSION_FACTORS = {
+    'day': 1 / 365,
+    'week': 1 / 52,
+    'month': 1 / 12,
+    'year': 1,
+}
+
+# Trial gender requirements are encoded as indices into this list. Each canonical value
+# behaves exactly like the raw requirement strings it stands for under the substring
+# checks of evaluate_demographic_relevance.
+CANONICAL_TRIAL_GENDERS = ['all', 'male', 'female', 'other']
+
 
 def extract_trial_conditions(trial_id: str, base_path: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
     """
@@ -112,16 +126,9 @@ def is_age_within_range(patient_age: Optional[int],
         max_age = 1000
         max_unit = 'year'
 
-    conversion_factors = {
-        'day': 1 / 365,
-        'week': 1 / 52,
-        'month': 1 / 12,
-        'year': 1,
-    }
-
-    patient_age_years = patient_age * conversion_factors.get(patient_unit, 1)
-    min_age_years = min_age * conversion_factors.get(min_unit, 1)
-    max_age_years = max_age * conversion_factors.get(max_unit, 1)
+    patient_age_years = patient_age * AGE_CONVERSION_FACTORS.get(patient_unit, 1)
+    min_age_years = min_age * AGE_CONVERSION_FACTORS.get(min_unit, 1)
+    max_age_years = max_age * AGE_CONVERSION_FACTORS.get(max_unit, 1)
 
     return min_age_years <= patient_age_years <= max_age_years
 
@@ -170,6 +177,27 @@ def evaluate_demographic_relevance(
     else:
         max_age, max_unit = 1000, 'year'
 
+    found_age, patient_age, patient_unit, found_gender, patient_gender = parse_patient_demographics(
+        patient_demographics)
+
+    age_relevance = is_age_within_range(
+        patient_age, patient_unit, min_age, max_age, min_unit, max_unit
+    ) if found_age else True
+
+    gender_relevance = is_gender_compatible(patient_gender, trial_gender) if found_gender else True
+
+    return age_relevance, gender_relevance
+
+
+def parse_patient_demographics(
+    patient_demographics: List[str]
+) -> Tuple[bool, Optional[int], Optional[str], bool, Optional[str]]:
+    """
+    Extracts the patient's age and gender from their demographic characteristics.
+
+    :param patient_demographics: A list of strings representing the patient's demographic info.
+    :return: A tuple (found_age, age, age_unit, found_gender, gender).
+    """
     patient_age: Optional[int] = None
     patient_unit: Optional[str] = None
     patient_gender: Optional[str] = None
@@ -189,25 +217,276 @@ def evaluate_demographic_relevance(
                     found_gender = True
                     break
 
-    age_relevance = is_age_within_range(
-        patient_age, patient_unit, min_age, max_age, min_unit, max_unit
-    ) if found_age else True
+    return found_age, patient_age, patient_unit, found_gender, patient_gender
 
-    if found_gender:
-        gender_relevance = (
-            True if 'all' in trial_gender.lower() or (patient_gender and patient_gender in trial_gender.lower())
-            else False
-        )
-    else:
-        gender_relevance = True
 
-    return age_relevance, gender_relevance
+def is_gender_compatible(patient_gender: Optional[str], trial_gender: Optional[str]) -> bool:
+    """
+    Checks if a trial's gender requirement admits the patient's gender.
+
+    :param patient_gender: The patient's gender keyword.
+    :param trial_gender: The trial's gender requirement (defaults to 'all' if unspecified).
+    :return: True if the trial admits the patient; otherwise, False.
+    """
+    trial_gender = (trial_gender or 'all').lower()
+    return 'all' in trial_gender or bool(patient_gender and patient_gender in trial_gender)
+
+
+def encode_trial_gender(trial_gender: Optional[str]) -> int:
+    """
+    Encodes a trial's gender requirement as an index into CANONICAL_TRIAL_GENDERS.
+
+    :param trial_gender: The trial's gender requirement (defaults to 'all' if unspecified).
+    :return: The gender code.
+    """
+    trial_gender = (trial_gender or 'all').lower()
+    if 'all' in trial_gender:
+        return 0
+    if 'female' in trial_gender:
+        return 2
+    if 'male' in trial_gender:
+        return 1
+    return 3
+
+
+def trial_age_in_years(age_str: Optional[str], default_years: int) -> float:
+    """
+    Normalizes a trial's age limit to years, falling back to the default when the
+    limit is missing or unparsable, exactly as evaluate_demographic_relevance does.
+
+    :param age_str: The trial's age limit as a string.
+    :param default_years: The limit used when none is given (0 for minimum, 1000 for maximum).
+    :return: The age limit in years.
+    """
+    if not age_str:
+        return float(default_years)
+    age, unit = parse_age_and_unit(age_str)
+    if not age:
+        return float(default_years)
+    return age * AGE_CONVERSION_FACTORS.get(unit or 'year', 1)
+
+
+class TrialDemographics:
+    """
+    Precomputed age limits and gender requirements of a set of trials, held as NumPy
+    arrays indexed by trial id, so eligibility is a vectorized mask instead of an XML
+    parse per (topic, trial) pair.
+
+    Ages are kept in years rather than days: the conversion factors are not multiples
+    of a day (52 weeks are 364 days), so years is the only unit that reproduces the
+    comparisons of evaluate_demographic_relevance exactly.
+    """
+
+    def __init__(self,
+                 trial_ids: Iterable[str] = (),
+                 min_age_years: Iterable[float] = (),
+                 max_age_years: Iterable[float] = (),
+                 gender_codes: Iterable[int] = ()):
+        self.trial_ids = list(trial_ids)
+        self.min_age_years = np.asarray(list(min_age_years), dtype=np.float64)
+        self.max_age_years = np.asarray(list(max_age_years), dtype=np.float64)
+        self.gender_codes = np.asarray(list(gender_codes), dtype=np.int8)
+        self.index = {trial_id: row for row, trial_id in enumerate(self.trial_ids)}
+
+    def __len__(self) -> int:
+        return len(self.trial_ids)
+
+    def __contains__(self, trial_id: str) -> bool:
+        return trial_id in self.index
+
+    @classmethod
+    def build(cls, trial_ids: Iterable[str], base_path: str) -> 'TrialDemographics':
+        """
+        Parses each trial's XML file once and builds the table.
+
+        :param trial_ids: The clinical trial identifiers.
+        :param base_path: The directory path where the XML files are located.
+        :return: The demographics table.
+        """
+        table = cls()
+        table.extend(trial_ids, base_path)
+        return table
+
+    def extend(self, trial_ids: Iterable[str], base_path: str) -> int:
+        """
+        Adds the trials missing from the table.
+
+        :param trial_ids: The clinical trial identifiers.
+        :param base_path: The directory path where the XML files are located.
+        :return: The number of trials added.
+        """
+        missing = [trial_id for trial_id in dict.fromkeys(trial_ids) if trial_id not in self.index]
+        if not missing:
+            return 0
+        min_ages, max_ages, genders = [], [], []
+        for trial_id in missing:
+            gender, minimum_age, maximum_age = extract_trial_conditions(trial_id, base_path)
+            min_ages.append(trial_age_in_years(minimum_age, 0))
+            max_ages.append(trial_age_in_years(maximum_age, 1000))
+            genders.append(encode_trial_gender(gender))
+        for trial_id in missing:
+            self.index[trial_id] = len(self.trial_ids)
+            self.trial_ids.append(trial_id)
+        self.min_age_years = np.concatenate([self.min_age_years, np.asarray(min_ages, dtype=np.float64)])
+        self.max_age_years = np.concatenate([self.max_age_years, np.asarray(max_ages, dtype=np.float64)])
+        self.gender_codes = np.concatenate([self.gender_codes, np.asarray(genders, dtype=np.int8)])
+        return len(missing)
+
+    def rows(self, trial_ids: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.index[trial_id] for trial_id in trial_ids), dtype=np.int64)
+
+    def eligible_mask(self, trial_ids: List[str], patient_demographics: List[str]) -> np.ndarray:
+        """
+        Evaluates age and gender compatibility of a patient with many trials at once.
+
+        :param trial_ids: The clinical trial identifiers, all present in the table.
+        :param patient_demographics: A list of strings representing the patient's demographic info.
+        :return: A boolean array, True where the trial admits the patient.
+        """
+        rows = self.rows(trial_ids)
+        mask = np.ones(rows.shape[0], dtype=bool)
+        found_age, patient_age, patient_unit, found_gender, patient_gender = parse_patient_demographics(
+            patient_demographics)
+
+        if found_age and patient_age is not None:
+            patient_age_years = patient_age * AGE_CONVERSION_FACTORS.get(patient_unit or 'year', 1)
+            mask &= (self.min_age_years[rows] <= patient_age_years) & (patient_age_years <= self.max_age_years[rows])
+
+        if found_gender:
+            compatible = np.array([is_gender_compatible(patient_gender, gender)
+                                   for gender in CANONICAL_TRIAL_GENDERS])
+            mask &= compatible[self.gender_codes[rows]]
+
+        return mask
+
+    def eligibility_matrix(self, trial_ids: List[str], patients_demographics: List[List[str]]) -> np.ndarray:
+        """
+        Evaluates age and gender compatibility of many patients with many trials at once.
+
+        :param trial_ids: The clinical trial identifiers, all present in the table.
+        :param patients_demographics: The demographic info of each patient.
+        :return: A patients-by-trials boolean array, True where the trial admits the patient.
+        """
+        rows = self.rows(trial_ids)
+        min_ages = self.min_age_years[rows]
+        max_ages = self.max_age_years[rows]
+        codes = self.gender_codes[rows]
+
+        n_patients = len(patients_demographics)
+        patient_ages = np.full(n_patients, np.nan)
+        gender_compatibility = np.ones((n_patients, len(CANONICAL_TRIAL_GENDERS)), dtype=bool)
+        for patient, patient_demographics in enumerate(patients_demographics):
+            found_age, patient_age, patient_unit, found_gender, patient_gender = parse_patient_demographics(
+                patient_demographics)
+            if found_age and patient_age is not None:
+                patient_ages[patient] = patient_age * AGE_CONVERSION_FACTORS.get(patient_unit or 'year', 1)
+            if found_gender:
+                gender_compatibility[patient] = [is_gender_compatible(patient_gender, gender)
+                                                 for gender in CANONICAL_TRIAL_GENDERS]
+
+        ages = patient_ages[:, None]
+        # Patients without a parsed age are admitted by every age range.
+        age_ok = np.isnan(ages) | ((min_ages[None, :] <= ages) & (ages <= max_ages[None, :]))
+        return age_ok & gender_compatibility[:, codes]
+
+    def save(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez(path,
+                 trial_ids=np.asarray(self.trial_ids, dtype=str),
+                 min_age_years=self.min_age_years,
+                 max_age_years=self.max_age_years,
+                 gender_codes=self.gender_codes)
+
+    @classmethod
+    def load(cls, path: str) -> 'TrialDemographics':
+        with np.load(path) as data:
+            return cls(data['trial_ids'].tolist(), data['min_age_years'],
+                       data['max_age_years'], data['gender_codes'])
+
+
+class DemographicIndex:
+    """
+    Interval index over trial age ranges, bucketed by gender requirement. Answers
+    "which trials are open to a 62-year-old female" without scanning every trial.
+    """
+
+    def __init__(self, table: TrialDemographics):
+        self.table = table
+        self.buckets = []
+        for code in range(len(CANONICAL_TRIAL_GENDERS)):
+            rows = np.flatnonzero(table.gender_codes == code)
+            # Within a bucket, rows are sorted by minimum age so the trials whose range
+            # starts at or below an age form a prefix found by binary search.
+            rows = rows[np.argsort(table.min_age_years[rows], kind='stable')]
+            self.buckets.append((rows, table.min_age_years[rows], table.max_age_years[rows]))
+
+    def open_rows(self, patient_demographics: List[str]) -> np.ndarray:
+        """
+        Returns the table rows of the trials that admit the patient, in ascending order.
+
+        :param patient_demographics: A list of strings representing the patient's demographic info.
+        :return: The sorted row indices.
+        """
+        found_age, patient_age, patient_unit, found_gender, patient_gender = parse_patient_demographics(
+            patient_demographics)
+        patient_age_years = None
+        if found_age and patient_age is not None:
+            patient_age_years = patient_age * AGE_CONVERSION_FACTORS.get(patient_unit or 'year', 1)
+
+        open_rows = []
+        for code, (rows, min_ages, max_ages) in enumerate(self.buckets):
+            if found_gender and not is_gender_compatible(patient_gender, CANONICAL_TRIAL_GENDERS[code]):
+                continue
+            if patient_age_years is None:
+                open_rows.append(rows)
+                continue
+            end = np.searchsorted(min_ages, patient_age_years, side='right')
+            open_rows.append(rows[:end][max_ages[:end] >= patient_age_years])
+        if not open_rows:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(open_rows))
+
+    def open_trials(self, patient_demographics: List[str]) -> set:
+        return {self.table.trial_ids[row] for row in self.open_rows(patient_demographics)}
+
+
+def prefilter_trials_by_demographics(
+    unranked_trials: Dict[Any, List[str]],
+    topics_json_path: str,
+    demographic_index: DemographicIndex
+) -> Dict[Any, List[str]]:
+    """
+    Removes candidate trials that exclude the patient on age or gender before ranking.
+    Keeps the same trials as filter_trials_by_demographics, but BM25 statistics
+    computed afterwards cover only the trials that remain.
+
+    :param unranked_trials: Dictionary mapping topic IDs to candidate trial IDs.
+    :param topics_json_path: Path to the JSON file containing topics information.
+    :param demographic_index: Index over the demographics of every candidate trial.
+    :return: A dictionary with the candidate trial IDs open to each topic's patient.
+    """
+    topics_demographics = extract_topics_demographics(topics_json_path)
+    prefiltered_trials = {}
+
+    for topic_id, trial_ids in unranked_trials.items():
+        patient_demographics = topics_demographics.get(topic_id)
+        if patient_demographics:
+            open_trials = demographic_index.open_trials(patient_demographics)
+            prefiltered_trials[topic_id] = [trial_id for trial_id in trial_ids if trial_id in open_trials]
+        else:
+            prefiltered_trials[topic_id] = trial_ids
+        print(f'Topic {topic_id}: {len(trial_ids)} candidates -> {len(prefiltered_trials[topic_id])} candidates')
+
+    return prefiltered_trials
 
 
 def filter_trials_by_demographics(
     unfiltered_trials: Dict[Any, Tuple[List[str], List[float]]],
     topics_json_path: str,
-    trial_xml_base_path: str
+    trial_xml_base_path: str,
+    demographics_table: Optional[TrialDemographics] = None
 ) -> Dict[Any, Tuple[List[str], List[float]]]:
     """
     Filters clinical trial retrievals based on demographic relevance.
@@ -217,26 +496,25 @@ def filter_trials_by_demographics(
     :param unfiltered_trials: Dictionary mapping topic IDs to tuples (trial_ids, scores).
     :param topics_json_path: Path to the JSON file containing topics information.
     :param trial_xml_base_path: Directory path where trial XML files are stored.
+    :param demographics_table: Precomputed trial demographics; trials missing from it are
+        parsed and added. A table over the retrieved trials is built when omitted.
     :return: A dictionary with filtered trial IDs and scores for each topic.
     """
     topics_demographics = extract_topics_demographics(topics_json_path)
+    if demographics_table is None:
+        demographics_table = TrialDemographics()
+    demographics_table.extend(
+        (trial_id for trial_ids, _ in unfiltered_trials.values() for trial_id in trial_ids), trial_xml_base_path)
     filtered_trials = {}
 
     for topic_id, (trial_ids, scores) in unfiltered_trials.items():
         unfiltered_ttl = len(trial_ids)
         patient_demographics = topics_demographics.get(topic_id)
-        filtered_trial_ids = []
-        filtered_scores = []
 
         if patient_demographics:
-            for trial_id, score in zip(trial_ids, scores):
-                trial_gender, trial_min_age, trial_max_age = extract_trial_conditions(trial_id, trial_xml_base_path)
-                age_ok, gender_ok = evaluate_demographic_relevance(
-                    trial_min_age, trial_max_age, trial_gender, patient_demographics
-                )
-                if age_ok and gender_ok:
-                    filtered_trial_ids.append(trial_id)
-                    filtered_scores.append(score)
+            keep = np.flatnonzero(demographics_table.eligible_mask(trial_ids, patient_demographics))
+            filtered_trial_ids = [trial_ids[index] for index in keep]
+            filtered_scores = [scores[index] for index in keep]
         else:
             filtered_trial_ids, filtered_scores = trial_ids, scores
 
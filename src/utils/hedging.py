@@ -0,0 +1,175 @@
+"""
+Hedged model requests: when a request runs past the observed tail latency, a duplicate
+is sent to the same or an alternate backend and the first answer wins.
+"""
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent request latencies.
+
+    Args:
+        window: Number of latencies kept
+    """
+
+    def __init__(self, window: int = 500):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """The given percentile (0-100) of the window, or None while it is empty."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(percentile / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+
+class RequestHedger:
+    """
+    Sends a duplicate of a request that is slower than the p-th percentile of recent latencies.
+
+    The duplicate goes to the next of the alternate hosts (or to the request's own host
+    when there are none); whichever answer arrives first is returned and the other request
+    is cancelled, which closes its connection. Requests run as asyncio tasks on a
+    background event loop, so the losing request is really aborted rather than left
+    running in a thread. Hedging starts after min_samples requests have been observed,
+    and the duplicates stay within budget (a fraction of all requests).
+
+    Args:
+        percentile: Latency percentile after which a request is hedged
+        budget: Maximum number of duplicate requests, as a fraction of all requests
+        hosts: Alternate hosts duplicates are sent to, in turn
+        min_samples: Requests observed before hedging starts
+        min_delay: Lower bound of the hedging delay, in seconds
+        window: Number of recent latencies the percentile is computed on
+        on_close: Coroutine function run on the event loop before it is closed, e.g. to
+            close the clients bound to it
+    """
+
+    def __init__(self, percentile: float = 95.0, budget: float = 0.05, hosts: Optional[Sequence[str]] = None,
+                 min_samples: int = 20, min_delay: float = 0.0, window: int = 500,
+                 on_close: Optional[Callable[[], Awaitable[None]]] = None):
+        self.percentile = percentile
+        self.budget = budget
+        self.hosts = list(hosts or [])
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.on_close = on_close
+        self.latencies = LatencyTracker(window)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._next_host = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="request-hedger", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds after which a request is hedged, or None while there are too few samples."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latencies.percentile(self.percentile))
+
+    def _take_hedge(self, host: Optional[str]) -> Optional[Any]:
+        # Reserve one duplicate from the budget; returns the host to send it to.
+        with self._lock:
+            if self.hedged + 1 > self.budget * self.requests:
+                return None
+            self.hedged += 1
+            if not self.hosts:
+                return (host,)
+            hedge_host = self.hosts[self._next_host % len(self.hosts)]
+            self._next_host += 1
+            return (hedge_host,)
+
+    async def _race(self, send: Callable[[Optional[str]], Awaitable[str]], host: Optional[str]) -> str:
+        start_time = time.monotonic()
+        with self._lock:
+            self.requests += 1
+        primary = asyncio.ensure_future(send(host))
+        delay = self.hedge_delay()
+        tasks = {primary}
+        hedge = None
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                reserved = None if done else self._take_hedge(host)
+                if reserved is not None:
+                    hedge = asyncio.ensure_future(send(reserved[0]))
+                    tasks.add(hedge)
+            # The first successful answer wins; a failed request leaves the other one running.
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        self.latencies.add(time.monotonic() - start_time)
+                        return task.result()
+                    if task is primary or error is None:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def call(self, send: Callable[[Optional[str]], Awaitable[str]], host: Optional[str] = None) -> str:
+        """
+        Run send(host) with hedging and return the first answer.
+
+        Args:
+            send: Coroutine function sending the request to the given host
+            host: Host of the primary request
+        """
+        return asyncio.run_coroutine_threadsafe(self._race(send, host), self._event_loop()).result()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay": self.hedge_delay(),
+        }
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Run on_close on the background event loop, then stop and close the loop."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        if self.on_close is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self.on_close(), loop).result(timeout)
+            except Exception as e:
+                logging.warning(f"Could not close the hedging event loop's clients: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
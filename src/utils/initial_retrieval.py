@@ -1,27 +1,68 @@
 from .SNOMED_retrieval import retrieve_relevant_trials
 from .BM25 import bm25_rank_documents
 from .evaluation import save_results_and_evaluate
-from .demographics import filter_trials_by_demographics
+from .demographics import (DemographicIndex, TrialDemographics, filter_trials_by_demographics,
+                           prefilter_trials_by_demographics)
+import os
 
 def run_initial_retrieval(
     diagnoses_mapping_path, conditions_mapping_path, retrieval_depth, qrels_path,
-    trials_xml_directory, topic_directory, SNOMEDCT_US, results_directory, structured_topics_dir):
+    trials_xml_directory, topic_directory, SNOMEDCT_US, results_directory, structured_topics_dir,
+    token_cache_path=None, parallel_ranking=False, streaming_threshold=None, demographics_path=None,
+    demographic_prefilter=False, save_ranked=True):
     """
     Executes the initial retrieval pipeline, including SNOMED-based relevance retrieval
     and BM25 ranking, followed by result saving and evaluation.
+
+    With demographic_prefilter, candidates that exclude the patient on age or gender
+    are removed before BM25 ranking, so only open trials are scored for
+    'filtered_retrieval'. The unfiltered 'ranked_retrieval' run is only produced when
+    save_ranked is set; both candidate sets are then ranked together, so each trial is
+    tokenized once and, with parallel_ranking, the term matrix is built once.
     """
 
     # Perform SNOMED-based relevance retrieval
     relevant_trials = retrieve_relevant_trials(
         diagnoses_mapping_path, conditions_mapping_path, qrels_path, SNOMEDCT_US)
 
-    # Rank retrieved trials using BM25
-    ranked_trials = bm25_rank_documents(relevant_trials, trials_xml_directory, topic_directory)
+    # Trial demographics are parsed once per corpus and reused across runs
+    if demographics_path is not None and os.path.exists(demographics_path):
+        demographics_table = TrialDemographics.load(demographics_path)
+    else:
+        demographics_table = TrialDemographics()
+
+    def rank(unranked_trials, query_ids=None):
+        return bm25_rank_documents(
+            unranked_trials, trials_xml_directory, topic_directory, token_cache_path=token_cache_path,
+            parallel=parallel_ranking, streaming_threshold=streaming_threshold, query_ids=query_ids)
+
+    ranked_trials = None
+    if demographic_prefilter:
+        demographics_table.extend(
+            (trial_id for trial_ids in relevant_trials.values() for trial_id in trial_ids), trials_xml_directory)
+        prefiltered_trials = prefilter_trials_by_demographics(
+            relevant_trials, structured_topics_dir, DemographicIndex(demographics_table))
+        if save_ranked:
+            # Rank the unfiltered and prefiltered candidates of each topic in one pass.
+            candidate_sets = {**{(topic_id, False): trial_ids for topic_id, trial_ids in relevant_trials.items()},
+                              **{(topic_id, True): trial_ids for topic_id, trial_ids in prefiltered_trials.items()}}
+            rankings = rank(candidate_sets, {key: key[0] for key in candidate_sets})
+            ranked_trials = {topic_id: rankings[(topic_id, False)] for topic_id in relevant_trials}
+            filtered_trials = {topic_id: rankings[(topic_id, True)] for topic_id in prefiltered_trials}
+        else:
+            filtered_trials = rank(prefiltered_trials)
+    else:
+        # Rank retrieved trials using BM25
+        ranked_trials = rank(relevant_trials)
+        filtered_trials = filter_trials_by_demographics(
+            ranked_trials, structured_topics_dir, trials_xml_directory, demographics_table)
 
-    # Save ranked results and evaluate performance
-    save_results_and_evaluate(ranked_trials, 'ranked_retrieval', results_directory, qrels_path)
+    if demographics_path is not None:
+        demographics_table.save(demographics_path)
 
-    filtered_trials = filter_trials_by_demographics(ranked_trials, structured_topics_dir, trials_xml_directory)
+    if save_ranked:
+        # Save ranked results and evaluate performance
+        save_results_and_evaluate(ranked_trials, 'ranked_retrieval', results_directory, qrels_path)
 
     # Save filtered results and evaluate performance
     save_results_and_evaluate(filtered_trials, 'filtered_retrieval', results_directory, qrels_path)
@@ -3,7 +3,17 @@ Model API module for interacting with different LLM providers.
 Supports both Ollama and OpenAI APIs.
 """
 import os
-from typing import Optional
+import re
+import time
+import asyncio
+import inspect
+import logging
+import threading
+import weakref
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
 
 try:
     import ollama
@@ -11,12 +21,579 @@ except ImportError:
     ollama = None
 
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
 except ImportError:
     OpenAI = None
+    AsyncOpenAI = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from .response_cache import ResponseCache, request_key
+from .scheduler import RequestScheduler
+from .hedging import RequestHedger
+from .ollama_pool import OllamaPool
+from .config import (RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_BYTES, OLLAMA_HOSTS, OLLAMA_CONTEXT_BUCKETS,
+                     MODEL_RATE_LIMITS, MAX_CONCURRENT_REQUESTS, MODEL_MAX_RETRIES, HEDGE_PERCENTILE, HEDGE_BUDGET,
+                     HEDGE_HOSTS)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Default number of requests kept in flight by map_concurrent
+DEFAULT_MAX_CONCURRENCY = 4
+
+# Connection pool settings shared by every client created by get_client
+CLIENT_SETTINGS = {
+    "max_connections": int(os.getenv("MODEL_API_MAX_CONNECTIONS", "32")),
+    "max_keepalive_connections": int(os.getenv("MODEL_API_MAX_KEEPALIVE_CONNECTIONS", "16")),
+    "keepalive_expiry": float(os.getenv("MODEL_API_KEEPALIVE_EXPIRY", "60")),
+    "connect_timeout": float(os.getenv("MODEL_API_CONNECT_TIMEOUT", "10")),
+    "read_timeout": float(os.getenv("MODEL_API_READ_TIMEOUT", "600")),
+}
+
+_clients: Dict[Tuple, Any] = {}
+# Asynchronous clients per event loop; a loop's clients are dropped when it is garbage collected
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, Any]]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+# Response cache consulted by prompt_model, see enable_response_cache
+_response_cache: Optional[ResponseCache] = None
+
+# Scheduler every prompt_model request goes through, see enable_scheduler
+_scheduler: Optional[RequestScheduler] = None
+
+# Hedger duplicating slow prompt_model requests, see enable_hedging
+_hedger: Optional[RequestHedger] = None
+
+# Ollama hosts requests without an explicit host are spread over, see enable_ollama_pool
+_ollama_pool: Optional[OllamaPool] = None
+
+# Prompt token usage per provider, see usage_stats
+_usage: Dict[str, Dict[str, int]] = {}
+_usage_lock = threading.Lock()
+
+# Ollama context sizes requests choose from, see configure_context
+CONTEXT_SETTINGS = {
+    "buckets": [],
+    "output_tokens": 512,
+}
+
+# Ollama models pinned by model_residency: keep_alive, and the context size loaded so far
+_residency: Dict[str, Dict[str, Any]] = {}
+_residency_lock = threading.Lock()
+
+
+def configure_clients(**settings) -> None:
+    """
+    Update the connection pool settings (see CLIENT_SETTINGS) and drop the clients
+    created with the previous settings.
+    """
+    unknown = set(settings) - set(CLIENT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+    with _clients_lock:
+        CLIENT_SETTINGS.update(settings)
+        _clients.clear()
+        _async_clients.clear()
+
+
+def _http_options() -> Dict[str, Any]:
+    """Timeout and connection limits passed to the underlying httpx client."""
+    if httpx is None:
+        return {}
+    limits = httpx.Limits(
+        max_connections=CLIENT_SETTINGS["max_connections"],
+        max_keepalive_connections=CLIENT_SETTINGS["max_keepalive_connections"],
+        keepalive_expiry=CLIENT_SETTINGS["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(CLIENT_SETTINGS["read_timeout"], connect=CLIENT_SETTINGS["connect_timeout"])
+    return {"limits": limits, "timeout": timeout}
+
+
+def _create_client(provider: str, host: Optional[str], api_key: Optional[str], asynchronous: bool):
+    options = _http_options()
+    if provider == "ollama":
+        if ollama is None:
+            raise ImportError("ollama package is not installed. Install it with: pip install ollama")
+        client_class = ollama.AsyncClient if asynchronous else ollama.Client
+        return client_class(host=host, **options)
+    if OpenAI is None:
+        raise ImportError("openai package is not installed. Install it with: pip install openai")
+    if httpx is not None:
+        http_client_class = httpx.AsyncClient if asynchronous else httpx.Client
+        http_client = http_client_class(**options)
+        client_class = AsyncOpenAI if asynchronous else OpenAI
+        return client_class(api_key=api_key, base_url=host, timeout=options["timeout"], http_client=http_client)
+    client_class = AsyncOpenAI if asynchronous else OpenAI
+    return client_class(api_key=api_key, base_url=host)
+
+
+def get_client(provider: str, host: Optional[str] = None, api_key: Optional[str] = None, asynchronous: bool = False):
+    """
+    Return the long-lived client for a (provider, host, API key), creating it on first use.
+
+    Clients keep a pool of persistent connections, so repeated calls reuse open TCP/TLS
+    connections instead of paying a new handshake. Synchronous clients are shared by all
+    threads. Asynchronous clients are bound to the event loop that created them, so one
+    is kept per running loop (see aclose_clients).
+
+    Args:
+        provider: The provider ("ollama" or "openai")
+        host: Ollama host or OpenAI base URL (default: the library's default)
+        api_key: API key for OpenAI
+        asynchronous: Return an asyncio client instead of a blocking one
+
+    Returns:
+        An ollama.Client/AsyncClient or an OpenAI/AsyncOpenAI client
+    """
+    provider = provider.lower()
+    if provider not in ("ollama", "openai"):
+        raise ValueError(f"Unsupported provider: {provider}. Supported providers are 'ollama' and 'openai'")
+    key = (provider, host, api_key)
+    if asynchronous:
+        loop = asyncio.get_running_loop()
+        with _clients_lock:
+            clients = _async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = _create_client(provider, host, api_key, asynchronous)
+                clients[key] = client
+        return client
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _create_client(provider, host, api_key, asynchronous)
+                _clients[key] = client
+    return client
+
+
+def close_clients() -> None:
+    """Close the connection pools of every synchronous client and forget all clients."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None) or getattr(getattr(client, "_client", None), "close", None)
+        if close is not None:
+            close()
+
+
+async def aclose_clients() -> None:
+    """Close the connection pools of the running event loop's clients and forget them."""
+    with _clients_lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        close = getattr(client, "close", None) or getattr(getattr(client, "_client", None), "aclose", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+
+
+def _resolve_api_key(api_key: Optional[str]) -> str:
+    # Use provided API key or fall back to environment variable
+    if api_key is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if api_key is None:
+            raise ValueError("OpenAI API key not provided. Set OPENAI_API_KEY environment variable or pass api_key parameter")
+    return api_key
+
+
+def enable_response_cache(path: str, max_bytes: Optional[int] = None) -> ResponseCache:
+    """
+    Cache every prompt_model response in a persistent SQLite store, so repeated
+    prompts, within a run or across runs, are answered without calling the model.
+
+    Args:
+        path: Path of the cache database
+        max_bytes: Size above which the least recently used responses are evicted
+
+    Returns:
+        The active ResponseCache
+    """
+    global _response_cache
+    disable_response_cache()
+    _response_cache = ResponseCache(path, max_bytes)
+    return _response_cache
+
+
+def disable_response_cache() -> None:
+    """Stop caching responses and close the active cache."""
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _response_cache
 
 
-def prompt_model(prompt: str, model: str, provider: str = "ollama", api_key: Optional[str] = None) -> str:
+def enable_scheduler(rate_limits: Optional[Dict[str, Any]] = None, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                     max_retries: int = 5, **settings) -> RequestScheduler:
+    """
+    Send every prompt_model request through a shared RequestScheduler, which rate limits
+    each provider, retries failed requests with backoff and adapts the number of requests
+    in flight to the provider (see RequestScheduler for the settings).
+
+    Args:
+        rate_limits: Requests per second per provider
+        max_concurrency: Most requests in flight per provider
+        max_retries: Retries of a failed request before its error is raised
+
+    Returns:
+        The active RequestScheduler
+    """
+    global _scheduler
+    _scheduler = RequestScheduler(rate_limits, max_concurrency, max_retries=max_retries, **settings)
+    return _scheduler
+
+
+def disable_scheduler() -> None:
+    """Send requests directly again, without rate limits or retries."""
+    global _scheduler
+    _scheduler = None
+
+
+def get_scheduler() -> Optional[RequestScheduler]:
+    return _scheduler
+
+
+def enable_hedging(percentile: float = 95.0, budget: float = 0.05, hosts: Optional[Sequence[str]] = None,
+                   **settings) -> RequestHedger:
+    """
+    Hedge prompt_model requests: a request still running after the observed percentile
+    latency is duplicated to the next alternate host (or its own host), the first answer
+    is returned and the other request cancelled (see RequestHedger for the settings).
+
+    Args:
+        percentile: Latency percentile after which a request is hedged
+        budget: Maximum number of duplicate requests, as a fraction of all requests
+        hosts: Alternate Ollama hosts or OpenAI base URLs for the duplicates
+
+    Returns:
+        The active RequestHedger
+    """
+    global _hedger
+    disable_hedging()
+    _hedger = RequestHedger(percentile, budget, hosts, on_close=aclose_clients, **settings)
+    return _hedger
+
+
+def disable_hedging() -> None:
+    """Stop hedging requests, closing the hedger's event loop and the clients bound to it."""
+    global _hedger
+    if _hedger is not None:
+        _hedger.close()
+    _hedger = None
+
+
+def get_hedger() -> Optional[RequestHedger]:
+    return _hedger
+
+
+def enable_ollama_pool(hosts: Sequence[str], **settings) -> OllamaPool:
+    """
+    Spread Ollama requests that do not name a host over several hosts, each request going
+    to the healthy host with the fewest requests outstanding (see OllamaPool for the
+    settings). Retried and hedged requests pick a host again, so they avoid failing
+    or busy hosts.
+
+    Args:
+        hosts: Ollama hosts, e.g. ["http://gpu1:11434", "http://gpu2:11434"]
+
+    Returns:
+        The active OllamaPool
+    """
+    global _ollama_pool
+    disable_ollama_pool()
+    _ollama_pool = OllamaPool(hosts, **settings)
+    return _ollama_pool
+
+
+def disable_ollama_pool() -> None:
+    """Send Ollama requests to the default host again."""
+    global _ollama_pool
+    if _ollama_pool is not None:
+        _ollama_pool.close()
+    _ollama_pool = None
+
+
+def get_ollama_pool() -> Optional[OllamaPool]:
+    return _ollama_pool
+
+
+# Word pieces and single punctuation marks, the units BPE tokenizers split text into
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the token count of a text without the model's tokenizer: a word counts one
+    token per four letters (common words are one token), numbers one per three digits, and
+    every punctuation mark or symbol one. Usually within 10-20% of BPE tokenizers on
+    English, erring on the high side for medical vocabulary.
+    """
+    return sum((len(piece) + 3) // 4 if piece[0].isalpha() else 1 for piece in _TOKEN_PATTERN.findall(text))
+
+
+def configure_context(buckets: Sequence[int], output_tokens: int = 512) -> None:
+    """
+    Set the context sizes (num_ctx) Ollama requests choose from. Each request uses the
+    smallest bucket holding its estimated prompt plus output_tokens (or its max_tokens),
+    so short prompts do not reserve KV memory for long ones and long prompts are not
+    truncated to Ollama's default context. An empty list leaves num_ctx to the server.
+    """
+    CONTEXT_SETTINGS["buckets"] = sorted(buckets)
+    CONTEXT_SETTINGS["output_tokens"] = output_tokens
+
+
+def _context_tokens(prompt: str, system: Optional[str], max_tokens: Optional[int]) -> int:
+    return estimate_tokens(prompt) + estimate_tokens(system or "") + (max_tokens or CONTEXT_SETTINGS["output_tokens"])
+
+
+def context_bucket(prompt: str, system: Optional[str] = None, max_tokens: Optional[int] = None) -> Optional[int]:
+    """
+    The smallest num_ctx bucket holding an Ollama request (the largest bucket when none
+    does), or None when no buckets are configured.
+    """
+    buckets = CONTEXT_SETTINGS["buckets"]
+    if not buckets:
+        return None
+    needed = _context_tokens(prompt, system, max_tokens)
+    return next((bucket for bucket in buckets if bucket >= needed), buckets[-1])
+
+
+def context_size(model: str, prompt: str, system: Optional[str] = None, max_tokens: Optional[int] = None) -> Optional[int]:
+    """
+    The num_ctx of an Ollama request, or None when no buckets are configured.
+
+    Ollama reloads a model whenever num_ctx changes, so while the model is pinned by
+    model_residency its context only grows: a request never gets a smaller bucket than
+    one already loaded during the residency.
+    """
+    size = context_bucket(prompt, system, max_tokens)
+    if size is None:
+        return None
+    needed = _context_tokens(prompt, system, max_tokens)
+    if needed > size:
+        logging.warning(f"Prompt of about {needed} tokens exceeds the largest context size {size} and will be truncated")
+    with _residency_lock:
+        residency = _residency.get(model)
+        if residency is not None:
+            size = max(size, residency["num_ctx"] or 0)
+            residency["num_ctx"] = size
+    return size
+
+
+def warm_model(model: str, host: Optional[str] = None, keep_alive: Union[str, float, None] = None,
+               num_ctx: Optional[int] = None) -> None:
+    """
+    Load an Ollama model into memory without generating anything, so the first request of
+    a stage does not pay the load time.
+    """
+    client = get_client("ollama", host)
+    options = {"options": {"num_ctx": num_ctx}} if num_ctx else {}
+    if keep_alive is not None:
+        options["keep_alive"] = keep_alive
+    try:
+        client.chat(model=model, messages=[], **options)
+    except Exception as e:
+        raise RuntimeError(f"Ollama API call failed: {e}") from e
+
+
+@contextmanager
+def model_residency(model: str, keep_alive: Union[str, float] = "30m", host: Optional[str] = None):
+    """
+    Keep an Ollama model loaded for the duration of a stage.
+
+    On entry the model is loaded on the host (or every host of the Ollama pool), and
+    every request to it inside the block asks Ollama to keep it loaded for keep_alive
+    after the request, so idle gaps do not unload it. After the block, requests go back
+    to the server's default keep_alive; the model stays loaded until the last
+    keep_alive expires.
+    """
+    pool = _ollama_pool
+    hosts = pool.hosts if host is None and pool is not None else [host]
+    buckets = CONTEXT_SETTINGS["buckets"]
+    num_ctx = buckets[0] if buckets else None
+    with _residency_lock:
+        _residency[model] = {"keep_alive": keep_alive, "num_ctx": num_ctx}
+    for warm_host in hosts:
+        try:
+            warm_model(model, warm_host, keep_alive, num_ctx)
+        except Exception as e:
+            logging.warning(f"Could not load model {model} on {warm_host or 'the default host'}: {e}")
+    try:
+        yield
+    finally:
+        with _residency_lock:
+            _residency.pop(model, None)
+
+
+def stage_residency(models: Iterable[str], provider: str = "ollama", keep_alive: Union[str, float, None] = "30m") -> ExitStack:
+    """
+    Context manager keeping every model a stage uses resident (see model_residency).
+    Does nothing for providers other than Ollama, or without keep_alive.
+    """
+    stack = ExitStack()
+    if provider.lower() == "ollama" and keep_alive is not None:
+        for model in dict.fromkeys(models):
+            stack.enter_context(model_residency(model, keep_alive))
+    return stack
+
+
+def _messages(prompt: str, system: Optional[str] = None) -> List[Dict[str, str]]:
+    messages = [{'role': 'system', 'content': system}] if system else []
+    messages.append({'role': 'user', 'content': prompt})
+    return messages
+
+
+def _response_field(response: Any, name: str) -> Any:
+    try:
+        return response[name]
+    except (KeyError, TypeError):
+        return getattr(response, name, None)
+
+
+def _record_usage(provider: str, response: Any) -> None:
+    # Prompt tokens of a response and, where the provider reports them, prompt-cache hits.
+    if provider == "openai":
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+        cached_tokens = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0
+    else:
+        # Ollama reports only the prompt tokens it evaluated, i.e. those not reused from its cache.
+        prompt_tokens = _response_field(response, "prompt_eval_count") or 0
+        cached_tokens = None
+    with _usage_lock:
+        usage_stats = _usage.setdefault(provider, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+        usage_stats["requests"] += 1
+        usage_stats["prompt_tokens"] += prompt_tokens
+        if cached_tokens is not None:
+            usage_stats["cached_tokens"] += cached_tokens
+
+
+def usage_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Prompt tokens per provider since the start of the run. For OpenAI, the tokens served
+    from its prompt cache and the cache hit rate; Ollama only reports the prompt tokens it
+    had to evaluate, so fewer evaluated tokens for the same prompts means more cache reuse.
+    Streamed requests (early_stop) are not counted.
+    """
+    with _usage_lock:
+        stats = {}
+        for provider, usage in _usage.items():
+            stats[provider] = dict(usage)
+            if provider == "ollama":
+                stats[provider]["prompt_eval_tokens"] = stats[provider].pop("prompt_tokens")
+                del stats[provider]["cached_tokens"]
+            else:
+                stats[provider]["cache_hit_rate"] = usage["cached_tokens"] / usage["prompt_tokens"] if usage["prompt_tokens"] else 0.0
+        return stats
+
+
+def _generation(max_tokens: Optional[int], stop: Optional[Sequence[str]],
+                early_stop: Optional[Callable[[str], bool]]) -> Dict[str, Any]:
+    generation = {}
+    if max_tokens:
+        generation["max_tokens"] = max_tokens
+    if stop:
+        generation["stop"] = list(stop)
+    if early_stop is not None:
+        generation["early_stop"] = early_stop
+    return generation
+
+
+def _cache_params(system: Optional[str], generation: Dict[str, Any],
+                  num_ctx: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    # Only parameters that are set enter the key, so plain requests keep their cached responses.
+    params = {"system": system} if system else {}
+    if num_ctx is not None:
+        # The bucket the prompt needs, not the larger context a residency may have loaded:
+        # an answer changes only when the prompt is truncated.
+        params["num_ctx"] = num_ctx
+    params.update({name: value for name, value in generation.items() if name != "early_stop"})
+    if "early_stop" in generation:
+        params["early_stop"] = getattr(generation["early_stop"], "__qualname__", repr(generation["early_stop"]))
+    return params or None
+
+
+def _read_stream(stream: Iterable[Any], chunk_text: Callable[[Any], Optional[str]],
+                 early_stop: Callable[[str], bool]) -> str:
+    # Accumulate a streamed answer and close the stream as soon as early_stop accepts it.
+    text = ""
+    try:
+        for chunk in stream:
+            text += chunk_text(chunk) or ""
+            if early_stop(text):
+                break
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return text
+
+
+async def _read_stream_async(stream: Any, chunk_text: Callable[[Any], Optional[str]],
+                             early_stop: Callable[[str], bool]) -> str:
+    text = ""
+    try:
+        async for chunk in stream:
+            text += chunk_text(chunk) or ""
+            if early_stop(text):
+                break
+    finally:
+        close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+        if close is not None:
+            await close()
+    return text
+
+
+def _ollama_options(model: str, prompt: str, system: Optional[str], generation: Dict[str, Any]) -> Dict[str, Any]:
+    options = {}
+    if "max_tokens" in generation:
+        options["num_predict"] = generation["max_tokens"]
+    if "stop" in generation:
+        options["stop"] = generation["stop"]
+    num_ctx = context_size(model, prompt, system, generation.get("max_tokens"))
+    if num_ctx is not None:
+        options["num_ctx"] = num_ctx
+    request_options = {"options": options} if options else {}
+    residency = _residency.get(model)
+    if residency is not None:
+        request_options["keep_alive"] = residency["keep_alive"]
+    return request_options
+
+
+def _openai_options(generation: Dict[str, Any]) -> Dict[str, Any]:
+    options = {}
+    if "max_tokens" in generation:
+        options["max_tokens"] = generation["max_tokens"]
+    if "stop" in generation:
+        # The OpenAI API accepts at most 4 stop sequences.
+        options["stop"] = generation["stop"][:4]
+    return options
+
+
+def _ollama_chunk_text(chunk: Any) -> Optional[str]:
+    return chunk['message']['content']
+
+
+def _openai_chunk_text(chunk: Any) -> Optional[str]:
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+
+def prompt_model(prompt: str, model: str, provider: str = "ollama", api_key: Optional[str] = None,
+                 host: Optional[str] = None, use_cache: bool = True, system: Optional[str] = None,
+                 max_tokens: Optional[int] = None, stop: Optional[Sequence[str]] = None,
+                 early_stop: Optional[Callable[[str], bool]] = None) -> str:
     """
     Send a prompt to a model using the specified provider.
     
@@ -25,68 +602,164 @@ def prompt_model(prompt: str, model: str, provider: str = "ollama", api_key: Opt
         model: The model name/identifier
         provider: The provider to use ("ollama" or "openai")
         api_key: Optional API key for OpenAI (if not set, will use OPENAI_API_KEY env var)
+        host: Optional Ollama host or OpenAI base URL
+        use_cache: Look the prompt up in the response cache, if one is enabled
+        system: Optional system message sent before the prompt
+        max_tokens: Maximum number of tokens generated
+        stop: Sequences that end the generation
+        early_stop: Stream the answer and stop it as soon as early_stop(text so far) is true,
+            e.g. once a parseable label has been emitted
     
     Returns:
         The model's response text
     
     Raises:
         ValueError: If provider is not supported or required libraries are missing
-        RuntimeError: If API call fails
+        RuntimeError: If API call fails (after the scheduler's retries, if one is enabled)
     """
     provider = provider.lower()
+    generation = _generation(max_tokens, stop, early_stop)
     
+    cache = _response_cache if use_cache else None
+    if cache is not None:
+        num_ctx = context_bucket(prompt, system, generation.get("max_tokens")) if provider == "ollama" else None
+        key = request_key(provider, model, prompt, _cache_params(system, generation, num_ctx))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    hedger = _hedger
+    if provider == "ollama" and hedger is not None:
+        call, args = hedger.call, (lambda target: _prompt_ollama_async(prompt, model, target, system, generation), host)
+    elif provider == "openai" and hedger is not None:
+        call, args = hedger.call, (lambda target: _prompt_openai_async(prompt, model, api_key, target, system, generation),
+                                   host)
+    elif provider == "ollama":
+        call, args = _prompt_ollama, (prompt, model, host, system, generation)
+    elif provider == "openai":
+        call, args = _prompt_openai, (prompt, model, api_key, host, system, generation)
+    else:
+        raise ValueError(f"Unsupported provider: {provider}. Supported providers are 'ollama' and 'openai'")
+    scheduler = _scheduler
+    response = scheduler.call(provider, call, *args) if scheduler is not None else call(*args)
+
+    if cache is not None and response is not None:
+        cache.put(key, response)
+    return response
+
+
+async def prompt_model_async(prompt: str, model: str, provider: str = "ollama", api_key: Optional[str] = None,
+                             host: Optional[str] = None, use_cache: bool = True, system: Optional[str] = None,
+                             max_tokens: Optional[int] = None, stop: Optional[Sequence[str]] = None,
+                             early_stop: Optional[Callable[[str], bool]] = None) -> str:
+    """
+    Asyncio counterpart of prompt_model, using the pooled asynchronous clients.
+    """
+    provider = provider.lower()
+    generation = _generation(max_tokens, stop, early_stop)
+
+    cache = _response_cache if use_cache else None
+    if cache is not None:
+        num_ctx = context_bucket(prompt, system, generation.get("max_tokens")) if provider == "ollama" else None
+        key = request_key(provider, model, prompt, _cache_params(system, generation, num_ctx))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
     if provider == "ollama":
-        return _prompt_ollama(prompt, model)
+        raw_output = await _prompt_ollama_async(prompt, model, host, system, generation)
     elif provider == "openai":
-        return _prompt_openai(prompt, model, api_key)
+        raw_output = await _prompt_openai_async(prompt, model, api_key, host, system, generation)
     else:
         raise ValueError(f"Unsupported provider: {provider}. Supported providers are 'ollama' and 'openai'")
 
+    if cache is not None and raw_output is not None:
+        cache.put(key, raw_output)
+    return raw_output
+
+
+async def _prompt_ollama_async(prompt: str, model: str, host: Optional[str] = None, system: Optional[str] = None,
+                               generation: Optional[Dict[str, Any]] = None) -> str:
+    """Internal function to call Ollama API with the asynchronous client."""
+    pool = _ollama_pool
+    if host is None and pool is not None:
+        with pool.lease() as pooled_host:
+            return await _prompt_ollama_async(prompt, model, pooled_host, system, generation)
+    client = get_client("ollama", host, asynchronous=True)
+    generation = generation or {}
+    try:
+        if "early_stop" in generation:
+            stream = await client.chat(model=model, messages=_messages(prompt, system), stream=True,
+                                       **_ollama_options(model, prompt, system, generation))
+            return await _read_stream_async(stream, _ollama_chunk_text, generation["early_stop"])
+        response = await client.chat(model=model, messages=_messages(prompt, system), **_ollama_options(model, prompt, system, generation))
+        _record_usage("ollama", response)
+        return response['message']['content']
+    except Exception as e:
+        raise RuntimeError(f"Ollama API call failed: {e}") from e
+
 
-def _prompt_ollama(prompt: str, model: str) -> str:
+async def _prompt_openai_async(prompt: str, model: str, api_key: Optional[str] = None, host: Optional[str] = None,
+                               system: Optional[str] = None, generation: Optional[Dict[str, Any]] = None) -> str:
+    """Internal function to call OpenAI API with the asynchronous client."""
+    client = get_client("openai", host, _resolve_api_key(api_key), asynchronous=True)
+    generation = generation or {}
+    try:
+        if "early_stop" in generation:
+            stream = await client.chat.completions.create(model=model, messages=_messages(prompt, system), stream=True,
+                                                          **_openai_options(generation))
+            return await _read_stream_async(stream, _openai_chunk_text, generation["early_stop"])
+        response = await client.chat.completions.create(model=model, messages=_messages(prompt, system),
+                                                        **_openai_options(generation))
+        _record_usage("openai", response)
+        return response.choices[0].message.content
+    except Exception as e:
+        raise RuntimeError(f"OpenAI API call failed: {e}") from e
+
+
+def _prompt_ollama(prompt: str, model: str, host: Optional[str] = None, system: Optional[str] = None,
+                   generation: Optional[Dict[str, Any]] = None) -> str:
     """Internal function to call Ollama API."""
-    if ollama is None:
-        raise ImportError("ollama package is not installed. Install it with: pip install ollama")
+    pool = _ollama_pool
+    if host is None and pool is not None:
+        with pool.lease() as pooled_host:
+            return _prompt_ollama(prompt, model, pooled_host, system, generation)
+    client = get_client("ollama", host)
+    generation = generation or {}
     
     try:
-        response = ollama.chat(model=model, messages=[
-            {
-                'role': 'user',
-                'content': prompt,
-            },
-        ])
+        if "early_stop" in generation:
+            stream = client.chat(model=model, messages=_messages(prompt, system), stream=True, **_ollama_options(model, prompt, system, generation))
+            return _read_stream(stream, _ollama_chunk_text, generation["early_stop"])
+        response = client.chat(model=model, messages=_messages(prompt, system), **_ollama_options(model, prompt, system, generation))
+        _record_usage("ollama", response)
         raw_output = response['message']['content']
         return raw_output
     except Exception as e:
-        raise RuntimeError(f"Ollama API call failed: {e}")
+        raise RuntimeError(f"Ollama API call failed: {e}") from e
 
 
-def _prompt_openai(prompt: str, model: str, api_key: Optional[str] = None) -> str:
+def _prompt_openai(prompt: str, model: str, api_key: Optional[str] = None, host: Optional[str] = None,
+                   system: Optional[str] = None, generation: Optional[Dict[str, Any]] = None) -> str:
     """Internal function to call OpenAI API."""
-    if OpenAI is None:
-        raise ImportError("openai package is not installed. Install it with: pip install openai")
-    
-    # Use provided API key or fall back to environment variable
-    if api_key is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if api_key is None:
-            raise ValueError("OpenAI API key not provided. Set OPENAI_API_KEY environment variable or pass api_key parameter")
+    client = get_client("openai", host, _resolve_api_key(api_key))
+    generation = generation or {}
     
     try:
-        client = OpenAI(api_key=api_key)
+        if "early_stop" in generation:
+            stream = client.chat.completions.create(model=model, messages=_messages(prompt, system), stream=True,
+                                                    **_openai_options(generation))
+            return _read_stream(stream, _openai_chunk_text, generation["early_stop"])
         response = client.chat.completions.create(
             model=model,
-            messages=[
-                {
-                    'role': 'user',
-                    'content': prompt,
-                },
-            ],
+            messages=_messages(prompt, system),
+            **_openai_options(generation),
         )
+        _record_usage("openai", response)
         raw_output = response.choices[0].message.content
         return raw_output
     except Exception as e:
-        raise RuntimeError(f"OpenAI API call failed: {e}")
+        raise RuntimeError(f"OpenAI API call failed: {e}") from e
 
 
 # Backward compatibility alias
@@ -97,3 +770,215 @@ def prompt_ollama(prompt: str, model: str) -> str:
     """
     return prompt_model(prompt, model, provider="ollama")
 
+
+def map_concurrent(func: Callable[[T], R], items: Iterable[T], max_concurrency: Optional[int] = None,
+                   return_exceptions: bool = False) -> Iterator[R]:
+    """
+    Apply func to every item on a pool of threads and yield the results in input order.
+
+    Model calls spend almost all their time waiting on the server, so threads keep several
+    requests in flight. At most max_concurrency calls run at once, and only a bounded window
+    of results is buffered ahead of the consumer, so items may be a lazy iterable.
+
+    Args:
+        func: Function applied to each item, typically wrapping prompt_model
+        items: The work items
+        max_concurrency: Maximum number of concurrent calls (default: DEFAULT_MAX_CONCURRENCY)
+        return_exceptions: Yield exceptions raised by func instead of raising them
+
+    Returns:
+        An iterator over func(item), in the order of items
+
+    Raises:
+        The first exception raised by func, in input order, unless return_exceptions is set.
+        Pending calls are cancelled.
+    """
+    max_concurrency = max(1, max_concurrency or DEFAULT_MAX_CONCURRENCY)
+    if max_concurrency == 1:
+        for item in items:
+            try:
+                yield func(item)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                yield e
+        return
+
+    window = max_concurrency * 4
+    iterator = iter(items)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        for item in iterator:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                break
+        while pending:
+            future = pending.popleft()
+            try:
+                result = future.result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                result = e
+            # Refill the window before handing the result over.
+            for item in iterator:
+                pending.append(executor.submit(func, item))
+                break
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def prompt_model_batch(prompts: Iterable[str], model: str, provider: str = "ollama", api_key: Optional[str] = None,
+                       max_concurrency: Optional[int] = None, host: Optional[str] = None) -> List[str]:
+    """
+    Send many prompts to a model concurrently.
+
+    Args:
+        prompts: The prompt texts to send to the model
+        model: The model name/identifier
+        provider: The provider to use ("ollama" or "openai")
+        api_key: Optional API key for OpenAI
+        max_concurrency: Maximum number of requests in flight
+        host: Optional Ollama host or OpenAI base URL
+
+    Returns:
+        The model's responses, in the order of prompts
+    """
+    return list(map_concurrent(lambda prompt: prompt_model(prompt, model, provider=provider, api_key=api_key, host=host),
+                               prompts, max_concurrency))
+
+
+class ModelRouter:
+    """
+    Routes prompts through a list of models, smallest first.
+
+    Each prompt goes to the first model; the output is checked by a validator supplied by
+    the calling stage, and the prompt escalates to the next model when the output fails
+    validation or the call raises. The last model's output is returned even if it fails
+    validation. Call counts, rejected outputs, failures and latencies are recorded per model.
+
+    Args:
+        models: Models in escalation order, as model names or (model, provider) pairs
+        provider: Provider of models given by name only
+        api_key: Optional API key for OpenAI
+    """
+
+    def __init__(self, models: Sequence[Union[str, Tuple[str, str]]], provider: str = "ollama",
+                 api_key: Optional[str] = None):
+        if not models:
+            raise ValueError("ModelRouter needs at least one model")
+        self.tiers = [(model, provider) if isinstance(model, str) else tuple(model) for model in models]
+        self.api_key = api_key
+        self._lock = threading.Lock()
+        self._stats = {model: {"calls": 0, "rejected": 0, "failed": 0, "latency": 0.0} for model, _ in self.tiers}
+
+    def _record(self, model: str, latency: float, rejected: bool = False, failed: bool = False) -> None:
+        with self._lock:
+            stats = self._stats[model]
+            stats["calls"] += 1
+            stats["latency"] += latency
+            stats["rejected"] += rejected
+            stats["failed"] += failed
+
+    def prompt(self, prompt: str, validator: Optional[Callable[[str], bool]] = None, system: Optional[str] = None,
+               budget: Any = None, **generation) -> str:
+        """
+        Send a prompt, escalating until an output passes the validator.
+
+        Args:
+            prompt: The prompt text
+            validator: Returns False for outputs that should escalate (default: accept all)
+            system: Optional system message sent before the prompt
+            budget: Optional call budget (with an acquire method, e.g. a LabellingBudget) each
+                escalation takes a call from; the caller acquires the first call. Escalation
+                stops once the budget refuses, returning the last output (or raising the
+                last error when every call failed).
+            generation: Generation limits passed to prompt_model (max_tokens, stop, early_stop)
+
+        Returns:
+            The first accepted output, or the last model's output
+        """
+        last_index = len(self.tiers) - 1
+        output, error = None, None
+        for index, (model, provider) in enumerate(self.tiers):
+            if index > 0 and budget is not None and not budget.acquire():
+                if output is None and error is not None:
+                    raise error
+                return output
+            start_time = time.time()
+            try:
+                output = prompt_model(prompt, model, provider=provider, api_key=self.api_key, system=system,
+                                      **generation)
+            except Exception as e:
+                self._record(model, time.time() - start_time, failed=True)
+                if index == last_index:
+                    raise
+                error = e
+                continue
+            valid = validator is None or validator(output)
+            self._record(model, time.time() - start_time, rejected=not valid)
+            if valid or index == last_index:
+                return output
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-model call counts, rejected outputs, failed calls and mean latency in seconds."""
+        with self._lock:
+            return {
+                model: {
+                    "calls": stats["calls"],
+                    "rejected": stats["rejected"],
+                    "failed": stats["failed"],
+                    "mean_latency": stats["latency"] / stats["calls"] if stats["calls"] else 0.0,
+                }
+                for model, stats in self._stats.items()
+            }
+
+
+def build_router(models: Sequence[Union[str, Tuple[str, str]]], provider: str = "ollama",
+                 api_key: Optional[str] = None) -> Optional[ModelRouter]:
+    """Build a ModelRouter for a stage's route, or None when the route is empty (routing disabled)."""
+    return ModelRouter(models, provider=provider, api_key=api_key) if models else None
+
+
+def configure_model_runtime() -> None:
+    """
+    Set up the model request runtime of a stage script from the config: the response cache
+    (RESPONSE_CACHE_PATH), the Ollama host pool (OLLAMA_HOSTS), context sizing
+    (OLLAMA_CONTEXT_BUCKETS), the request scheduler (MODEL_RATE_LIMITS,
+    MAX_CONCURRENT_REQUESTS, MODEL_MAX_RETRIES) and hedging (HEDGE_PERCENTILE).
+    """
+    if RESPONSE_CACHE_PATH:
+        enable_response_cache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_BYTES)
+    if OLLAMA_HOSTS:
+        enable_ollama_pool(OLLAMA_HOSTS)
+    configure_context(OLLAMA_CONTEXT_BUCKETS)
+    enable_scheduler(MODEL_RATE_LIMITS, MAX_CONCURRENT_REQUESTS, MODEL_MAX_RETRIES)
+    if HEDGE_PERCENTILE:
+        enable_hedging(HEDGE_PERCENTILE, HEDGE_BUDGET, HEDGE_HOSTS)
+
+
+def log_usage_stats(routers: Optional[Dict[str, Optional[ModelRouter]]] = None, budget: Any = None) -> None:
+    """
+    Print the statistics of a stage script's run: model routing per stage, the labelling
+    budget, if any, and the parts of the runtime configure_model_runtime enabled.
+
+    Args:
+        routers: Router of each stage (None when the stage is not routed)
+        budget: Labelling budget of the run (with a stats method, e.g. a LabellingBudget)
+    """
+    for stage, router in (routers or {}).items():
+        if router is not None:
+            print(f"Model routing ({stage}): {router.stats()}")
+    if budget is not None:
+        print(f"Labelling budget: {budget.stats()}")
+    if _scheduler is not None:
+        print(f"Request scheduler: {_scheduler.stats()}")
+    print(f"Prompt tokens: {usage_stats()}")
+    if _ollama_pool is not None:
+        print(f"Ollama hosts: {_ollama_pool.stats()}")
+    if _hedger is not None:
+        print(f"Request hedging: {_hedger.stats()}")
+    if _response_cache is not None:
+        print(f"Response cache: {_response_cache.stats()}")
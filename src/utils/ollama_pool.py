@@ -0,0 +1,156 @@
+"""
+Pool of Ollama hosts: requests go to the healthy host with the fewest requests
+outstanding, and hosts that keep failing are ejected until they recover.
+"""
+import time
+import threading
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .scheduler import classify_error
+
+
+def _base_url(host: str) -> str:
+    return host.rstrip("/") if "://" in host else f"http://{host.rstrip('/')}"
+
+
+class OllamaPool:
+    """
+    Least-outstanding-requests balancing over several Ollama hosts.
+
+    A host is ejected after max_failures consecutive retryable failures (connection
+    errors, timeouts, 5xx and 429 responses) for ejection_time seconds, doubled for each
+    further ejection before a request on the host succeeds, up to max_ejection_time. A
+    background health check polls every host's /api/version every health_interval seconds,
+    ejecting hosts that do not answer and readmitting the hosts it ejected once they answer
+    again. Hosts ejected for failed requests stay out for their whole ejection, since a
+    host that fails requests may still answer health checks. When every host is ejected,
+    requests still go to the host whose ejection ends first rather than failing.
+
+    Args:
+        hosts: Ollama hosts, e.g. ["http://gpu1:11434", "gpu2:11434"]
+        max_failures: Consecutive failures before a host is ejected
+        ejection_time: First ejection duration, in seconds
+        max_ejection_time: Longest ejection duration, in seconds
+        health_interval: Seconds between health checks (0 or None to disable them)
+        health_timeout: Timeout of a health check request, in seconds
+    """
+
+    def __init__(self, hosts: Sequence[str], max_failures: int = 3, ejection_time: float = 30.0,
+                 max_ejection_time: float = 300.0, health_interval: Optional[float] = 15.0,
+                 health_timeout: float = 2.0):
+        if not hosts:
+            raise ValueError("OllamaPool needs at least one host")
+        self.hosts: List[str] = list(dict.fromkeys(hosts))
+        self.max_failures = max_failures
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.health_timeout = health_timeout
+        self._state = {host: {"outstanding": 0, "requests": 0, "failures": 0, "consecutive_failures": 0,
+                              "ejections": 0, "ejected": 0, "ejected_until": 0.0, "health_ejected": False}
+                       for host in self.hosts}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+        if health_interval:
+            self._health_thread = threading.Thread(target=self._health_loop, args=(health_interval,),
+                                                   name="ollama-pool-health", daemon=True)
+            self._health_thread.start()
+
+    def _eject(self, host: str, now: float, by_health_check: bool = False) -> None:
+        state = self._state[host]
+        duration = min(self.max_ejection_time, self.ejection_time * 2 ** state["ejections"])
+        state["ejected_until"] = now + duration
+        state["ejections"] += 1
+        state["ejected"] += 1
+        state["consecutive_failures"] = 0
+        state["health_ejected"] = by_health_check
+
+    def _readmit(self, host: str) -> None:
+        state = self._state[host]
+        state["ejected_until"] = 0.0
+        state["ejections"] = 0
+        state["consecutive_failures"] = 0
+        state["health_ejected"] = False
+
+    def acquire(self) -> str:
+        """Pick the host for a request and count the request as outstanding on it."""
+        with self._lock:
+            now = time.monotonic()
+            healthy = [host for host in self.hosts if self._state[host]["ejected_until"] <= now]
+            candidates = healthy or [min(self.hosts, key=lambda host: self._state[host]["ejected_until"])]
+            # Rotate the starting point so ties do not always go to the first host.
+            start = self._next % len(candidates)
+            self._next += 1
+            rotated = candidates[start:] + candidates[:start]
+            host = min(rotated, key=lambda host: self._state[host]["outstanding"])
+            self._state[host]["outstanding"] += 1
+            self._state[host]["requests"] += 1
+            return host
+
+    def release(self, host: str, error: Optional[BaseException] = None) -> None:
+        """Mark a request on host as finished, with the error it failed with, if any."""
+        with self._lock:
+            state = self._state[host]
+            state["outstanding"] -= 1
+            if error is None or classify_error(error) is None:
+                state["consecutive_failures"] = 0
+                if state["ejected_until"] <= time.monotonic():
+                    state["ejections"] = 0
+                return
+            state["failures"] += 1
+            state["consecutive_failures"] += 1
+            if state["consecutive_failures"] >= self.max_failures:
+                self._eject(host, time.monotonic())
+
+    @contextmanager
+    def lease(self) -> Iterator[str]:
+        """Context manager yielding a host, released (with the error raised, if any) on exit."""
+        host = self.acquire()
+        try:
+            yield host
+        except BaseException as e:
+            self.release(host, e)
+            raise
+        self.release(host)
+
+    def check_health(self) -> Dict[str, bool]:
+        """
+        Poll every host once, ejecting the ones that do not answer and readmitting the ones
+        this check ejected that answer again.
+        """
+        results = {}
+        for host in self.hosts:
+            try:
+                with urllib.request.urlopen(f"{_base_url(host)}/api/version", timeout=self.health_timeout) as response:
+                    healthy = response.status == 200
+            except Exception:
+                healthy = False
+            results[host] = healthy
+            with self._lock:
+                state = self._state[host]
+                ejected = state["ejected_until"] > time.monotonic()
+                if healthy and ejected and state["health_ejected"]:
+                    self._readmit(host)
+                elif not healthy and not ejected:
+                    self._eject(host, time.monotonic(), by_health_check=True)
+        return results
+
+    def _health_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self.check_health()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-host requests, failures, ejections, outstanding requests and whether the host is in use."""
+        with self._lock:
+            now = time.monotonic()
+            return {host: {"requests": state["requests"], "failures": state["failures"],
+                           "ejections": state["ejected"], "outstanding": state["outstanding"],
+                           "healthy": state["ejected_until"] <= now}
+                    for host, state in self._state.items()}
+
+    def close(self) -> None:
+        """Stop the health checks."""
+        self._stop.set()
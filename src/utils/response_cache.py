@@ -0,0 +1,109 @@
+"""
+Persistent cache of model responses shared across pipeline stages and runs.
+Responses are stored in a local SQLite database keyed by a hash of the request.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+
+def request_key(provider: str, model: str, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Content address of a model request: the SHA-256 of its provider, model,
+    generation parameters and prompt.
+    """
+    payload = json.dumps([provider.lower(), model, params or {}, prompt], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Size-bounded SQLite store of model responses.
+
+    The least recently used entries are evicted once the stored responses exceed
+    max_bytes. The cache can be shared by the threads of one process, and WAL mode
+    lets several pipeline processes use the same file.
+
+    Args:
+        path: Path of the SQLite database file
+        max_bytes: Maximum total size of the stored responses (default: unbounded)
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._connection:
+                self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            with self._connection:
+                previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, response, size, time.time()))
+            self._size += size - (previous[0] if previous else 0)
+            if self.max_bytes is not None and self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Evict down to 90% of the limit so a full cache does not evict on every insert.
+        target = int(self.max_bytes * 0.9)
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= size
+        with self._connection:
+            self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "size_bytes": self._size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
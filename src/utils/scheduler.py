@@ -0,0 +1,243 @@
+"""
+Shared scheduler for model requests: per-provider rate limits, retries with
+exponential backoff and jitter, and concurrency that adapts to the provider.
+"""
+import time
+import random
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Kinds of retryable failures returned by classify_error
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error: BaseException) -> Optional[str]:
+    """
+    Classify a failed model request.
+
+    Returns:
+        THROTTLED for rate limiting, overload and timeouts (the provider needs less load),
+        TRANSIENT for connection errors and server errors worth retrying as is,
+        None for errors a retry will not fix (bad request, unknown model, missing key)
+    """
+    original = error
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        status = _status_code(error)
+        if status in (408, 429, 503, 504):
+            return THROTTLED
+        if status is not None and status >= 500:
+            return TRANSIENT
+        if status is not None:
+            return None
+        if httpx is not None and isinstance(error, httpx.TimeoutException):
+            return THROTTLED
+        if isinstance(error, TimeoutError) or "Timeout" in type(error).__name__ or "RateLimit" in type(error).__name__:
+            return THROTTLED
+        if isinstance(error, ConnectionError) or "Connection" in type(error).__name__:
+            return TRANSIENT
+        if httpx is not None and isinstance(error, httpx.TransportError):
+            return TRANSIENT
+        error = error.__cause__ or error.__context__
+
+    # Wrapped errors without a cause only keep the original error in their message.
+    message = str(original).lower()
+    if any(marker in message for marker in ("429", "rate limit", "too many requests", "timed out", "timeout")):
+        return THROTTLED
+    if any(marker in message for marker in ("connection refused", "connection reset", "502", "503", "504")):
+        return TRANSIENT
+    return None
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `rate` requests per second on average and bursts of up to `burst`.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("TokenBucket rate must be positive")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, waiting for it if necessary. Returns the time waited in seconds."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit adjusted by additive increase, multiplicative decrease.
+
+    The limit is halved when a request is throttled (429, overload or timeout), at most
+    once per batch of requests in flight, and grows by one after a full limit's worth of
+    successful requests whose latency stays within latency_tolerance times the best
+    smoothed latency seen so far.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, latency_tolerance: float = 2.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.limit = self.maximum
+        self.in_flight = 0
+        self._healthy = 0
+        self._latency: Optional[float] = None
+        self._best_latency: Optional[float] = None
+        self._last_cut = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """Wait for a free slot. Returns the start time of the request."""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self, latency: float) -> None:
+        with self._condition:
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            if self._best_latency is None or self._latency < self._best_latency:
+                self._best_latency = self._latency
+            if self._latency > self.latency_tolerance * self._best_latency:
+                self._healthy = 0
+                return
+            self._healthy += 1
+            if self._healthy >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._healthy = 0
+                self._condition.notify()
+
+    def on_throttle(self, started: float) -> None:
+        with self._condition:
+            # Requests sent before the last cut saw the old limit; cut once for all of them.
+            if started < self._last_cut:
+                return
+            self.limit = max(self.minimum, self.limit // 2)
+            self._healthy = 0
+            self._last_cut = time.monotonic()
+
+
+class RequestScheduler:
+    """
+    Schedules the model requests of all pipeline stages.
+
+    Each provider gets an optional token bucket (rate_limits maps a provider to requests
+    per second, or to a (rate, burst) pair) and an adaptive concurrency limit of at most
+    max_concurrency requests in flight. A request failing with a retryable error gives up
+    its slot, waits an exponential backoff with full jitter, and is queued again behind
+    the waiting requests; after max_retries retries its error is raised.
+
+    Args:
+        rate_limits: Requests per second per provider (providers not listed are not rate limited)
+        max_concurrency: Upper bound of the adaptive concurrency limit per provider
+        min_concurrency: Lower bound of the adaptive concurrency limit
+        max_retries: Retries of a failed request before its error is raised
+        base_delay: Backoff before the first retry, in seconds
+        max_delay: Upper bound of the backoff, in seconds
+    """
+
+    def __init__(self, rate_limits: Optional[Dict[str, Any]] = None, max_concurrency: int = 4,
+                 min_concurrency: int = 1, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets: Dict[str, TokenBucket] = {}
+        for provider, limit in (rate_limits or {}).items():
+            if limit:
+                rate, burst = limit if isinstance(limit, (tuple, list)) else (limit, None)
+                self._buckets[provider.lower()] = TokenBucket(rate, burst)
+        self._limiters: Dict[str, AdaptiveConcurrency] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _provider_state(self, provider: str) -> Tuple[Optional[TokenBucket], AdaptiveConcurrency, Dict[str, float]]:
+        with self._lock:
+            if provider not in self._limiters:
+                self._limiters[provider] = AdaptiveConcurrency(self.max_concurrency, self.min_concurrency)
+                self._stats[provider] = {"requests": 0, "retries": 0, "throttled": 0, "failed": 0, "rate_wait": 0.0}
+            return self._buckets.get(provider), self._limiters[provider], self._stats[provider]
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number attempt + 1."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, provider: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run func(*args, **kwargs) as one request to provider, retrying retryable failures.
+        """
+        provider = provider.lower()
+        bucket, limiter, stats = self._provider_state(provider)
+        attempt = 0
+        while True:
+            waited = bucket.acquire() if bucket is not None else 0.0
+            started = limiter.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                limiter.release()
+                kind = classify_error(e)
+                with self._lock:
+                    stats["requests"] += 1
+                    stats["rate_wait"] += waited
+                    stats["throttled"] += kind == THROTTLED
+                    if kind is None or attempt >= self.max_retries:
+                        stats["failed"] += 1
+                    else:
+                        stats["retries"] += 1
+                if kind is None or attempt >= self.max_retries:
+                    raise
+                if kind == THROTTLED:
+                    limiter.on_throttle(started)
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            latency = time.monotonic() - started
+            limiter.release()
+            limiter.on_success(latency)
+            with self._lock:
+                stats["requests"] += 1
+                stats["rate_wait"] += waited
+            return result
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-provider requests, retries, throttled and failed requests, current concurrency limit and rate-limit wait."""
+        with self._lock:
+            return {provider: dict(stats, concurrency=self._limiters[provider].limit)
+                    for provider, stats in self._stats.items()}
@@ -0,0 +1,265 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import math
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def build_term_matrix(tokenized_docs: Iterable[List[str]],
+                      vocabulary: Optional[Dict[str, int]] = None) -> Tuple[csr_matrix, Dict[str, int]]:
+    """
+    Builds a documents-by-terms matrix of raw term frequencies.
+
+    Parameters:
+        tokenized_docs (Iterable[List[str]]): The preprocessed tokens of each document.
+        vocabulary (Optional[Dict[str, int]]): Mapping from term to column index. It is
+            extended in place with unseen terms; a new one is created when omitted.
+
+    Returns:
+        Tuple[csr_matrix, Dict[str, int]]: The CSR term-frequency matrix and the vocabulary.
+    """
+    vocabulary = {} if vocabulary is None else vocabulary
+    indptr = [0]
+    indices: List[int] = []
+    for tokens in tokenized_docs:
+        for token in tokens:
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float64)
+    matrix = csr_matrix((data, np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+                        shape=(len(indptr) - 1, len(vocabulary)))
+    # Duplicate (document, term) entries are summed into term frequencies.
+    matrix.sum_duplicates()
+    return matrix, vocabulary
+
+
+def top_k_indices(scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    """
+    Returns the indices of the k highest scores in descending order of score.
+    Ties keep their original order, matching a stable descending sort.
+
+    Parameters:
+        scores (np.ndarray): One-dimensional array of scores.
+        k (Optional[int]): Number of indices to return (default: all).
+
+    Returns:
+        np.ndarray: The selected indices.
+    """
+    n = scores.shape[0]
+    if k is None or k >= n:
+        return np.argsort(-scores, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    kth_score = -np.partition(-scores, k - 1)[k - 1]
+    above = np.flatnonzero(scores > kth_score)
+    tied = np.flatnonzero(scores == kth_score)[:k - above.shape[0]]
+    candidates = np.concatenate([above, tied])
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+class SparseBM25:
+    """
+    Okapi BM25 over a sparse term-frequency matrix.
+
+    Scores are identical to rank_bm25's BM25Okapi, including the epsilon floor
+    applied to negative idf values, but every query is scored with a single
+    sparse matrix-vector product instead of a Python loop over query terms.
+    """
+
+    def __init__(self,
+                 term_matrix: csr_matrix,
+                 vocabulary: Dict[str, int],
+                 k1: float = 0.75,
+                 b: float = 0.75,
+                 epsilon: float = 0.25):
+        self.term_matrix = term_matrix.tocsr()
+        self.vocabulary = vocabulary
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.corpus_size = self.term_matrix.shape[0]
+        self.doc_len = np.asarray(self.term_matrix.sum(axis=1)).ravel()
+        self.avgdl = self.doc_len.mean() if self.corpus_size else 0.0
+        self.idf = self._calc_idf()
+        self.weights = self._calc_weights()
+
+    @classmethod
+    def from_tokenized(cls, tokenized_docs: Iterable[List[str]], **kwargs) -> 'SparseBM25':
+        term_matrix, vocabulary = build_term_matrix(tokenized_docs)
+        return cls(term_matrix, vocabulary, **kwargs)
+
+    def subset(self, rows: Sequence[int]) -> 'SparseBM25':
+        """
+        Returns a model over a subset of the documents, with corpus statistics
+        recomputed for that subset. The vocabulary is shared.
+        """
+        return SparseBM25(self.term_matrix[np.asarray(rows, dtype=np.int64)], self.vocabulary,
+                          k1=self.k1, b=self.b, epsilon=self.epsilon)
+
+    def _calc_idf(self) -> np.ndarray:
+        doc_freq = np.bincount(self.term_matrix.indices, minlength=self.term_matrix.shape[1])
+        present = doc_freq > 0
+        idf = np.zeros(self.term_matrix.shape[1], dtype=np.float64)
+        if not present.any():
+            return idf
+        freq = doc_freq[present]
+        present_idf = np.log(self.corpus_size - freq + 0.5) - np.log(freq + 0.5)
+        # Floor negative idf values at epsilon times the average idf, as BM25Okapi does.
+        # fsum keeps the average independent of the vocabulary's column order.
+        eps = self.epsilon * math.fsum(present_idf) / present_idf.shape[0]
+        present_idf[present_idf < 0] = eps
+        idf[present] = present_idf
+        return idf
+
+    def _calc_weights(self) -> csr_matrix:
+        weights = self.term_matrix.copy()
+        if self.avgdl == 0:
+            return weights
+        tf = weights.data
+        row_len = np.repeat(self.doc_len, np.diff(weights.indptr))
+        norm = self.k1 * (1 - self.b + self.b * row_len / self.avgdl)
+        weights.data = self.idf[weights.indices] * (tf * (self.k1 + 1) / (tf + norm))
+        return weights
+
+    def query_matrix(self, queries: Sequence[List[str]]) -> Tuple[np.ndarray, csr_matrix]:
+        """
+        Builds a matrix of query term counts over the terms used by the queries.
+        Terms outside the vocabulary are dropped since they contribute nothing to the score.
+
+        Returns:
+            Tuple[np.ndarray, csr_matrix]: The vocabulary columns of the query terms, sorted
+            by term, and the matching terms-by-queries count matrix.
+        """
+        terms = sorted({token for query_tokens in queries for token in query_tokens
+                        if self.vocabulary.get(token, self.weights.shape[1]) < self.weights.shape[1]})
+        term_rows = {term: row for row, term in enumerate(terms)}
+        rows: List[int] = []
+        cols: List[int] = []
+        for query_index, query_tokens in enumerate(queries):
+            for token in query_tokens:
+                row = term_rows.get(token)
+                if row is not None:
+                    rows.append(row)
+                    cols.append(query_index)
+        data = np.ones(len(rows), dtype=np.float64)
+        matrix = csr_matrix((data, (rows, cols)), shape=(len(terms), len(queries)))
+        matrix.sum_duplicates()
+        columns = np.asarray([self.vocabulary[term] for term in terms], dtype=np.int64)
+        return columns, matrix
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        """
+        Scores every document against a single preprocessed query.
+        """
+        return self.get_batch_scores([query_tokens])[:, 0]
+
+    def get_batch_scores(self, queries: Sequence[List[str]]) -> np.ndarray:
+        """
+        Scores every document against many preprocessed queries at once.
+
+        Returns:
+            np.ndarray: A dense documents-by-queries score matrix.
+        """
+        if self.corpus_size == 0 or not queries:
+            return np.zeros((self.corpus_size, len(queries)))
+        columns, query_counts = self.query_matrix(queries)
+        # Restricting the weights to the query terms, ordered by term, fixes the summation
+        # order so a document's score does not depend on how the vocabulary was built.
+        query_weights = self.weights[:, columns]
+        query_weights.sort_indices()
+        return (query_weights @ query_counts).toarray()
+
+    def top_k(self, query_tokens: List[str], k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the indices and scores of the k best documents for a query.
+        """
+        scores = self.get_scores(query_tokens)
+        order = top_k_indices(scores, k)
+        return order, scores[order]
+
+
+class CorpusStatistics:
+    """
+    Document count, total length and document frequencies of a corpus, accumulated
+    chunk by chunk so the corpus never has to be held in memory at once.
+    Memory grows with the vocabulary, not with the number of documents.
+    """
+
+    def __init__(self):
+        self.corpus_size = 0
+        self.total_length = 0
+        self.doc_freq: Dict[str, int] = {}
+
+    def update(self, tokenized_docs: Iterable[List[str]]):
+        for tokens in tokenized_docs:
+            self.corpus_size += 1
+            self.total_length += len(tokens)
+            for token in set(tokens):
+                self.doc_freq[token] = self.doc_freq.get(token, 0) + 1
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_length / self.corpus_size if self.corpus_size else 0.0
+
+    def idf(self, terms: Iterable[str], epsilon: float = 0.25) -> Dict[str, float]:
+        """
+        Returns the BM25Okapi idf of the given terms, with negative values floored
+        at epsilon times the average idf over the whole vocabulary.
+        """
+        if not self.doc_freq:
+            return {term: 0.0 for term in terms}
+        freq = np.fromiter(self.doc_freq.values(), dtype=np.float64, count=len(self.doc_freq))
+        all_idf = np.log(self.corpus_size - freq + 0.5) - np.log(freq + 0.5)
+        eps = epsilon * math.fsum(all_idf) / all_idf.shape[0]
+        idf = {}
+        for term in terms:
+            n = self.doc_freq.get(term)
+            if n is None:
+                idf[term] = 0.0
+            else:
+                value = math.log(self.corpus_size - n + 0.5) - math.log(n + 0.5)
+                idf[term] = eps if value < 0 else value
+        return idf
+
+    def scorer(self, query_tokens: List[str], k1: float = 0.75, b: float = 0.75,
+               epsilon: float = 0.25) -> 'ChunkScorer':
+        return ChunkScorer(self, query_tokens, k1=k1, b=b, epsilon=epsilon)
+
+
+class ChunkScorer:
+    """
+    Scores chunks of documents for one query using fixed corpus statistics.
+    """
+
+    def __init__(self, statistics: CorpusStatistics, query_tokens: List[str],
+                 k1: float = 0.75, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.avgdl = statistics.avgdl
+        # Query term counts, ordered by term like SparseBM25.get_batch_scores.
+        counts: Dict[str, int] = {}
+        for token in query_tokens:
+            if token in statistics.doc_freq:
+                counts[token] = counts.get(token, 0) + 1
+        self.terms = sorted(counts)
+        self.counts = [float(counts[term]) for term in self.terms]
+        idf = statistics.idf(self.terms, epsilon)
+        self.idf = [idf[term] for term in self.terms]
+
+    def score(self, tokenized_docs: Sequence[List[str]]) -> np.ndarray:
+        scores = np.zeros(len(tokenized_docs))
+        if not self.terms or self.avgdl == 0:
+            return scores
+        term_index = {term: index for index, term in enumerate(self.terms)}
+        tf = np.zeros((len(tokenized_docs), len(self.terms)))
+        doc_len = np.empty(len(tokenized_docs))
+        for row, tokens in enumerate(tokenized_docs):
+            doc_len[row] = len(tokens)
+            for token in tokens:
+                index = term_index.get(token)
+                if index is not None:
+                    tf[row, index] += 1
+        norm = self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)
+        for index, (idf, count) in enumerate(zip(self.idf, self.counts)):
+            term_tf = tf[:, index]
+            scores += idf * (term_tf * (self.k1 + 1) / (term_tf + norm)) * count
+        return scores
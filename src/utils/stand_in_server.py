@@ -0,0 +1,133 @@
+"""
+Local stand-in for an Ollama or OpenAI-compatible model server that injects latency,
+used to test request hedging, rate limiting and retries without a real model.
+"""
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+
+class StandInSettings:
+    """
+    Behaviour of the stand-in server.
+
+    Args:
+        latency: Median latency of a response, in seconds
+        jitter: Spread of the latency (sigma of its log-normal distribution)
+        tail_probability: Fraction of requests answered after tail_latency instead
+        tail_latency: Latency of the slow tail, in seconds
+        error_probability: Fraction of requests answered with a 429 error
+        reply: Content of every answer (default: the last line of the prompt)
+        parallel: Requests processed at once, like the parallel slots of an inference host
+            (default: unlimited); further requests wait for a slot
+    """
+
+    def __init__(self, latency: float = 0.2, jitter: float = 0.3, tail_probability: float = 0.05,
+                 tail_latency: float = 5.0, error_probability: float = 0.0, reply: Optional[str] = None,
+                 parallel: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_probability = tail_probability
+        self.tail_latency = tail_latency
+        self.error_probability = error_probability
+        self.reply = reply
+        self.slots = threading.Semaphore(parallel) if parallel else None
+        self.requests = 0
+        self.cancelled = 0
+        self.lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        if random.random() < self.tail_probability:
+            return self.tail_latency
+        return random.lognormvariate(0, self.jitter) * self.latency
+
+
+def _answer(path: str, model: str, content: str) -> Dict[str, Any]:
+    if path.startswith("/v1/"):
+        return {
+            "id": f"chatcmpl-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+    return {
+        "model": model,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "message": {"role": "assistant", "content": content},
+        "done": True,
+    }
+
+
+def _make_handler(settings: StandInSettings):
+    class StandInHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: Dict[str, Any]) -> bool:
+            data = json.dumps(body).encode("utf-8")
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return True
+            except (BrokenPipeError, ConnectionResetError):
+                # The client cancelled the request, e.g. a hedge that lost the race.
+                with settings.lock:
+                    settings.cancelled += 1
+                return False
+
+        def do_GET(self):
+            # Health checks, as Ollama answers them.
+            if self.path == "/api/version":
+                self._send_json(200, {"version": "stand-in"})
+            else:
+                self._send_json(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path not in ("/api/chat", "/v1/chat/completions"):
+                self._send_json(404, {"error": f"unknown path {self.path}"})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with settings.lock:
+                settings.requests += 1
+            if settings.slots is not None:
+                with settings.slots:
+                    time.sleep(settings.sample_latency())
+            else:
+                time.sleep(settings.sample_latency())
+            if random.random() < settings.error_probability:
+                self._send_json(429, {"error": "rate limit exceeded"})
+                return
+            messages = request.get("messages") or [{"content": ""}]
+            content = settings.reply
+            if content is None:
+                content = messages[-1].get("content", "").strip().splitlines()[-1:] or [""]
+                content = content[0]
+            self._send_json(200, _answer(self.path, request.get("model", "stand-in"), content))
+
+    return StandInHandler
+
+
+def start_stand_in_server(host: str = "127.0.0.1", port: int = 11435,
+                          settings: Optional[StandInSettings] = None) -> Tuple[ThreadingHTTPServer, StandInSettings]:
+    """
+    Start the stand-in server on a background thread.
+
+    Answers Ollama's /api/chat and OpenAI's /v1/chat/completions, so prompt_model can be
+    pointed at it with host="http://127.0.0.1:11435" (Ollama) or the same URL + "/v1" (OpenAI).
+
+    Returns:
+        The running server (stop it with server.shutdown()) and its settings
+    """
+    settings = settings or StandInSettings()
+    server = ThreadingHTTPServer((host, port), _make_handler(settings))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stand-in-server", daemon=True).start()
+    return server, settings
@@ -0,0 +1,236 @@
+from .xml_parsing import xml_processing
+from .config import STOPWORDS_PATH
+import os
+import re
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+# Bump whenever the token output changes so stale caches are discarded.
+TOKENIZER_VERSION = 1
+
+NON_ALPHA_PATTERN = re.compile(r'[^a-zA-Z\s]')
+
+# Contractions split by nltk's word_tokenize. After non-alphabetic characters are
+# removed these are the only rules that still apply to the text.
+CONTRACTIONS = {
+    'cannot': ('can', 'not'),
+    'gimme': ('gim', 'me'),
+    'gonna': ('gon', 'na'),
+    'gotta': ('got', 'ta'),
+    'lemme': ('lem', 'me'),
+    'wanna': ('wan', 'na'),
+}
+
+# Below this many documents a process pool costs more than it saves.
+MIN_PARALLEL_DOCUMENTS = 256
+
+
+@lru_cache(maxsize=None)
+def get_stop_words() -> FrozenSet[str]:
+    """
+    Loads the bundled English stopword list (a copy of nltk's) on first use.
+    Reading it from the repository keeps tokenization offline and deterministic.
+
+    Returns:
+        FrozenSet[str]: The stopwords.
+    """
+    with open(STOPWORDS_PATH, 'r', encoding='utf-8') as file:
+        return frozenset(line.strip() for line in file if line.strip())
+
+
+@lru_cache(maxsize=None)
+def get_stemmer():
+    """
+    Creates the Porter stemmer on first use, deferring the nltk import.
+    """
+    from nltk.stem import PorterStemmer
+    return PorterStemmer()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercases the text, removes non-alphabetic characters and splits it into words.
+    Produces the same tokens as nltk's word_tokenize on alphabetic-only text.
+
+    Parameters:
+        text (str): The input text to tokenize.
+
+    Returns:
+        List[str]: A list of raw tokens.
+    """
+    text = NON_ALPHA_PATTERN.sub('', text.lower())
+    tokens = []
+    for word in text.split():
+        split_word = CONTRACTIONS.get(word)
+        if split_word is None:
+            tokens.append(word)
+        else:
+            tokens.extend(split_word)
+    return tokens
+
+
+@lru_cache(maxsize=None)
+def stem(token: str) -> str:
+    """
+    Stems a token with the Porter stemmer, memoizing the result.
+
+    Parameters:
+        token (str): The token to stem.
+
+    Returns:
+        str: The stemmed token.
+    """
+    return get_stemmer().stem(token)
+
+
+def preprocess_text(text: str) -> List[str]:
+    """
+    Preprocesses text by lowercasing, removing non-alphabetic characters,
+    tokenizing, removing stopwords, and applying stemming.
+
+    Parameters:
+        text (str): The input text to preprocess.
+
+    Returns:
+        List[str]: A list of preprocessed tokens.
+    """
+    stop_words = get_stop_words()
+    return [stem(token) for token in tokenize(text) if token not in stop_words]
+
+
+def extract_trial_text(xml_dir: str, xml_id: str) -> str:
+    """
+    Concatenates the indexed fields and eligibility criteria of a trial XML file.
+
+    Parameters:
+        xml_dir (str): Directory containing the XML files.
+        xml_id (str): The XML file identifier.
+
+    Returns:
+        str: The trial text used for lexical matching.
+    """
+    file_path = os.path.join(xml_dir, f'{xml_id}.xml')
+    inclusion_text, exclusion_text, element_dict = xml_processing(file_path)
+
+    text_parts = []
+    for key, value in element_dict.items():
+        if value is not None:
+            # For these keys, assume the value is a list.
+            if key in ['condition', 'keyword', 'condition_browse']:
+                text_parts.append(' '.join(value))
+            else:
+                text_parts.append(value)
+    if inclusion_text is not None:
+        text_parts.append(inclusion_text)
+    if exclusion_text is not None:
+        text_parts.append(exclusion_text)
+
+    return ' '.join(text_parts)
+
+
+def _tokenize_trial(args) -> List[str]:
+    xml_dir, xml_id = args
+    return preprocess_text(extract_trial_text(xml_dir, xml_id))
+
+
+def _chunksize(n_items: int, workers: int) -> int:
+    return max(1, n_items // (workers * 4))
+
+
+def tokenize_documents(texts: List[str], workers: Optional[int] = None) -> List[List[str]]:
+    """
+    Preprocesses many documents, using a process pool for large batches.
+
+    Parameters:
+        texts (List[str]): The documents to preprocess.
+        workers (Optional[int]): Number of worker processes (default: CPU count).
+            A value of 1 disables the pool.
+
+    Returns:
+        List[List[str]]: The preprocessed tokens of each document, in input order.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(texts) < MIN_PARALLEL_DOCUMENTS:
+        return [preprocess_text(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(preprocess_text, texts, chunksize=_chunksize(len(texts), workers)))
+
+
+class TokenCache:
+    """
+    Persistent store of preprocessed trial tokens keyed by trial id.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.tokens: Dict[str, List[str]] = {}
+        self._dirty = False
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as file:
+                cached = pickle.load(file)
+            if cached.get('version') == TOKENIZER_VERSION:
+                self.tokens = cached['tokens']
+            else:
+                print(f"Discarding token cache {path} built by an older tokenizer")
+
+    def __contains__(self, trial_id: str) -> bool:
+        return trial_id in self.tokens
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def get(self, trial_id: str) -> Optional[List[str]]:
+        return self.tokens.get(trial_id)
+
+    def update(self, tokens: Dict[str, List[str]]):
+        if tokens:
+            self.tokens.update(tokens)
+            self._dirty = True
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump({'version': TOKENIZER_VERSION, 'tokens': self.tokens}, file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def tokenize_trials(xml_dir: str,
+                    xml_ids: Iterable[str],
+                    cache: Optional[TokenCache] = None,
+                    workers: Optional[int] = None) -> Dict[str, List[str]]:
+    """
+    Returns the preprocessed tokens of each trial, parsing and tokenizing only
+    trials missing from the cache. Newly tokenized trials are added to the cache.
+
+    Parameters:
+        xml_dir (str): Directory containing the XML files.
+        xml_ids (Iterable[str]): Trial identifiers.
+        cache (Optional[TokenCache]): Token cache shared across calls.
+        workers (Optional[int]): Number of worker processes (default: CPU count).
+
+    Returns:
+        Dict[str, List[str]]: A mapping from trial id to its tokens.
+    """
+    xml_ids = list(dict.fromkeys(xml_ids))
+    cache = cache if cache is not None else TokenCache()
+    missing = [xml_id for xml_id in xml_ids if xml_id not in cache]
+
+    if missing:
+        workers = workers or os.cpu_count() or 1
+        args = [(xml_dir, xml_id) for xml_id in missing]
+        if workers == 1 or len(missing) < MIN_PARALLEL_DOCUMENTS:
+            token_lists = [_tokenize_trial(arg) for arg in args]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                token_lists = list(executor.map(_tokenize_trial, args,
+                                                chunksize=_chunksize(len(args), workers)))
+        cache.update(dict(zip(missing, token_lists)))
+
+    return {xml_id: cache.get(xml_id) for xml_id in xml_ids}
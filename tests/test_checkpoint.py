@@ -0,0 +1,68 @@
+import sys
+import os
+import json
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils.checkpoint import CheckpointJournal, compact_checkpoint, journal_path
+
+
+@pytest.fixture
+def results_path(tmp_path):
+    return str(tmp_path / "fine_labelling.json")
+
+
+def test_records_are_replayed_after_a_crash(results_path):
+    journal = CheckpointJournal(results_path)
+    journal.record(["1", "NCT1"], {"label": "eligible"})
+    journal.record([2, "NCT2"], "excluded")
+    # No close: the process dies with the records only in the journal.
+    journal._file.close()
+
+    resumed = CheckpointJournal(results_path)
+    assert resumed.replayed == 2
+    assert resumed.state == {"1": {"NCT1": {"label": "eligible"}}, "2": {"NCT2": "excluded"}}
+    resumed.close(compact=False)
+
+
+def test_partial_last_record_is_dropped(results_path):
+    journal = CheckpointJournal(results_path)
+    journal.record(["1", "NCT1"], "eligible")
+    journal._file.write('{"keys": ["1", "NCT2"], "val')
+    journal._file.close()
+
+    resumed = CheckpointJournal(results_path)
+    assert resumed.state == {"1": {"NCT1": "eligible"}}
+    resumed.record(["1", "NCT3"], "excluded")
+    resumed._file.close()
+    with open(journal_path(results_path)) as file:
+        assert [json.loads(line)["keys"] for line in file] == [["1", "NCT1"], ["1", "NCT3"]]
+
+
+def test_context_manager_compacts_into_the_results_file(results_path):
+    with open(results_path, 'w') as file:
+        json.dump({"1": {"NCT0": "eligible"}}, file)
+    with CheckpointJournal(results_path) as journal:
+        journal.record(["1", "NCT1"], "excluded")
+    with open(results_path) as file:
+        assert json.load(file) == {"1": {"NCT0": "eligible", "NCT1": "excluded"}}
+    assert not os.path.exists(journal_path(results_path))
+
+
+def test_journal_is_kept_when_the_block_raises(results_path):
+    with pytest.raises(RuntimeError):
+        with CheckpointJournal(results_path) as journal:
+            journal.record(["1", "NCT1"], "eligible")
+            raise RuntimeError("interrupted")
+    assert not os.path.exists(results_path)
+    assert CheckpointJournal(results_path).state == {"1": {"NCT1": "eligible"}}
+
+
+def test_compact_checkpoint(results_path):
+    assert compact_checkpoint(results_path) is None
+    journal = CheckpointJournal(results_path)
+    journal.record(["1", "NCT1"], "eligible")
+    journal.close(compact=False)
+    assert compact_checkpoint(results_path) == 1
+    with open(results_path) as file:
+        assert json.load(file) == {"1": {"NCT1": "eligible"}}
+    assert not os.path.exists(journal_path(results_path))
@@ -0,0 +1,31 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.processing.depth import normalize_scores, adaptive_depths, read_retrieval_scores
+
+
+SCORES = {"1": [10.0, 9.0, 8.0, 1.0], "2": [5.0, 1.0, 1.0, 1.0]}
+
+
+def test_normalize_scores():
+    assert normalize_scores([4.0, 2.0, 3.0, 0.0]) == [1.0, 0.5, 0.5, 0.0]
+    assert normalize_scores([0.0, 0.0]) == [1.0, 1.0]
+
+
+def test_budget_goes_to_the_highest_normalized_scores():
+    # Topic 1 stays close to its top score for three trials; topic 2 drops after its first.
+    assert adaptive_depths(SCORES, call_budget=5) == {"1": 3, "2": 2}
+    assert adaptive_depths(SCORES, call_budget=4) == {"1": 3, "2": 1}
+    assert adaptive_depths(SCORES, call_budget=10, calls_per_trial=2) == {"1": 3, "2": 2}
+
+
+def test_depth_limits():
+    assert adaptive_depths(SCORES, call_budget=1) == {"1": 1, "2": 1}
+    assert adaptive_depths(SCORES, call_budget=1, min_depth=2) == {"1": 2, "2": 2}
+    assert adaptive_depths(SCORES, call_budget=100, max_depth=3) == {"1": 3, "2": 3}
+
+
+def test_read_retrieval_scores(tmp_path):
+    run = tmp_path / "qrel.txt"
+    run.write_text("1 Q0 NCT2 2 4.5 run\n1 Q0 NCT1 1 6.0 run\n2 Q0 NCT3 1 2.0 run\nbad line\n")
+    assert read_retrieval_scores(str(run)) == {"1": [("NCT1", 6.0), ("NCT2", 4.5)], "2": [("NCT3", 2.0)]}
@@ -0,0 +1,98 @@
+import sys
+import os
+import json
+import asyncio
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils.hedging import RequestHedger
+from src.utils.stand_in_server import start_stand_in_server, StandInSettings
+
+
+@pytest.fixture
+def servers():
+    # A primary host that always answers slowly and an alternate host that answers at once.
+    slow, slow_settings = start_stand_in_server(port=0, settings=StandInSettings(latency=1.0, jitter=0.0,
+                                                                                 tail_probability=0.0))
+    fast, fast_settings = start_stand_in_server(port=0, settings=StandInSettings(latency=0.01, jitter=0.0,
+                                                                                 tail_probability=0.0))
+    yield ((f"http://127.0.0.1:{slow.server_address[1]}", slow_settings),
+           (f"http://127.0.0.1:{fast.server_address[1]}", fast_settings))
+    slow.shutdown()
+    fast.shutdown()
+
+
+def make_send(prompt, cancelled):
+    async def send(host):
+        # Minimal Ollama /api/chat request, so the test needs no client library.
+        address, port = host.rsplit("//", 1)[1].split(":")
+        reader, writer = await asyncio.open_connection(address, int(port))
+        try:
+            body = json.dumps({"model": "stand-in", "messages": [{"role": "user", "content": prompt}]}).encode()
+            writer.write(b"POST /api/chat HTTP/1.1\r\nHost: stand-in\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+            await writer.drain()
+            response = await reader.read()
+            return json.loads(response.split(b"\r\n\r\n", 1)[1])["message"]["content"]
+        except asyncio.CancelledError:
+            cancelled.append(host)
+            raise
+        finally:
+            writer.close()
+    return send
+
+
+def test_hedge_wins_and_loser_is_cancelled(servers):
+    (slow_host, slow_settings), (fast_host, fast_settings) = servers
+    hedger = RequestHedger(percentile=95, budget=1.0, hosts=[fast_host], min_samples=1)
+    hedger.latencies.add(0.05)
+    cancelled = []
+    try:
+        assert hedger.call(make_send("hedged prompt", cancelled), slow_host) == "hedged prompt"
+    finally:
+        hedger.close()
+    assert hedger.stats()["hedged"] == 1
+    assert hedger.stats()["hedge_wins"] == 1
+    assert cancelled == [slow_host]
+    assert slow_settings.requests == 1 and fast_settings.requests == 1
+
+
+def test_fast_request_is_not_hedged(servers):
+    _, (fast_host, fast_settings) = servers
+    hedger = RequestHedger(percentile=95, budget=1.0, min_samples=1)
+    hedger.latencies.add(0.5)
+    cancelled = []
+    try:
+        assert hedger.call(make_send("fast prompt", cancelled), fast_host) == "fast prompt"
+    finally:
+        hedger.close()
+    assert hedger.stats()["hedged"] == 0
+    assert cancelled == [] and fast_settings.requests == 1
+
+
+def test_close_runs_on_close_and_closes_loop():
+    loops = []
+
+    async def on_close():
+        loops.append(asyncio.get_running_loop())
+
+    async def send(host):
+        return "answer"
+
+    hedger = RequestHedger(on_close=on_close)
+    assert hedger.call(send) == "answer"
+    hedger.close()
+    assert len(loops) == 1 and loops[0].is_closed()
+
+
+def test_prompt_model_hedges_to_alternate_host(servers):
+    pytest.importorskip("ollama")
+    from src.utils import model_api
+    (slow_host, _), (fast_host, _) = servers
+    hedger = model_api.enable_hedging(95, 1.0, [fast_host], min_samples=1)
+    hedger.latencies.add(0.05)
+    try:
+        assert model_api.prompt_model("hedged prompt", "stand-in", host=slow_host, use_cache=False) == "hedged prompt"
+        assert hedger.stats()["hedge_wins"] == 1
+    finally:
+        model_api.disable_hedging()
+    assert not model_api._async_clients
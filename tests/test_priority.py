@@ -0,0 +1,43 @@
+import sys
+import os
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.processing.priority import order_pairs, LabellingBudget, make_budget
+
+
+TRIALS = {"1": ["NCT1", "NCT2", "NCT3"], "2": ["NCT4"], "3": ["NCT5", "NCT6"]}
+
+
+def test_topic_order_keeps_each_topic_together():
+    assert order_pairs(TRIALS, "topic") == [("1", "NCT1"), ("1", "NCT2"), ("1", "NCT3"), ("2", "NCT4"),
+                                            ("3", "NCT5"), ("3", "NCT6")]
+
+
+def test_rank_order_interleaves_topics_by_rank():
+    assert order_pairs(TRIALS, "rank") == [("1", "NCT1"), ("2", "NCT4"), ("3", "NCT5"), ("1", "NCT2"),
+                                           ("3", "NCT6"), ("1", "NCT3")]
+
+
+def test_unknown_order():
+    with pytest.raises(ValueError):
+        order_pairs(TRIALS, "random")
+
+
+def test_budget_refuses_calls_beyond_the_limit():
+    budget = LabellingBudget(max_calls=3)
+    assert budget.acquire(2)
+    assert not budget.acquire(2)
+    assert not budget.exhausted()
+    assert budget.acquire()
+    assert budget.exhausted() and not budget.acquire()
+    assert (budget.stats()["calls"], budget.stats()["refused"]) == (3, 2)
+
+
+def test_budget_refuses_calls_once_the_time_is_up():
+    budget = LabellingBudget(max_seconds=0)
+    assert budget.exhausted() and not budget.acquire()
+
+
+def test_make_budget():
+    assert make_budget() is None
+    assert make_budget(max_calls=10).max_calls == 10
@@ -0,0 +1,33 @@
+import sys
+import os
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+re_ranking = pytest.importorskip("src.processing.re_ranking")
+
+RESULTS = {"1": (["NCT1", "NCT3", "NCT4"], [2.0, 0.5, 0.0])}
+RETRIEVAL = {"1": ["NCT1", "NCT2", "NCT3", "NCT4", "NCT5"], "2": ["NCT6", "NCT7"]}
+
+
+def assert_descending(scores):
+    assert all(higher > lower for higher, lower in zip(scores, scores[1:]))
+
+
+def test_unlabelled_trials_follow_positive_scores():
+    completed = re_ranking.complete_ranking(RESULTS, RETRIEVAL, "after_positive")
+    trial_ids, scores = completed["1"]
+    assert trial_ids == ["NCT1", "NCT3", "NCT2", "NCT5", "NCT4"]
+    assert_descending(scores)
+    assert completed["2"][0] == ["NCT6", "NCT7"]
+    assert_descending(completed["2"][1])
+
+
+def test_unlabelled_trials_follow_every_labelled_trial():
+    trial_ids, scores = re_ranking.complete_ranking(RESULTS, RETRIEVAL, "last")["1"]
+    assert trial_ids == ["NCT1", "NCT3", "NCT4", "NCT2", "NCT5"]
+    assert_descending(scores)
+
+
+def test_unknown_placement():
+    with pytest.raises(ValueError):
+        re_ranking.complete_ranking(RESULTS, RETRIEVAL, "first")
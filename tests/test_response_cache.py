@@ -0,0 +1,60 @@
+import sys
+import os
+import itertools
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils import response_cache
+from src.utils.response_cache import ResponseCache, request_key
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache" / "responses.sqlite")
+
+
+def test_get_and_put(cache_path):
+    cache = ResponseCache(cache_path)
+    key = request_key("ollama", "model", "prompt")
+    assert cache.get(key) is None
+    cache.put(key, "answer")
+    assert cache.get(key) == "answer"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["size_bytes"] == len("answer")
+    cache.close()
+
+
+def test_responses_persist_across_instances(cache_path):
+    cache = ResponseCache(cache_path)
+    cache.put("key", "answer")
+    cache.put("key", "longer answer")
+    cache.close()
+    reopened = ResponseCache(cache_path)
+    assert reopened.get("key") == "longer answer"
+    assert reopened.stats()["size_bytes"] == len("longer answer")
+    reopened.close()
+
+
+def test_least_recently_used_responses_are_evicted(cache_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(response_cache.time, "time", lambda: float(next(clock)))
+    cache = ResponseCache(cache_path, max_bytes=30)
+    cache.put("a", "x" * 10)
+    cache.put("b", "x" * 10)
+    cache.put("c", "x" * 10)
+    assert cache.get("a") is not None
+    cache.put("d", "x" * 10)
+    # Over the limit, the oldest responses go until the cache is back under 90% of it.
+    assert cache.get("b") is None and cache.get("c") is None
+    assert cache.get("a") is not None and cache.get("d") is not None
+    assert cache.stats()["evictions"] == 2 and cache.stats()["size_bytes"] == 20
+    cache.close()
+
+
+def test_request_key():
+    key = request_key("ollama", "model", "prompt", {"max_tokens": 10})
+    assert key == request_key("Ollama", "model", "prompt", {"max_tokens": 10})
+    assert key != request_key("ollama", "model", "prompt", {"max_tokens": 20})
+    assert key != request_key("ollama", "model", "prompt")
+    assert key != request_key("openai", "model", "prompt", {"max_tokens": 10})
+    assert key != request_key("ollama", "other", "prompt", {"max_tokens": 10})
@@ -0,0 +1,67 @@
+import sys
+import os
+import time
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils.scheduler import classify_error, AdaptiveConcurrency, THROTTLED, TRANSIENT
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def wrapped(cause):
+    try:
+        raise cause
+    except Exception as error:
+        try:
+            raise RuntimeError("request failed") from error
+        except RuntimeError as wrapper:
+            return wrapper
+
+
+@pytest.mark.parametrize("error, expected", [
+    (StatusError(429), THROTTLED),
+    (StatusError(503), THROTTLED),
+    (StatusError(500), TRANSIENT),
+    (StatusError(400), None),
+    (StatusError(404), None),
+    (TimeoutError(), THROTTLED),
+    (ConnectionRefusedError(), TRANSIENT),
+    (wrapped(StatusError(429)), THROTTLED),
+    (wrapped(ConnectionResetError()), TRANSIENT),
+    (Exception("Error code: 429 - Too Many Requests"), THROTTLED),
+    (ValueError("invalid model name"), None),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+
+def test_limit_is_halved_once_per_batch_of_throttled_requests():
+    concurrency = AdaptiveConcurrency(maximum=8)
+    started = [concurrency.acquire() for _ in range(3)]
+    for start in started:
+        concurrency.on_throttle(start)
+        concurrency.release()
+    assert concurrency.limit == 4
+    time.sleep(0.001)
+    concurrency.on_throttle(time.monotonic())
+    assert concurrency.limit == 2
+
+
+def test_limit_grows_after_a_limits_worth_of_healthy_requests():
+    concurrency = AdaptiveConcurrency(maximum=8, minimum=2)
+    for _ in range(3):
+        time.sleep(0.001)
+        concurrency.on_throttle(time.monotonic())
+    assert concurrency.limit == 2
+    concurrency.on_success(1.0)
+    assert concurrency.limit == 2
+    concurrency.on_success(1.0)
+    assert concurrency.limit == 3
+    # Requests slower than latency_tolerance times the best latency do not count.
+    for _ in range(10):
+        concurrency.on_success(50.0)
+    assert concurrency.limit == 3
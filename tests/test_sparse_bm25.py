@@ -0,0 +1,70 @@
+import sys
+import os
+import random
+import numpy as np
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils.sparse_bm25 import SparseBM25, CorpusStatistics, build_term_matrix, top_k_indices
+
+BM25Okapi = pytest.importorskip("rank_bm25").BM25Okapi
+
+WORDS = ["cancer", "lung", "breast", "patient", "diabetes", "heart", "failure", "age", "year", "pregnant",
+         "women", "therapy", "stage", "metastatic", "insulin", "renal"]
+
+
+@pytest.fixture
+def corpus():
+    rng = random.Random(0)
+    # "patient" is in every document, so its idf is negative and floored at epsilon.
+    return [["patient"] + [rng.choice(WORDS) for _ in range(rng.randint(3, 40))] for _ in range(200)]
+
+
+QUERIES = [["lung", "cancer", "women"], ["heart", "heart", "failure"], ["patient", "insulin"],
+           ["unknown", "term"], []]
+
+
+@pytest.mark.parametrize("k1, b", [(0.75, 0.75), (1.5, 0.3)])
+def test_scores_match_bm25okapi(corpus, k1, b):
+    reference = BM25Okapi(corpus, k1=k1, b=b)
+    model = SparseBM25.from_tokenized(corpus, k1=k1, b=b)
+    for query in QUERIES:
+        np.testing.assert_allclose(model.get_scores(query), reference.get_scores(query), rtol=1e-12, atol=1e-12)
+
+
+def test_batch_scores_match_single_queries(corpus):
+    model = SparseBM25.from_tokenized(corpus)
+    batch = model.get_batch_scores(QUERIES)
+    for column, query in enumerate(QUERIES):
+        np.testing.assert_array_equal(batch[:, column], model.get_scores(query))
+
+
+def test_subset_matches_model_built_on_subset(corpus):
+    rows = list(range(0, len(corpus), 3))
+    subset = SparseBM25.from_tokenized(corpus).subset(rows)
+    reference = BM25Okapi([corpus[row] for row in rows], k1=0.75, b=0.75)
+    np.testing.assert_allclose(subset.get_scores(QUERIES[0]), reference.get_scores(QUERIES[0]), rtol=1e-12)
+
+
+def test_chunked_statistics_match_in_memory_scores(corpus):
+    statistics = CorpusStatistics()
+    for start in range(0, len(corpus), 64):
+        statistics.update(corpus[start:start + 64])
+    model = SparseBM25.from_tokenized(corpus)
+    for query in QUERIES:
+        scorer = statistics.scorer(query)
+        chunked = np.concatenate([scorer.score(corpus[start:start + 64]) for start in range(0, len(corpus), 64)])
+        np.testing.assert_allclose(chunked, model.get_scores(query), rtol=1e-12, atol=1e-12)
+
+
+def test_top_k_indices_is_a_stable_descending_sort():
+    scores = np.array([1.0, 3.0, 2.0, 3.0, 1.0, 2.0, 0.0])
+    full = np.argsort(-scores, kind="stable")
+    for k in range(len(scores) + 1):
+        np.testing.assert_array_equal(top_k_indices(scores, k), full[:k])
+    np.testing.assert_array_equal(top_k_indices(scores), full)
+
+
+def test_term_matrix_counts_term_frequencies():
+    matrix, vocabulary = build_term_matrix([["a", "b", "a"], [], ["c"]])
+    assert vocabulary == {"a": 0, "b": 1, "c": 2}
+    assert matrix.toarray().tolist() == [[2, 1, 0], [0, 0, 0], [0, 0, 1]]
@@ -0,0 +1,42 @@
+import sys
+import os
+import json
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.utils.model_api import estimate_tokens
+from src.processing.token_budget import chunk_sections, split_criteria, split_line, merge_structured_outputs
+
+INCLUSION = "\n".join(f"{index}. Patients aged 18 years or older with confirmed diagnosis {index}" for index in range(20))
+EXCLUSION = "\n".join(f"{index}. Pregnant or breastfeeding women, or prior therapy {index}" for index in range(20))
+
+
+def test_criteria_within_the_budget_are_unchanged():
+    assert chunk_sections([INCLUSION, EXCLUSION], None) == [[INCLUSION, EXCLUSION]]
+    assert chunk_sections([INCLUSION, ""], 10000) == [[INCLUSION, ""]]
+
+
+@pytest.mark.parametrize("max_tokens", [40, 100, 300])
+def test_chunks_pack_whole_lines_in_order(max_tokens):
+    chunks = chunk_sections([INCLUSION, EXCLUSION], max_tokens)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert sum(estimate_tokens(section) for section in chunk) <= max_tokens
+    for index, section in enumerate([INCLUSION, EXCLUSION]):
+        assert [line for chunk in chunks for line in chunk[index].splitlines()] == section.splitlines()
+
+
+def test_long_lines_are_split_at_sentence_then_word_boundaries():
+    line = "First sentence about the disease. " + " ".join(["word"] * 60) + "; last clause."
+    pieces = split_line(line, 20)
+    assert all(estimate_tokens(piece) <= 20 for piece in pieces)
+    assert " ".join(pieces).split() == line.split()
+    assert len(split_criteria(line, 20)) > 1
+
+
+def test_merge_structured_outputs():
+    first = 'Output: {"criterion": "age >= 18"}\nsome explanation'
+    second = '{"criterion": "not pregnant"}\n[1, 2]'
+    assert merge_structured_outputs([first]) == first
+    merged = merge_structured_outputs([first, None, second])
+    assert [json.loads(line) for line in merged.splitlines()] == [{"criterion": "age >= 18"},
+                                                                  {"criterion": "not pregnant"}]
@@ -0,0 +1,44 @@
+import sys
+import os
+import pickle
+import pytest
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+tokenization = pytest.importorskip("src.utils.tokenization")
+nltk_tokenize = pytest.importorskip("nltk.tokenize")
+
+TEXTS = [
+    "Patients aged 18-75 years with histologically confirmed NSCLC.",
+    "Women who are pregnant, or breast-feeding; cannot give informed consent!",
+    "Prior therapy with anti-PD-1 (e.g. nivolumab) isn't allowed, gonna wanna gotta lemme gimme.",
+    "ECOG 0–1, eGFR ≥ 60 mL/min/1.73m²; HbA1c < 7.5%",
+    "  Multiple   spaces\tand\nnew lines  ",
+    "",
+]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_tokenize_matches_word_tokenize(text):
+    cleaned = tokenization.NON_ALPHA_PATTERN.sub('', text.lower())
+    # preserve_line skips sentence splitting; text without punctuation is a single sentence.
+    assert tokenization.tokenize(text) == nltk_tokenize.word_tokenize(cleaned, preserve_line=True)
+
+
+def test_preprocess_text_removes_stopwords_and_stems():
+    assert tokenization.preprocess_text("The patients were treated with therapies") == ["patient", "treat", "therapi"]
+
+
+def test_token_cache_round_trip(tmp_path):
+    path = str(tmp_path / "tokens.pkl")
+    cache = tokenization.TokenCache(path)
+    cache.update({"NCT1": ["lung", "cancer"]})
+    cache.save()
+    reloaded = tokenization.TokenCache(path)
+    assert "NCT1" in reloaded and reloaded.get("NCT1") == ["lung", "cancer"]
+
+
+def test_token_cache_discards_older_tokenizer(tmp_path):
+    path = str(tmp_path / "tokens.pkl")
+    with open(path, 'wb') as file:
+        pickle.dump({'version': tokenization.TOKENIZER_VERSION - 1, 'tokens': {"NCT1": ["stale"]}}, file)
+    assert len(tokenization.TokenCache(path)) == 0